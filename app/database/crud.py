@@ -4,8 +4,10 @@ CRUD Operations for Database
 import logging
 from typing import List, Optional, Dict
 from sqlalchemy.orm import Session
-from sqlalchemy import func, or_
-from app.database.models import Dataset, Company, DatasetAnalysis
+from functools import reduce
+from operator import add
+from sqlalchemy import func, or_, insert, case
+from app.database.models import Dataset, Company, DatasetAnalysis, SEARCH_FIELDS, search_document
 
 logger = logging.getLogger(__name__)
 
@@ -40,6 +42,14 @@ def get_dataset(db: Session, dataset_id: int) -> Optional[Dataset]:
     return db.query(Dataset).filter(Dataset.id == dataset_id).first()
 
 
+def get_datasets_by_ids(db: Session, dataset_ids) -> Dict[int, Dataset]:
+    """Get datasets by ID in one query, keyed by ID."""
+    ids = set(dataset_ids)
+    if not ids:
+        return {}
+    return {d.id: d for d in db.query(Dataset).filter(Dataset.id.in_(ids)).all()}
+
+
 def get_dataset_by_name(db: Session, name: str) -> Optional[Dataset]:
     """Get dataset by name."""
     return db.query(Dataset).filter(Dataset.name == name).first()
@@ -81,21 +91,29 @@ def delete_dataset(db: Session, dataset_id: int) -> bool:
 
 # ============ COMPANY OPERATIONS ============
 
-def bulk_create_companies(db: Session, dataset_id: int, companies_data: List[Dict]) -> int:
-    """Bulk insert companies into a dataset."""
-    companies = [
-        Company(dataset_id=dataset_id, **company_data)
-        for company_data in companies_data
-    ]
+def bulk_create_companies(
+    db: Session, dataset_id: int, companies_data: List[Dict], commit: bool = True
+) -> int:
+    """
+    Bulk insert companies into a dataset.
+    Rows are sent as a single executemany (no ORM objects are built).
+    May be called repeatedly with batches; the dataset count accumulates.
+    With commit=False the caller commits, e.g. once after its last batch.
+    """
+    if not companies_data:
+        return 0
     
-    db.bulk_save_objects(companies)
-    db.commit()
+    # New row dicts, so the caller's data is left untouched
+    rows = [{**company_data, "dataset_id": dataset_id} for company_data in companies_data]
+    db.execute(insert(Company), rows)
     
-    # Update dataset company count
-    count = len(companies)
+    # Update dataset company count (same transaction as the insert)
+    count = len(rows)
     dataset = get_dataset(db, dataset_id)
     if dataset:
-        dataset.total_companies = count
+        dataset.total_companies = (dataset.total_companies or 0) + count
+    
+    if commit:
         db.commit()
     
     logger.info(f"Inserted {count} companies into dataset {dataset_id}")
@@ -167,155 +185,110 @@ def delete_company(db: Session, company_id: int) -> bool:
 
 # ============ COMPREHENSIVE SEARCH OPERATIONS ============
 
+def search_filter(db: Session, search_term: str):
+    """
+    True when search_term ILIKE-matches any of SEARCH_FIELDS. PostgreSQL
+    matches the combined search document, which the trigram index serves;
+    elsewhere the per-field OR is cheaper, as it stops at the first match.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        return search_document().ilike(search_term)
+    return or_(*(getattr(Company, name).ilike(search_term) for name in SEARCH_FIELDS))
+
+
+def search_match_mask(search_term: str):
+    """
+    Column with bit i set when SEARCH_FIELDS[i] matches search_term, using the
+    same ILIKE as the search filter; the bits are distinct, so the sum is an OR.
+    """
+    return reduce(add, [
+        case((getattr(Company, name).ilike(search_term), 1 << i), else_=0)
+        for i, name in enumerate(SEARCH_FIELDS)
+    ]).label("match_mask")
+
+
+# Search results are plain rows of just the columns the search responses and
+# get_search_match_info read, rather than full Company instances
+SEARCH_RESULT_COLUMNS = (Company.id, Company.dataset_id) + tuple(
+    getattr(Company, name) for name in SEARCH_FIELDS
+)
+
+
+def _search_page(db: Session, search_term: str, criteria, skip: int, limit: int, with_match_mask: bool):
+    # The page's ids come from one filtered scan whose COUNT(*) OVER () (taken
+    # before OFFSET/LIMIT) gives every row the total match count; the result
+    # columns and match mask are then only built for the rows on the page
+    page = db.query(
+        Company.id.label("id"), func.count().over().label("total_count")
+    ).filter(*criteria).offset(skip).limit(limit).subquery()
+
+    columns = SEARCH_RESULT_COLUMNS + (page.c.total_count,)
+    if with_match_mask:
+        columns += (search_match_mask(search_term),)
+    return db.query(*columns).join(page, Company.id == page.c.id).all()
+
+
 def search_companies_comprehensive(
     db: Session,
     query: str,
     skip: int = 0,
-    limit: int = 500
-) -> List[Company]:
+    limit: int = 500,
+    with_match_mask: bool = True
+) -> List:
     """
     COMPREHENSIVE SEARCH: Search across ALL company fields in ALL datasets.
+    Returns rows of SEARCH_RESULT_COLUMNS plus the total_count of all matches,
+    each with a match_mask of the fields that matched (see SEARCH_FIELDS)
+    unless with_match_mask is False.
     """
     search_term = f"%{query}%"
     
-    # Build OR conditions for ALL searchable text fields
-    search_conditions = [
-        # Core fields
-        Company.business_name.ilike(search_term),
-        Company.company_number.ilike(search_term),
-        
-        # Address fields
-        Company.address_line1.ilike(search_term),
-        Company.address_line2.ilike(search_term),
-        Company.town.ilike(search_term),
-        Company.county.ilike(search_term),
-        Company.postcode.ilike(search_term),
-        
-        # PSC & Ownership fields
-        Company.person_with_significant_control.ilike(search_term),
-        Company.nature_of_control.ilike(search_term),
-        
-        # Person fields
-        Company.title.ilike(search_term),
-        Company.fname.ilike(search_term),
-        Company.sname.ilike(search_term),
-        Company.position.ilike(search_term),
-        
-        # Company details
-        Company.sic.ilike(search_term),
-        Company.company_status.ilike(search_term),
-        Company.company_type.ilike(search_term),
-        Company.date_of_creation.ilike(search_term),
-        
-        # Contact fields
-        Company.website.ilike(search_term),
-        Company.phone.ilike(search_term),
-        Company.email.ilike(search_term),
-        Company.website_address.ilike(search_term),
-        Company.address_match.ilike(search_term),
-        
-        # Enrichment explanation fields
-        Company.selected_person_source.ilike(search_term),
-        Company.selected_psc_share_tier.ilike(search_term),
-        Company.selected_psc_nature_of_control.ilike(search_term),
-    ]
-    
-    results = db.query(Company).filter(
-        or_(*search_conditions)
-    ).offset(skip).limit(limit).all()
+    results = _search_page(
+        db, search_term, [search_filter(db, search_term)], skip, limit, with_match_mask
+    )
     
     logger.info(f"Comprehensive search '{query}': {len(results)} results across ALL fields")
     return results
 
 
-def get_comprehensive_search_count(db: Session, query: str) -> int:
-    """
-    Get total count for comprehensive search across ALL fields.
-    """
-    search_term = f"%{query}%"
-    
-    search_conditions = [
-        Company.business_name.ilike(search_term),
-        Company.company_number.ilike(search_term),
-        Company.address_line1.ilike(search_term),
-        Company.address_line2.ilike(search_term),
-        Company.town.ilike(search_term),
-        Company.county.ilike(search_term),
-        Company.postcode.ilike(search_term),
-        Company.person_with_significant_control.ilike(search_term),
-        Company.nature_of_control.ilike(search_term),
-        Company.title.ilike(search_term),
-        Company.fname.ilike(search_term),
-        Company.sname.ilike(search_term),
-        Company.position.ilike(search_term),
-        Company.sic.ilike(search_term),
-        Company.company_status.ilike(search_term),
-        Company.company_type.ilike(search_term),
-        Company.date_of_creation.ilike(search_term),
-        Company.website.ilike(search_term),
-        Company.phone.ilike(search_term),
-        Company.email.ilike(search_term),
-        Company.website_address.ilike(search_term),
-        Company.address_match.ilike(search_term),
-        Company.selected_person_source.ilike(search_term),
-        Company.selected_psc_share_tier.ilike(search_term),
-        Company.selected_psc_nature_of_control.ilike(search_term),
-    ]
-    
-    return db.query(func.count(Company.id)).filter(
-        or_(*search_conditions)
-    ).scalar()
-
-
 def search_within_dataset_comprehensive(
     db: Session,
     dataset_id: int,
     query: str,
     skip: int = 0,
-    limit: int = 500
-) -> List[Company]:
+    limit: int = 500,
+    with_match_mask: bool = True
+) -> List:
     """
     Comprehensive search within a specific dataset.
+    Returns rows of SEARCH_RESULT_COLUMNS plus the total_count of all matches,
+    each with a match_mask of the fields that matched (see SEARCH_FIELDS)
+    unless with_match_mask is False.
     """
     search_term = f"%{query}%"
     
-    search_conditions = [
-        Company.business_name.ilike(search_term),
-        Company.company_number.ilike(search_term),
-        Company.address_line1.ilike(search_term),
-        Company.address_line2.ilike(search_term),
-        Company.town.ilike(search_term),
-        Company.county.ilike(search_term),
-        Company.postcode.ilike(search_term),
-        Company.person_with_significant_control.ilike(search_term),
-        Company.nature_of_control.ilike(search_term),
-        Company.title.ilike(search_term),
-        Company.fname.ilike(search_term),
-        Company.sname.ilike(search_term),
-        Company.position.ilike(search_term),
-        Company.sic.ilike(search_term),
-        Company.company_status.ilike(search_term),
-        Company.company_type.ilike(search_term),
-        Company.date_of_creation.ilike(search_term),
-        Company.website.ilike(search_term),
-        Company.phone.ilike(search_term),
-        Company.email.ilike(search_term),
-        Company.website_address.ilike(search_term),
-        Company.address_match.ilike(search_term),
-        Company.selected_person_source.ilike(search_term),
-        Company.selected_psc_share_tier.ilike(search_term),
-        Company.selected_psc_nature_of_control.ilike(search_term),
-    ]
-    
-    results = db.query(Company).filter(
-        Company.dataset_id == dataset_id,
-        or_(*search_conditions)
-    ).offset(skip).limit(limit).all()
+    results = _search_page(
+        db, search_term,
+        [Company.dataset_id == dataset_id, search_filter(db, search_term)],
+        skip, limit, with_match_mask
+    )
     
     logger.info(f"Dataset {dataset_id} search '{query}': {len(results)} results")
     return results
 
 
+def get_dataset_search_count(db: Session, dataset_id: int, query: str) -> int:
+    """
+    Get total count for comprehensive search within a specific dataset.
+    """
+    search_term = f"%{query}%"
+    
+    return db.query(func.count(Company.id)).filter(
+        Company.dataset_id == dataset_id,
+        search_filter(db, search_term)
+    ).scalar()
+
+
 # ============ ANALYSIS OPERATIONS ============
 
 def save_analysis(
@@ -2,7 +2,7 @@
 Database Connection & Session Management
 """
 import logging
-from sqlalchemy import create_engine, event
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy.pool import StaticPool
 import os
@@ -66,5 +66,15 @@ def get_db():
 def init_db():
     """Initialize database tables."""
     logger.info("Initializing database...")
-    Base.metadata.create_all(bind=engine)
+    if engine.dialect.name == "postgresql":
+        from app.database.models import company_search_trgm
+
+        # Trigram search index: the extension must exist before create_all,
+        # and the index is added separately for tables that already exist
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        Base.metadata.create_all(bind=engine)
+        company_search_trgm.create(bind=engine, checkfirst=True)
+    else:
+        Base.metadata.create_all(bind=engine)
     logger.info("✓ Database initialized")
\ No newline at end of file
@@ -1,13 +1,23 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.responses import FileResponse, HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the county alias join table once so requests only scan it
+    from app.services.county_filtering import load_alias_table
+    load_alias_table(Path("config"))
+    yield
+
+
 # Create FastAPI app
 app = FastAPI(
     docs_url=None,
-    redoc_url=None
+    redoc_url=None,
+    lifespan=lifespan
 )
 
 # --- PATHS ---
@@ -14,6 +14,7 @@ from pathlib import Path
 from typing import List, Optional
 from unittest import result
 from fastapi import APIRouter, HTTPException, BackgroundTasks, Response
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 import polars as pl
 from fastapi import UploadFile, File
@@ -21,7 +22,7 @@ import io
 from datetime import datetime
 
 from app.services.pipeline_orchestrator import (
-    execute_pipeline,
+    run_pipeline_stages,
     analyze_current_dataset,
     enrich_current_dataset,
     enrich_current_dataset_v2
@@ -35,6 +36,7 @@ class ExtractRequest(BaseModel):
     sic_codes: List[str] = Field(..., description="List of SIC codes to extract")
     counties: Optional[List[str]] = Field(None, description="Optional counties to filter")
     force_refresh: bool = Field(False, description="Force cache refresh")
+    analyze: bool = Field(False, description="Also run Stage B analysis on the result")
 
 
 class AnalyzeRequest(BaseModel):
@@ -65,11 +67,15 @@ async def extract_companies(request: ExtractRequest):
     try:
         logger.info(f"Extract request: SIC={request.sic_codes}, Counties={request.counties}")
 
-        result = execute_pipeline(
+        # Run off the event loop so one extraction doesn't stall other requests
+        stage_outputs = await run_in_threadpool(
+            run_pipeline_stages,
             sic_codes=request.sic_codes,
             counties=request.counties,
+            analyze=request.analyze,
             force_refresh=request.force_refresh
         )
+        result = stage_outputs["pipeline"]
 
         job_id = generate_job_id()
         JOBS[job_id] = {
@@ -79,7 +85,7 @@ async def extract_companies(request: ExtractRequest):
             "result": result
         }
 
-        return {
+        response = {
             "success": True,
             "job_id": job_id,
             "pipeline_state": result["pipeline_state"],
@@ -89,6 +95,9 @@ async def extract_companies(request: ExtractRequest):
             "can_analyze": result["can_analyze"],
             "can_enrich": result["can_enrich"]
         }
+        if request.analyze:
+            response["analysis"] = stage_outputs["analysis"]
+        return response
 
     except FileNotFoundError as e:
         logger.error(f"File not found: {e}")
@@ -114,7 +123,7 @@ async def analyze_dataset(request: AnalyzeRequest):
         if not Path(request.dataset_file).exists():
             raise HTTPException(status_code=404, detail="Dataset file not found")
 
-        analysis = analyze_current_dataset(request.dataset_file)
+        analysis = await run_in_threadpool(analyze_current_dataset, request.dataset_file)
 
         job_id = generate_job_id()
         JOBS[job_id] = {
@@ -383,9 +392,10 @@ async def analyze_final_dataset(file: UploadFile = File(...)):
         logger.info(f"Comparison analysis started for file: {file.filename}")
         
         # Import required functions from dataset_analysis
-        from app.services.dataset_analysis import (
+        from app.services.county_names import (
             normalize_county,
-            is_england_county,
+            normalize_county_expr,
+            NORMALIZED_ENGLAND_COUNTIES,
             ENGLAND_REGIONS
         )
         
@@ -441,11 +451,8 @@ async def analyze_final_dataset(file: UploadFile = File(...)):
         
         # Filter for England only
         england_df = df.filter(
-            pl.col(county_col)
-            .map_elements(
-                lambda x: is_england_county(str(x)) if x and str(x).strip() else False, 
-                return_dtype=pl.Boolean
-            )
+            normalize_county_expr(pl.col(county_col).cast(pl.String))
+            .is_in(list(NORMALIZED_ENGLAND_COUNTIES))
         )
         
         total_england = england_df.height
@@ -457,18 +464,16 @@ async def analyze_final_dataset(file: UploadFile = File(...)):
         if total_england > 0:
             # Get county counts
             county_counts = (
-                england_df.filter(pl.col(county_col) != "")
-                .group_by(county_col)
-                .agg(pl.count().alias("count"))
+                england_df.select(
+                    normalize_county_expr(pl.col(county_col).cast(pl.String)).alias("county")
+                )
+                .filter(pl.col("county") != "")
+                .group_by("county")
+                .len()
             )
             
-            # Convert to dict (normalized keys)
-            county_dict = {}
-            for row in county_counts.iter_rows(named=True):
-                county_name = row[county_col]
-                normalized = normalize_county(str(county_name))
-                count = int(row["count"])
-                county_dict[normalized] = count
+            # Convert to dict (keys are already normalized)
+            county_dict = dict(zip(county_counts["county"].to_list(), county_counts["len"].to_list()))
             
             logger.info(f"County distribution: {county_dict}")
             
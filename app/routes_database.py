@@ -23,8 +23,10 @@ import logging
 from pathlib import Path
 from typing import List, Optional
 from fastapi import APIRouter, HTTPException, Depends, Response, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
+import orjson
 import polars as pl
 from io import StringIO, BytesIO
 
@@ -491,11 +493,35 @@ async def get_analysis(dataset_id: int, db: Session = Depends(get_db)):
 
 # ============ SEARCH ENDPOINT ============
 
+def _stream_search_response(summary: dict, results: dict, q: str):
+    """
+    Yield the /api/search JSON body one company at a time with orjson, so the
+    response is never encoded as a whole (same document as returning the dict).
+    """
+    yield orjson.dumps(summary)[:-1] + b',"datasets":['
+
+    for i, dataset in enumerate(results["datasets"]):
+        header = {k: v for k, v in dataset.items() if k != "companies"}
+        yield (b"," if i else b"") + orjson.dumps(header)[:-1] + b',"companies":['
+        for j, company in enumerate(dataset["companies"]):
+            yield (b"," if j else b"") + orjson.dumps(company)
+        yield b"]}"
+
+    yield b'],"search_info":' + orjson.dumps({
+        "query": q,
+        "fields_searched": results.get("search_fields_covered", []),
+        "datasets_with_matches": results.get("datasets_with_matches", 0)
+    }) + b"}"
+
+
 @router.get("/api/search")
 async def search_global(
     q: str = Query(..., min_length=1, description="Search query"),
     skip: int = Query(0, ge=0),
     limit: int = Query(500, ge=1, le=2000),
+    highlight: Optional[bool] = Query(
+        None, description="Include per-field match info (defaults to first page of up to 100 rows only)"
+    ),
     db: Session = Depends(get_db)
 ):
     """
@@ -503,20 +529,21 @@ async def search_global(
     Now searches in 25+ fields including addresses, contact info, PSC details, etc.
     """
     try:
-        results = search_all_datasets(db, q, skip=skip, limit=limit)
-        
-        return {
+        if highlight is None:
+            # The UI only highlights the first page it renders
+            highlight = skip == 0 and limit <= 100
+        results = search_all_datasets(db, q, skip=skip, limit=limit, highlight=highlight)
+        summary = {
             "success": True,
             "total_matching": results["total_results"],
             "returned": results["returned_results"],
-            "datasets": results["datasets"],
-            "search_info": {
-                "query": q,
-                "fields_searched": results.get("search_fields_covered", []),
-                "datasets_with_matches": results.get("datasets_with_matches", 0)
-            }
         }
         
+        return StreamingResponse(
+            _stream_search_response(summary, results, q),
+            media_type="application/json"
+        )
+        
     except Exception as e:
         logger.error(f"Search failed: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
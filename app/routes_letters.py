@@ -1,15 +1,20 @@
 """
 Routes for letter generation functionality.
 """
-from fastapi import APIRouter, HTTPException, Query, UploadFile, File, Form, BackgroundTasks
-from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from fastapi import APIRouter, HTTPException, Query, UploadFile, File, Form, BackgroundTasks, Request
+from fastapi.responses import FileResponse, JSONResponse, Response
+from fastapi.concurrency import run_in_threadpool
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List
 from pathlib import Path
 import tempfile
 import os
-import io
+import re
 import logging
 import shutil
+import time
+import asyncio
+import aiofiles.os
 
 # Import the letter generation service
 from app.services.letter_generation import LetterGenerationService
@@ -90,6 +95,10 @@ async def generate_letters_from_upload(
         
         logger.info(f"Created temporary template file: {tmp_template_path}")
         
+        # The ZIP is streamed into this file rather than built in memory
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as tmp_output:
+            tmp_output_path = tmp_output.name
+        
         try:
             # Initialize service with user's template
             logger.info(f"Initializing service with user template: {tmp_template_path}")
@@ -98,26 +107,27 @@ async def generate_letters_from_upload(
             # Generate letters based on file type (NO LIMIT PARAMETER)
             logger.info(f"Starting letter generation for {filename}...")
             
-            if filename.endswith('.csv'):
-                result = service.generate_from_csv(tmp_path, mode, letters_per_file)
-            else:  # Excel
-                result = service.generate_from_excel(tmp_path, mode, letters_per_file)
+            with open(tmp_output_path, 'wb') as output_stream:
+                if filename.endswith('.csv'):
+                    result = service.generate_from_csv(tmp_path, mode, letters_per_file, output_stream)
+                else:  # Excel
+                    result = service.generate_from_excel(tmp_path, mode, letters_per_file, output_stream)
             
             logger.info(f"Letter generation completed. Total letters: {result.get('total_letters', 0)}")
             
-            # Schedule cleanup of temp files
-            background_tasks.add_task(cleanup_temp_files, [tmp_path, tmp_template_path])
+            # Schedule cleanup of temp files (runs after the response is sent)
+            background_tasks.add_task(cleanup_temp_files, [tmp_path, tmp_template_path, tmp_output_path])
             
             # Check if there's an error
             if "error" in result:
                 logger.error(f"Letter generation error: {result['error']}")
                 return JSONResponse(content={"error": result["error"]}, status_code=400)
             
-            # Return file as streaming response
+            # Return the streamed ZIP straight from disk
             logger.info(f"Returning file: {result['filename']} ({result.get('content_type', 'application/zip')})")
             
-            return StreamingResponse(
-                io.BytesIO(result["content"]),
+            return FileResponse(
+                tmp_output_path,
                 media_type=result.get("content_type", "application/zip"),
                 headers={
                     "Content-Disposition": f"attachment; filename={result['filename']}",
@@ -129,7 +139,7 @@ async def generate_letters_from_upload(
         except Exception as e:
             logger.error(f"Letter generation failed: {str(e)}", exc_info=True)
             # Clean up temp files on error
-            cleanup_temp_files_sync([tmp_path, tmp_template_path])
+            cleanup_temp_files_sync([tmp_path, tmp_template_path, tmp_output_path])
             raise HTTPException(500, f"Letter generation failed: {str(e)}")
             
     except HTTPException:
@@ -173,17 +183,24 @@ async def generate_letters_from_dataset(
         raise HTTPException(500, f"Dataset letter generation failed: {str(e)}")
 
 @router.get("/download/{filename}")
-async def download_letters(filename: str):
+async def download_letters(filename: str, request: Request):
     """
     Download generated letters.
+    Honors If-None-Match so repeat downloads of an unchanged file return 304.
     """
     try:
         file_path = Path("outputs/letters") / filename
         
-        if not file_path.exists():
+        try:
+            st = await aiofiles.os.stat(file_path)
+        except FileNotFoundError:
             logger.warning(f"File not found: {file_path}")
             raise HTTPException(404, "File not found")
         
+        etag = file_etag(st)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        
         # Determine content type
         if filename.endswith('.docx'):
             media_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
@@ -197,7 +214,8 @@ async def download_letters(filename: str):
         return FileResponse(
             path=file_path,
             filename=filename,
-            media_type=media_type
+            media_type=media_type,
+            headers={"ETag": etag, "Cache-Control": "private, max-age=60"}
         )
     except HTTPException:
         raise
@@ -206,25 +224,32 @@ async def download_letters(filename: str):
         raise HTTPException(500, f"Error downloading file: {str(e)}")
 
 @router.get("/template")
-async def download_template():
+async def download_template(request: Request):
     """
     Download a sample letter template for reference.
     This is just an example - users should upload their own templates.
+    Honors If-None-Match so repeat downloads return 304.
     """
     try:
         # Look for an example template
-        example_template_path = find_example_template()
+        example_template_path = await asyncio.to_thread(find_example_template)
         
-        if not example_template_path or not os.path.exists(example_template_path):
+        if not example_template_path:
             logger.error("Example template not found")
             raise HTTPException(404, "Example template not found. Please use your own .docx template.")
         
+        st = await aiofiles.os.stat(example_template_path)
+        etag = file_etag(st)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        
         logger.info(f"Serving example template: {example_template_path}")
         
         return FileResponse(
             path=example_template_path,
             filename="example_letter_template.docx",
-            media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+            media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+            headers={"ETag": etag, "Cache-Control": "private, max-age=60"}
         )
     except HTTPException:
         raise
@@ -277,37 +302,7 @@ async def cleanup_old_letters(days_old: int = 7):
     Clean up old generated letter files.
     """
     try:
-        import time
-        from datetime import datetime, timedelta
-        
-        letters_dir = Path("outputs/letters")
-        if not letters_dir.exists():
-            logger.info("No letters directory found")
-            return {"success": True, "message": "No letters directory found"}
-        
-        cutoff_time = time.time() - (days_old * 86400)
-        deleted_count = 0
-        deleted_files = []
-        
-        for file_path in letters_dir.iterdir():
-            if file_path.is_file():
-                if file_path.stat().st_mtime < cutoff_time:
-                    try:
-                        file_path.unlink()
-                        deleted_count += 1
-                        deleted_files.append(file_path.name)
-                        logger.info(f"Deleted old file: {file_path.name}")
-                    except Exception as e:
-                        logger.warning(f"Failed to delete {file_path.name}: {str(e)}")
-        
-        logger.info(f"Cleaned up {deleted_count} files older than {days_old} days")
-        
-        return {
-            "success": True, 
-            "message": f"Cleaned up {deleted_count} files older than {days_old} days",
-            "deleted_count": deleted_count,
-            "deleted_files": deleted_files
-        }
+        return await run_in_threadpool(_do_cleanup, days_old)
     except Exception as e:
         logger.error(f"Cleanup failed: {str(e)}", exc_info=True)
         raise HTTPException(500, f"Cleanup failed: {str(e)}")
@@ -318,30 +313,7 @@ async def get_recent_letters(limit: int = Query(10, ge=1, le=50)):
     Get recently generated letters.
     """
     try:
-        letters_dir = Path("outputs/letters")
-        
-        if not letters_dir.exists():
-            logger.info("No letters directory found")
-            return {"files": []}
-        
-        # Get all files, sort by modification time
-        files = []
-        for file_path in letters_dir.iterdir():
-            if file_path.is_file():
-                files.append({
-                    "filename": file_path.name,
-                    "path": str(file_path),
-                    "size": file_path.stat().st_size,
-                    "modified": file_path.stat().st_mtime,
-                    "file_type": "docx" if file_path.suffix == ".docx" else "zip",
-                    "download_url": f"/api/letters/download/{file_path.name}"
-                })
-        
-        # Sort by modification time (newest first)
-        files.sort(key=lambda x: x["modified"], reverse=True)
-        
-        # Limit results
-        files = files[:limit]
+        files = await asyncio.to_thread(_collect_recent, Path("outputs/letters"), limit)
         
         logger.info(f"Returning {len(files)} recent files")
         return {"files": files}
@@ -356,21 +328,7 @@ async def get_letter_generation_status():
     Get status of letter generation system.
     """
     try:
-        example_template_path = find_example_template()
-        letters_dir = Path("outputs/letters")
-        
-        status = {
-            "example_template_available": example_template_path is not None and os.path.exists(example_template_path),
-            "example_template_path": example_template_path,
-            "note": "Users must upload their own .docx template for letter generation",
-            "outputs_dir_exists": letters_dir.exists(),
-            "outputs_dir": str(letters_dir),
-        }
-        
-        if letters_dir.exists():
-            files = list(letters_dir.iterdir())
-            status["total_files"] = len(files)
-            status["total_size_bytes"] = sum(f.stat().st_size for f in files if f.is_file())
+        status = await asyncio.to_thread(_collect_status)
         
         return status
         
@@ -380,6 +338,26 @@ async def get_letter_generation_status():
 
 # ================= HELPER FUNCTIONS =================
 
+def file_etag(st: os.stat_result) -> str:
+    """Build a strong ETag from a file's size and modification time."""
+    return f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+# One entity-tag (optionally weak), or "*", from an If-None-Match list
+_ETAG_LIST_RE = re.compile(r'(?:W/)?"[^"]*"|\*')
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    If-None-Match check per RFC 9110 13.1.2: true for "*" or when any tag in the
+    comma-separated list matches etag under weak comparison (W/ ignored).
+    """
+    if not if_none_match:
+        return False
+    opaque = etag.removeprefix("W/")
+    return any(
+        tag == "*" or tag.removeprefix("W/") == opaque
+        for tag in _ETAG_LIST_RE.findall(if_none_match)
+    )
+
 def find_example_template() -> Optional[str]:
     """Find an example letter template (for download reference only)."""
     app_dir = Path(__file__).resolve().parent
@@ -393,16 +371,131 @@ def find_example_template() -> Optional[str]:
     logger.info(f"Searching for example template in {len(possible_paths)} locations...")
     
     for path in possible_paths:
-        path_str = str(path)
-        if os.path.exists(path_str):
-            logger.info(f"✓ Found example template at: {path_str}")
-            return path_str
-        else:
-            logger.debug(f"✗ Not found: {path_str}")
+        try:
+            path.stat()
+        except OSError:
+            # Missing, unreadable or a broken path: try the next location
+            logger.debug(f"✗ Not found: {path}")
+            continue
+        logger.info(f"✓ Found example template at: {path}")
+        return str(path)
     
     logger.warning("No example template found - users must upload their own")
     return None
 
+def _collect_recent(letters_dir: Path, limit: int) -> list:
+    """
+    Scan the letters directory and return the newest files (runs in a worker thread).
+    """
+    if not letters_dir.exists():
+        logger.info("No letters directory found")
+        return []
+    
+    # Get all files, sort by modification time
+    files = []
+    with os.scandir(letters_dir) as entries:
+        for entry in entries:
+            if entry.is_file():
+                st = entry.stat()
+                files.append({
+                    "filename": entry.name,
+                    "path": str(letters_dir / entry.name),
+                    "size": st.st_size,
+                    "modified": st.st_mtime,
+                    "file_type": "docx" if entry.name.endswith(".docx") else "zip",
+                    "download_url": f"/api/letters/download/{entry.name}"
+                })
+    
+    # Sort by modification time (newest first)
+    files.sort(key=lambda x: x["modified"], reverse=True)
+    
+    # Limit results
+    return files[:limit]
+
+def _collect_status() -> dict:
+    """
+    Gather letter generation status from the filesystem (runs in a worker thread).
+    """
+    example_template_path = find_example_template()
+    letters_dir = Path("outputs/letters")
+    outputs_dir_exists = letters_dir.exists()
+    
+    status = {
+        "example_template_available": example_template_path is not None,
+        "example_template_path": example_template_path,
+        "note": "Users must upload their own .docx template for letter generation",
+        "outputs_dir_exists": outputs_dir_exists,
+        "outputs_dir": str(letters_dir),
+    }
+    
+    if outputs_dir_exists:
+        total_files = 0
+        total_size = 0
+        with os.scandir(letters_dir) as entries:
+            for entry in entries:
+                total_files += 1
+                if entry.is_file():
+                    total_size += entry.stat().st_size
+        status["total_files"] = total_files
+        status["total_size_bytes"] = total_size
+    
+    return status
+
+def _try_unlink(path: str) -> tuple:
+    """
+    Delete a single file.
+
+    Returns:
+        (name, ok, error) - error is None when the delete succeeded
+    """
+    name = os.path.basename(path)
+    try:
+        os.unlink(path)
+        return name, True, None
+    except Exception as e:
+        return name, False, str(e)
+
+def _do_cleanup(days_old: int) -> dict:
+    """
+    Delete letter files older than days_old (runs in a worker thread).
+
+    Eligible files are collected in a single os.scandir pass, then the
+    unlinks are fanned out over a thread pool so their latencies overlap.
+    """
+    letters_dir = Path("outputs/letters")
+    if not letters_dir.exists():
+        logger.info("No letters directory found")
+        return {"success": True, "message": "No letters directory found"}
+    
+    cutoff_time = time.time() - (days_old * 86400)
+    
+    with os.scandir(letters_dir) as entries:
+        paths = [
+            entry.path for entry in entries
+            if entry.is_file() and entry.stat().st_mtime < cutoff_time
+        ]
+    
+    with ThreadPoolExecutor(max_workers=16) as ex:
+        results = list(ex.map(_try_unlink, paths))
+    
+    deleted_files = []
+    for name, ok, err in results:
+        if ok:
+            deleted_files.append(name)
+            logger.info(f"Deleted old file: {name}")
+        else:
+            logger.warning(f"Failed to delete {name}: {err}")
+    deleted_count = len(deleted_files)
+    
+    logger.info(f"Cleaned up {deleted_count} files older than {days_old} days")
+    
+    return {
+        "success": True, 
+        "message": f"Cleaned up {deleted_count} files older than {days_old} days",
+        "deleted_count": deleted_count,
+        "deleted_files": deleted_files
+    }
+
 def cleanup_temp_files(file_paths: list):
     """
     Background task to clean up temporary files.
@@ -8,16 +8,22 @@ LOGIC:
 NO POSTCODE MAPPING - CSV County field only
 """
 
-import re
+import os
 import json
 import pickle
 import hashlib
 import logging
+import tempfile
+import threading
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import Callable, Iterable, List, Dict, Optional, Tuple
 from datetime import datetime
+import orjson
 import polars as pl
-from functools import wraps
+import pyarrow as pa
+import pyarrow.parquet as pq
+from functools import wraps, lru_cache
+from app.services.county_names import normalize_county, normalize_county_expr
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +31,15 @@ logger = logging.getLogger(__name__)
 COUNTY_OUTPUT_DIR = Path("outputs/county_filtered")
 COUNTY_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
+# zstd level for county-filtered parquet. Outputs are written once and scanned
+# many times by analysis, so the default favours size; lower to 1-3 when the
+# consumer is local and write CPU matters
+_OUT_COMPRESSION_LEVEL = int(os.getenv("COUNTY_PARQUET_ZSTD_LEVEL", "9"))
+_OUT_ROW_GROUP_SIZE = 100_000
+
+# Precomputed alias join table, written next to county_aliases.json
+ALIAS_TABLE_FILE = "aliases.parquet"
+
 # ============ UTILITIES ============
 def track_performance(func):
     @wraps(func)
@@ -38,45 +53,64 @@ def track_performance(func):
     return wrapper
 
 
-def normalize_county(name: str) -> str:
-    """
-    Normalize county name to canonical form.
-    This is the SINGLE SOURCE OF TRUTH for county name normalization.
-    """
-    if not name or not isinstance(name, str):
-        return ""
-    
-    s = name.strip().lower()
-    
-    # Special case: London variants
-    if "london" in s:
-        return "Greater London"
-    
-    # Remove common suffixes
-    s = re.sub(
-        r"\s+(county|unitary|borough|city|metropolitan|royal|district|council|region)$",
-        "",
-        s,
-        flags=re.I,
-    )
-    
-    # Title case for consistency
-    return s.strip().title()
+@lru_cache(maxsize=4)
+def _load_county_aliases_cached(path: str, mtime: float) -> Dict[str, str]:
+    """Parse and normalize an aliases file; keyed on mtime so edits are picked up."""
+    with open(path, "r") as f:
+        raw = json.load(f)
+        return {normalize_county(k): normalize_county(v) for k, v in raw.items()}
 
 
 def load_county_aliases(config_dir: Path) -> Dict[str, str]:
-    """Load county aliases from config file."""
+    """Load county aliases from config file (memoized per file version)."""
     path = config_dir / "county_aliases.json"
-    if path.exists():
-        try:
-            with open(path, "r") as f:
-                raw = json.load(f)
-                return {normalize_county(k): normalize_county(v) for k, v in raw.items()}
-        except Exception as e:
-            logger.warning(f"Failed to load county aliases: {e}")
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return {}
+    try:
+        return _load_county_aliases_cached(str(path), mtime)
+    except Exception as e:
+        logger.warning(f"Failed to load county aliases: {e}")
     return {}
 
 
+def load_alias_table(config_dir: Path) -> Optional[pl.LazyFrame]:
+    """
+    Alias lookup table (raw -> canonical, both normalized) as a LazyFrame.
+
+    Backed by a sidecar parquet next to county_aliases.json, rebuilt whenever
+    the JSON is newer. Returns None when no aliases are configured.
+    """
+    json_path = config_dir / "county_aliases.json"
+    table_path = config_dir / ALIAS_TABLE_FILE
+    try:
+        json_mtime = json_path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+    try:
+        if table_path.stat().st_mtime >= json_mtime:
+            return pl.scan_parquet(table_path)
+    except FileNotFoundError:
+        pass
+
+    aliases = load_county_aliases(config_dir)
+    if not aliases:
+        return None
+
+    alias_df = pl.DataFrame(
+        {"raw": list(aliases.keys()), "canonical": list(aliases.values())},
+        schema={"raw": pl.String, "canonical": pl.String},
+    )
+    try:
+        alias_df.write_parquet(table_path)
+        logger.info(f"Built county alias table: {table_path}")
+    except OSError as e:
+        logger.warning(f"Could not write county alias table: {e}")
+    return alias_df.lazy()
+
+
 def map_to_canonical(name: str, aliases: Dict[str, str]) -> str:
     """Map county name to canonical form using aliases."""
     norm = normalize_county(name)
@@ -94,6 +128,104 @@ def generate_hash(base: str, counties: Optional[List[str]]) -> str:
     return hashlib.md5(key.encode()).hexdigest()[:12]
 
 
+# One lock per output hash, so concurrent requests for the same filter wait
+# for the first write and then reuse it rather than writing the file twice
+_OUTPUT_LOCKS: Dict[str, threading.Lock] = {}
+_OUTPUT_LOCKS_GUARD = threading.Lock()
+
+
+def _output_lock(out_hash: str) -> threading.Lock:
+    with _OUTPUT_LOCKS_GUARD:
+        return _OUTPUT_LOCKS.setdefault(out_hash, threading.Lock())
+
+
+def _temp_path(target: Path) -> Path:
+    """Unique temp file beside target, for writing before os.replace."""
+    fd, name = tempfile.mkstemp(dir=target.parent, prefix=target.name + ".", suffix=".tmp")
+    os.close(fd)
+    # mkstemp creates the file 0600; published outputs keep the usual mode
+    os.chmod(name, 0o644)
+    return Path(name)
+
+
+def _with_normalized_county(lf: pl.LazyFrame, alias_lf: Optional[pl.LazyFrame]) -> pl.LazyFrame:
+    """Add NormalizedCounty (normalized CSV County, mapped through the alias table)."""
+    plan = lf.with_columns(
+        normalize_county_expr(pl.col("County")).alias("NormalizedCounty")
+    )
+
+    # Aliases are applied as a hash join on the precomputed lookup table
+    if alias_lf is not None:
+        plan = (
+            plan.join(alias_lf, left_on="NormalizedCounty", right_on="raw", how="left")
+            .with_columns(
+                pl.coalesce(["canonical", "NormalizedCounty"]).alias("NormalizedCounty")
+            )
+            .drop("canonical")
+        )
+    return plan
+
+
+def _county_match(normalized_targets: set) -> pl.Expr:
+    """Must have county in CSV AND match one of the targets."""
+    return (
+        (pl.col("NormalizedCounty") != "") &
+        (pl.col("NormalizedCounty").is_in(list(normalized_targets)))
+    )
+
+
+def _county_stats(
+    filtered: bool, total_rows: int, after_filter: int, companies_with_county: int
+) -> Dict[str, int]:
+    """Stage C stats as stored in the output metadata."""
+    stats = {
+        "total_rows": int(total_rows),
+        "before_filter": int(total_rows),
+        "after_filter": int(after_filter),
+        "total_companies": int(after_filter),  # For frontend compatibility
+        "companies_with_explicit_county": int(companies_with_county),
+    }
+    if not filtered:
+        stats["companies_without_county"] = int(total_rows - companies_with_county)
+    return stats
+
+
+def _publish_output(
+    sic_extract_file: str,
+    counties: Optional[List[str]],
+    stats: Dict[str, int],
+    tmp_output: Path,
+    output_file: Path,
+    meta_file: Path,
+) -> Dict[str, any]:
+    """Write the metadata and move both files into place."""
+    # ============ WRITE METADATA ============
+    metadata = {
+        "input_file": sic_extract_file,
+        "output_file": str(output_file),
+        "filter_applied": bool(counties),
+        "counties_requested": counties,
+        "counties_normalized": list({normalize_county(c) for c in counties}) if counties else None,
+        "timestamp": datetime.now(),
+        "stats": stats
+    }
+
+    tmp_meta = _temp_path(meta_file)
+    tmp_meta.write_bytes(orjson.dumps(metadata, option=orjson.OPT_INDENT_2))
+    os.replace(tmp_output, output_file)
+    os.replace(tmp_meta, meta_file)
+
+    logger.info(f"Output written: {output_file}")
+    logger.info(f"Final rows: {stats['after_filter']:,}")
+
+    return {
+        "output_file": str(output_file),
+        "metadata_file": str(meta_file),
+        "stats": stats,
+        "from_cache": False,
+    }
+
+
 # ============ CORE ============
 @track_performance
 def resolve_and_filter_by_county(
@@ -104,124 +236,243 @@ def resolve_and_filter_by_county(
     config_dir: Path,
     force_refresh: bool = False,
 ) -> Dict[str, any]:
+    """
+    Filter a SIC extract by explicit CSV county (or return all companies).
+
+    Output parquet uses zstd at COUNTY_PARQUET_ZSTD_LEVEL (env, default 9),
+    with row-group statistics so later scans can skip row groups.
+    Results are cached by (extract, counties) hash; a cached output is reused
+    unless force_refresh is set or the extract/aliases changed since it was written.
+    """
 
     if not Path(sic_extract_file).exists():
         raise FileNotFoundError(f"SIC extract not found: {sic_extract_file}")
 
-    aliases = load_county_aliases(config_dir)
+    # ============ OUTPUT PATHS ============
+    base_hash = Path(sic_extract_file).stem
+    out_hash = generate_hash(base_hash, counties)
 
-    df = pl.read_parquet(sic_extract_file)
-    total_rows = df.height
-    if total_rows == 0:
-        raise ValueError("Empty SIC extract")
-
-    for col in ["CompanyNumber", "Postcode", "County"]:
-        if col not in df.columns:
-            raise ValueError(f"Missing required column '{col}' in SIC extract")
-
-    # ============ PREPARE COLUMNS ============
-    df = df.with_columns([
-        pl.col("County").fill_null("").alias("County"),
-    ])
-
-    # ============ SIMPLE LOGIC: FILTER OR RETURN ALL ============
-    if counties:
-        # ===== FILTER MODE: ONLY USE EXPLICIT CSV COUNTIES =====
-        logger.info(f"FILTER MODE: Filtering by counties: {counties}")
-        logger.info("Using ONLY explicit CSV County field")
-        
-        # Normalize user-provided counties
-        normalized_targets = {normalize_county(c) for c in counties}
-        logger.info(f"Normalized filter targets: {normalized_targets}")
-        
-        before_filter = df.height
+    output_file = COUNTY_OUTPUT_DIR / f"{out_hash}.parquet"
+    meta_file = COUNTY_OUTPUT_DIR / f"{out_hash}_meta.json"
+
+    with _output_lock(out_hash):
+        # ============ CACHE CHECK ============
+        if not force_refresh and output_file.exists() and meta_file.exists():
+            aliases_file = config_dir / "county_aliases.json"
+            source_mtime = max(
+                Path(sic_extract_file).stat().st_mtime,
+                aliases_file.stat().st_mtime if aliases_file.exists() else 0,
+            )
+            if output_file.stat().st_mtime >= source_mtime:
+                cached_meta = orjson.loads(meta_file.read_bytes())
+                logger.info(f"Using cached county output: {output_file}")
+                return {
+                    "output_file": str(output_file),
+                    "metadata_file": str(meta_file),
+                    "stats": cached_meta["stats"],
+                    "from_cache": True,
+                }
+
+        # Validate from the Parquet footer before decoding any column data
+        parquet_meta = pq.read_metadata(sic_extract_file)
+        total_rows = parquet_meta.num_rows
+        if total_rows == 0:
+            raise ValueError("Empty SIC extract")
+
+        schema_names = parquet_meta.schema.names
+        for col in ["CompanyNumber", "Postcode", "County"]:
+            if col not in schema_names:
+                raise ValueError(f"Missing required column '{col}' in SIC extract")
+
+        lf = pl.scan_parquet(sic_extract_file)
+
+        # ============ PREPARE COLUMNS ============
+        # Nulls are kept as-is; predicates treat null and "" alike
+        has_county = pl.col("County").is_not_null() & (pl.col("County") != "")
+
+        # One lazy plan: normalization and filter are streamed straight to parquet
+        plan = _with_normalized_county(lf, load_alias_table(config_dir))
+
+        # Written to a temp file and published with os.replace below, so no
+        # reader (or cache check) ever sees a half-written output
+        tmp_output = _temp_path(output_file)
+
+        def sink_output(out_plan: pl.LazyFrame) -> int:
+            # Stream the plan to disk row-group at a time; the row count comes
+            # from the written footer so the output is never re-read for it.
+            # NormalizedCounty has a few dozen distinct values, so it is written as
+            # Categorical (dictionary-encoded in parquet)
+            try:
+                out_plan.with_columns(
+                    pl.col("NormalizedCounty").cast(pl.Categorical)
+                ).sink_parquet(
+                    tmp_output,
+                    compression="zstd",
+                    compression_level=_OUT_COMPRESSION_LEVEL,
+                    statistics=True,
+                    row_group_size=_OUT_ROW_GROUP_SIZE,
+                )
+            except BaseException:
+                tmp_output.unlink(missing_ok=True)
+                raise
+            return pq.read_metadata(tmp_output).num_rows
+
+        # ============ SIMPLE LOGIC: FILTER OR RETURN ALL ============
+        if counties:
+            # ===== FILTER MODE: ONLY USE EXPLICIT CSV COUNTIES =====
+            logger.info(f"FILTER MODE: Filtering by counties: {counties}")
+            logger.info("Using ONLY explicit CSV County field")
         
-        # Normalize the CSV County field and filter
-        df = df.with_columns(
-            pl.col("County").map_elements(
-                lambda x: map_to_canonical(x, aliases), 
-                return_dtype=pl.String
-            ).alias("NormalizedCounty")
-        )
+            # Normalize user-provided counties
+            normalized_targets = {normalize_county(c) for c in counties}
+            logger.info(f"Normalized filter targets: {normalized_targets}")
         
-        # Filter: must have county in CSV AND match one of the targets
-        df = df.filter(
-            (pl.col("NormalizedCounty") != "") &
-            (pl.col("NormalizedCounty").is_in(list(normalized_targets)))
-        )
+            before_filter = total_rows
         
-        after_filter = df.height
-        companies_with_county = (df["County"] != "").sum()
+            # Filter: must have county in CSV AND match one of the targets
+            after_filter = sink_output(plan.filter(_county_match(normalized_targets)))
+            # A non-empty NormalizedCounty implies a non-empty CSV County
+            companies_with_county = after_filter
         
-        logger.info(f"Filtered: {before_filter:,} → {after_filter:,} companies")
-        logger.info(f"All {after_filter:,} companies had explicit county in CSV")
+            logger.info(f"Filtered: {before_filter:,} → {after_filter:,} companies")
+            logger.info(f"All {after_filter:,} companies had explicit county in CSV")
         
-        # Stats for metadata
-        stats = {
-            "total_rows": int(total_rows),
-            "before_filter": int(before_filter),
-            "after_filter": int(after_filter),
-            "total_companies": int(after_filter),  # For frontend compatibility
-            "companies_with_explicit_county": int(companies_with_county),
-        }
+            # Stats for metadata
+            stats = _county_stats(True, total_rows, after_filter, companies_with_county)
         
-    else:
-        # ===== NO FILTER MODE: RETURN ALL COMPANIES =====
-        logger.info("NO FILTER MODE: Returning all companies")
+        else:
+            # ===== NO FILTER MODE: RETURN ALL COMPANIES =====
+            logger.info("NO FILTER MODE: Returning all companies")
         
-        companies_with_county = (df["County"] != "").sum()
-        companies_without_county = total_rows - companies_with_county
+            # Normalized county column is kept for consistency
+            sink_output(plan)
+            companies_with_county = int(
+                pl.scan_parquet(tmp_output).select(has_county.sum()).collect().item() or 0
+            )
+            companies_without_county = total_rows - companies_with_county
         
-        logger.info(f"Total companies: {total_rows:,}")
-        logger.info(f"  - With county: {companies_with_county:,}")
-        logger.info(f"  - Without county: {companies_without_county:,}")
+            logger.info(f"Total companies: {total_rows:,}")
+            logger.info(f"  - With county: {companies_with_county:,}")
+            logger.info(f"  - Without county: {companies_without_county:,}")
         
-        # Add normalized county column for consistency
-        df = df.with_columns(
-            pl.col("County").map_elements(
-                lambda x: map_to_canonical(x, aliases) if x else "", 
-                return_dtype=pl.String
-            ).alias("NormalizedCounty")
+            # Stats for metadata
+            stats = _county_stats(False, total_rows, total_rows, companies_with_county)
+
+        return _publish_output(
+            sic_extract_file, counties, stats, tmp_output, output_file, meta_file
         )
-        
-        # Stats for metadata
-        stats = {
-            "total_rows": int(total_rows),
-            "before_filter": int(total_rows),
-            "after_filter": int(total_rows),
-            "total_companies": int(total_rows),  # For frontend compatibility
-            "companies_with_explicit_county": int(companies_with_county),
-            "companies_without_county": int(companies_without_county),
-        }
-
-    # ============ WRITE OUTPUT ============
+
+
+
+# ============ STREAMED EXTRACT ============
+def county_batch_filter(
+    counties: Optional[List[str]],
+    config_dir: Path,
+) -> Callable[[pl.DataFrame], Tuple[pa.Table, int]]:
+    """
+    Stage C for one batch of extract rows, for use while Stage A is streaming.
+
+    The returned function gives the batch's output rows as an Arrow table for
+    write_county_batches, and how many of the batch's rows have a CSV county.
+    """
+    normalized_targets = {normalize_county(c) for c in counties} if counties else None
+
+    # The alias table is read once and joined against every batch
+    alias_lf = load_alias_table(config_dir)
+    if alias_lf is not None:
+        alias_lf = alias_lf.collect().lazy()
+
+    has_county = pl.col("County").is_not_null() & (pl.col("County") != "")
+
+    def filter_batch(rows: pl.DataFrame) -> Tuple[pa.Table, int]:
+        plan = _with_normalized_county(rows.lazy(), alias_lf)
+        if counties:
+            plan = plan.filter(_county_match(normalized_targets))
+        out = plan.with_columns(pl.col("NormalizedCounty").cast(pl.Categorical)).collect()
+        return out.to_arrow(), int(rows.select(has_county.sum()).item() or 0)
+
+    return filter_batch
+
+
+@track_performance
+def write_county_batches(
+    batches: Iterable[Tuple[int, pa.Table, int]],
+    sic_extract_file: str,
+    counties: Optional[List[str]],
+) -> Dict[str, any]:
+    """
+    Write Stage C's output from batches filtered by county_batch_filter.
+
+    batches are (extract_rows, output_table, rows_with_county) in extract
+    order. Gives the same output, metadata and stats as
+    resolve_and_filter_by_county on that extract, without reading it. Only
+    used for a fresh extract, so there is no cache check. The output is
+    published once the batches run out, which the caller must arrange to be
+    after the extract is in place so the output stays newer than it.
+    """
     base_hash = Path(sic_extract_file).stem
     out_hash = generate_hash(base_hash, counties)
 
     output_file = COUNTY_OUTPUT_DIR / f"{out_hash}.parquet"
     meta_file = COUNTY_OUTPUT_DIR / f"{out_hash}_meta.json"
 
-    df.write_parquet(output_file, compression="zstd")
+    with _output_lock(out_hash):
+        tmp_output = _temp_path(output_file)
+        writer: Optional[pq.ParquetWriter] = None
 
-    metadata = {
-        "input_file": sic_extract_file,
-        "output_file": str(output_file),
-        "filter_applied": bool(counties),
-        "counties_requested": counties,
-        "counties_normalized": list(normalized_targets) if counties else None,
-        "timestamp": datetime.now().isoformat(),
-        "stats": stats
-    }
+        def write(table: pa.Table) -> None:
+            nonlocal writer
+            # Each batch brings its own NormalizedCounty dictionary; one per
+            # row group keeps the column dictionary-encoded, which Polars
+            # needs to read it back as Categorical
+            table = table.unify_dictionaries()
+            if writer is None:
+                writer = pq.ParquetWriter(
+                    tmp_output,
+                    table.schema,
+                    compression="zstd",
+                    compression_level=_OUT_COMPRESSION_LEVEL,
+                    write_statistics=True,
+                )
+            writer.write_table(table, row_group_size=_OUT_ROW_GROUP_SIZE)
 
-    with open(meta_file, "w") as f:
-        json.dump(metadata, f, indent=2)
+        total_rows = after_filter = companies_with_county = 0
+        pending: List[pa.Table] = []
+        try:
+            for extract_rows, table, with_county in batches:
+                total_rows += extract_rows
+                after_filter += table.num_rows
+                companies_with_county += with_county
+                pending.append(table)
 
-    logger.info(f"Output written: {output_file}")
-    logger.info(f"Final rows: {stats['after_filter']:,}")
+                # Only whole row groups are written until the last batch, so
+                # the layout matches sink_parquet's
+                buffered = sum(t.num_rows for t in pending)
+                if buffered >= _OUT_ROW_GROUP_SIZE:
+                    combined = pa.concat_tables(pending)
+                    cut = buffered - buffered % _OUT_ROW_GROUP_SIZE
+                    write(combined.slice(0, cut))
+                    pending = [combined.slice(cut)]
 
-    return {
-        "output_file": str(output_file),
-        "metadata_file": str(meta_file),
-        "stats": stats,
-        "from_cache": False,
-    }
\ No newline at end of file
+            if total_rows == 0:
+                raise ValueError("Empty SIC extract")
+            if writer is None or any(t.num_rows for t in pending):
+                write(pa.concat_tables(pending))
+            writer.close()
+        except BaseException:
+            if writer is not None:
+                writer.close()
+            tmp_output.unlink(missing_ok=True)
+            raise
+
+        if counties:
+            # A non-empty NormalizedCounty implies a non-empty CSV County
+            companies_with_county = after_filter
+            logger.info(f"Filtered: {total_rows:,} → {after_filter:,} companies")
+        else:
+            logger.info(f"Total companies: {total_rows:,}")
+
+        stats = _county_stats(bool(counties), total_rows, after_filter, companies_with_county)
+        return _publish_output(
+            sic_extract_file, counties, stats, tmp_output, output_file, meta_file
+        )
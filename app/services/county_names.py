@@ -0,0 +1,112 @@
+"""
+County Names: shared county normalization and England region lookups
+
+Used by Script B (analysis) and Script C (county filtering) so both normalize
+county names identically. Lookup tables are precomputed once at import.
+"""
+
+import re
+import polars as pl
+
+# ============ ENGLAND REGIONS CONFIGURATION ============
+ENGLAND_REGIONS = {
+    "North West": {
+        "code": "NW",
+        "counties": ["Cheshire", "Cumbria", "Greater Manchester", "Lancashire", "Merseyside"]
+    },
+    "North East": {
+        "code": "NE",
+        "counties": ["County Durham", "Northumberland", "Tyne and Wear"]
+    },
+    "West Midlands": {
+        "code": "WM",
+        "counties": ["Herefordshire", "Shropshire", "Staffordshire", "Warwickshire", "West Midlands", "Worcestershire"]
+    },
+    "East Midlands": {
+        "code": "EM",
+        "counties": ["Derbyshire", "Leicestershire", "Lincolnshire", "Northamptonshire", "Nottinghamshire", "Rutland"]
+    },
+    "East": {
+        "code": "E",
+        "counties": ["Bedfordshire", "Cambridgeshire", "Essex", "Hertfordshire", "Norfolk", "Suffolk"]
+    },
+    "South West": {
+        "code": "SW",
+        "counties": ["Bristol", "Cornwall", "Devon", "Dorset", "Gloucestershire", "Somerset", "Wiltshire"]
+    },
+    "South East": {
+        "code": "SE",
+        "counties": ["Berkshire", "Buckinghamshire", "East Sussex", "Hampshire", "Isle of Wight", "Kent", "Oxfordshire", "Surrey", "West Sussex"]
+    },
+    "London": {
+        "code": "L",
+        "counties": ["Greater London"]
+    }
+}
+
+# Suffixes stripped from county names during normalization (input is lower-cased)
+COUNTY_SUFFIX_PATTERN = r"\s+(county|unitary|borough|city|metropolitan|royal|district|council|region)$"
+_COUNTY_SUFFIX_RE = re.compile(COUNTY_SUFFIX_PATTERN, re.IGNORECASE)
+
+
+# ============ NORMALIZATION ============
+def normalize_county(name: str) -> str:
+    """
+    Normalize county name to canonical form.
+    This is the SINGLE SOURCE OF TRUTH for county name normalization.
+    """
+    if not name or not isinstance(name, str):
+        return ""
+    
+    s = name.strip().lower()
+    
+    # Special case: London variants (City of London and Greater London both map to Greater London)
+    if "london" in s:
+        return "Greater London"
+    
+    # Remove common suffixes
+    s = _COUNTY_SUFFIX_RE.sub("", s)
+    
+    # Title case for consistency
+    return s.strip().title()
+
+
+def normalize_county_expr(expr: pl.Expr) -> pl.Expr:
+    """
+    Vectorized equivalent of normalize_county for a String column.
+    Runs entirely in Polars kernels (no per-row Python callback).
+    Nulls are returned as "".
+    """
+    s = expr.fill_null("").str.strip_chars().str.to_lowercase()
+    return (
+        pl.when(s.str.contains("london", literal=True))
+        .then(pl.lit("Greater London"))
+        .otherwise(
+            s.str.replace(COUNTY_SUFFIX_PATTERN, "")
+            .str.strip_chars()
+            .str.to_titlecase()
+        )
+    )
+
+
+# ============ ENGLAND LOOKUPS ============
+# Flattened and keyed by normalize_county, so lookups match normalized input
+ALL_ENGLAND_COUNTIES = set()
+COUNTY_TO_REGION = {}
+for region, data in ENGLAND_REGIONS.items():
+    for county in data["counties"]:
+        normalized = normalize_county(county)
+        ALL_ENGLAND_COUNTIES.add(normalized)
+        COUNTY_TO_REGION[normalized] = region
+
+NORMALIZED_ENGLAND_COUNTIES = frozenset(ALL_ENGLAND_COUNTIES)
+
+
+def is_england_county(county: str) -> bool:
+    """Check if county is in England regions."""
+    return normalize_county(county) in NORMALIZED_ENGLAND_COUNTIES
+
+
+def get_region_for_county(county: str) -> str:
+    """Get region name for a county."""
+    return COUNTY_TO_REGION.get(normalize_county(county), "")
@@ -7,59 +7,19 @@ Purpose:
 """
 import logging
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Union
 from datetime import datetime
 import polars as pl
 from functools import wraps
+from app.services.county_names import (
+    ENGLAND_REGIONS,
+    NORMALIZED_ENGLAND_COUNTIES,
+    normalize_county,
+    normalize_county_expr,
+)
 
 logger = logging.getLogger(__name__)
 
-# ============ ENGLAND REGIONS CONFIGURATION ============
-ENGLAND_REGIONS = {
-    "North West": {
-        "code": "NW",
-        "counties": ["Cheshire", "Cumbria", "Greater Manchester", "Lancashire", "Merseyside"]
-    },
-    "North East": {
-        "code": "NE",
-        "counties": ["County Durham", "Northumberland", "Tyne and Wear"]
-    },
-    "West Midlands": {
-        "code": "WM",
-        "counties": ["Herefordshire", "Shropshire", "Staffordshire", "Warwickshire", "West Midlands", "Worcestershire"]
-    },
-    "East Midlands": {
-        "code": "EM",
-        "counties": ["Derbyshire", "Leicestershire", "Lincolnshire", "Northamptonshire", "Nottinghamshire", "Rutland"]
-    },
-    "East": {
-        "code": "E",
-        "counties": ["Bedfordshire", "Cambridgeshire", "Essex", "Hertfordshire", "Norfolk", "Suffolk"]
-    },
-    "South West": {
-        "code": "SW",
-        "counties": ["Bristol", "Cornwall", "Devon", "Dorset", "Gloucestershire", "Somerset", "Wiltshire"]
-    },
-    "South East": {
-        "code": "SE",
-        "counties": ["Berkshire", "Buckinghamshire", "East Sussex", "Hampshire", "Isle of Wight", "Kent", "Oxfordshire", "Surrey", "West Sussex"]
-    },
-    "London": {
-        "code": "L",
-        "counties": ["Greater London"]
-    }
-}
-
-# Flatten for quick lookup
-ALL_ENGLAND_COUNTIES = set()
-COUNTY_TO_REGION = {}
-for region, data in ENGLAND_REGIONS.items():
-    for county in data["counties"]:
-        # Store normalized form for consistent matching
-        normalized = county.strip().title()
-        ALL_ENGLAND_COUNTIES.add(normalized)
-        COUNTY_TO_REGION[normalized] = region
-
 # ============ UTIL ============
 def track_performance(func):
     @wraps(func)
@@ -72,51 +32,27 @@ def track_performance(func):
         return result
     return wrapper
 
-def normalize_county(county: str) -> str:
-    """
-    Normalize county name to canonical form.
-    This MUST match Script C's normalize_county function exactly.
-    """
-    if not county or not isinstance(county, str):
-        return ""
-    
-    s = county.strip().lower()
-    
-    # Special case: London variants (City of London and Greater London both map to Greater London)
-    if "london" in s:
-        return "Greater London"
-    
-    # Remove common suffixes
-    import re
-    s = re.sub(
-        r"\s+(county|unitary|borough|city|metropolitan|royal|district|council|region)$",
-        "",
-        s,
-        flags=re.I,
-    )
-    
-    # Title case for consistency
-    return s.strip().title()
-
-def is_england_county(county: str) -> bool:
-    """Check if county is in England regions."""
-    normalized = normalize_county(county)
-    # Compare normalized form
-    return normalized in {normalize_county(c) for c in ALL_ENGLAND_COUNTIES}
-
-def get_region_for_county(county: str) -> str:
-    """Get region name for a county."""
-    normalized = normalize_county(county)
-    return COUNTY_TO_REGION.get(normalized, "")
-
 # ============ CORE ============
 @track_performance
-def analyze_dataset(dataset_file: str) -> Dict[str, any]:
-    if not Path(dataset_file).exists():
-        raise FileNotFoundError(f"Dataset not found: {dataset_file}")
+def analyze_dataset(source: Union[str, pl.DataFrame, pl.LazyFrame]) -> Dict[str, any]:
+    """
+    Analyze a dataset given as a parquet path or an in-memory (Lazy)DataFrame.
+    In-memory sources skip the parquet round-trip; dataset_file is then None.
+    """
+    if isinstance(source, pl.LazyFrame):
+        dataset_file = None
+        lf = source
+    elif isinstance(source, pl.DataFrame):
+        dataset_file = None
+        lf = source.lazy()
+    else:
+        dataset_file = source
+        if not Path(dataset_file).exists():
+            raise FileNotFoundError(f"Dataset not found: {dataset_file}")
+        lf = pl.scan_parquet(dataset_file)
 
-    df = pl.read_parquet(dataset_file)
-    total = df.height
+    schema_names = lf.collect_schema().names()
+    total = lf.select(pl.len()).collect().item()
 
     if total == 0:
         return {
@@ -133,9 +69,12 @@ def analyze_dataset(dataset_file: str) -> Dict[str, any]:
         }
 
     # ---------- Column Presence ----------
-    has_raw_county = "County" in df.columns
-    has_resolved = "ResolvedCounty" in df.columns
-    has_postcode = "Postcode" in df.columns
+    has_raw_county = "County" in schema_names
+    has_resolved = "ResolvedCounty" in schema_names
+    has_postcode = "Postcode" in schema_names
+
+    # Only the columns analysis needs are decoded
+    lf = lf.select([c for c in ["County", "ResolvedCounty", "Postcode"] if c in schema_names])
 
     # ---------- Determine County Source ----------
     if has_resolved:
@@ -147,31 +86,46 @@ def analyze_dataset(dataset_file: str) -> Dict[str, any]:
 
     # ---------- Filter for England Only ----------
     if county_source:
-        # Filter using normalized county matching
-        england_df = df.filter(
-            pl.col(county_source)
-            .map_elements(lambda x: is_england_county(x), return_dtype=pl.Boolean)
-        )
+        # Filter using normalized county matching (pushed into the scan)
+        england_df = lf.filter(
+            normalize_county_expr(pl.col(county_source))
+            .is_in(list(NORMALIZED_ENGLAND_COUNTIES))
+        ).collect(streaming=True)
         total_england = england_df.height
     else:
-        england_df = df
+        england_df = lf.collect(streaming=True)
         total_england = 0
 
+    # ---------- Column Sums (England only, one pass) ----------
+    aggs = []
+    if has_raw_county:
+        aggs += [
+            (pl.col("County") != "").sum().alias("county_set"),
+            (pl.col("County") == "").sum().alias("county_empty"),
+        ]
+    if has_resolved:
+        aggs += [
+            (pl.col("ResolvedCounty") != "").sum().alias("resolved_set"),
+            (pl.col("ResolvedCounty") == "").sum().alias("resolved_empty"),
+        ]
+    if has_postcode:
+        aggs.append((pl.col("Postcode") == "").sum().alias("postcode_empty"))
+    sums = england_df.select(aggs).row(0, named=True) if aggs else {}
+
     # ---------- Resolution Stats (England only) ----------
+    direct = sums["county_set"] if has_raw_county else 0
     if has_resolved:
-        direct = (england_df["County"] != "").sum() if has_raw_county else 0
-        resolved_total = (england_df["ResolvedCounty"] != "").sum()
+        resolved_total = sums["resolved_set"]
         postcode_resolved = max(int(resolved_total - direct), 0)
-        unresolvable = (england_df["ResolvedCounty"] == "").sum()
+        unresolvable = sums["resolved_empty"]
     else:
-        direct = (england_df["County"] != "").sum() if has_raw_county else 0
         postcode_resolved = 0
         unresolvable = total_england - direct
 
     # ---------- Missing Data (England only) ----------
-    postcode_missing = (england_df["Postcode"] == "").sum() if has_postcode else total_england
-    county_missing = (england_df["ResolvedCounty"] == "").sum() if has_resolved else (
-        (england_df["County"] == "").sum() if has_raw_county else total_england
+    postcode_missing = sums["postcode_empty"] if has_postcode else total_england
+    county_missing = sums["resolved_empty"] if has_resolved else (
+        sums["county_empty"] if has_raw_county else total_england
     )
 
     # ---------- Regional Distribution (England only, in specified order) ----------
@@ -179,17 +133,16 @@ def analyze_dataset(dataset_file: str) -> Dict[str, any]:
     
     if county_source:
         # Get county counts
+        # (grouped on the normalized name, so variants of one county are summed)
         county_counts = (
-            england_df.filter(pl.col(county_source) != "")
-            .group_by(county_source)
-            .agg(pl.count().alias("count"))
+            england_df.select(normalize_county_expr(pl.col(county_source)).alias("county"))
+            .filter(pl.col("county") != "")
+            .group_by("county")
+            .len()
         )
         
-        # Convert to dict for easy lookup (use normalized keys)
-        county_dict = {
-            normalize_county(row[county_source]): int(row["count"])
-            for row in county_counts.iter_rows(named=True)
-        }
+        # Convert to dict for easy lookup (keys are already normalized)
+        county_dict = dict(zip(county_counts["county"].to_list(), county_counts["len"].to_list()))
         
         # Build regional distribution in specified order
         for region_name, region_data in ENGLAND_REGIONS.items():
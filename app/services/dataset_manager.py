@@ -6,12 +6,17 @@ import logging
 from pathlib import Path
 from typing import Dict, Optional, List
 import polars as pl
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from app.database import crud
+from app.database.models import Company
 from app.services.dataset_analysis import analyze_dataset
 
 logger = logging.getLogger(__name__)
 
+# Rows per bulk insert when importing a parquet file
+IMPORT_BATCH_SIZE = 50_000
+
 # ============ DATASET IMPORT ============
 
 def import_parquet_to_dataset(
@@ -36,8 +41,53 @@ def import_parquet_to_dataset(
     if existing:
         raise ValueError(f"Dataset '{dataset_name}' already exists")
     
-    # Read parquet
-    df = pl.read_parquet(parquet_file)
+    # Read parquet, projecting and renaming to Company columns in one pass
+    lf = pl.scan_parquet(parquet_file)
+    schema_names = set(lf.collect_schema().names())
+    
+    def source(col: str) -> pl.Expr:
+        """Source column as String, or "" when the parquet doesn't have it."""
+        if col in schema_names:
+            return pl.col(col).cast(pl.String)
+        return pl.lit("")
+    
+    def source_or(col: str, fallback: str) -> pl.Expr:
+        """Source column, falling back when it is missing, null or empty."""
+        if col not in schema_names:
+            return source(fallback)
+        value = pl.col(col).cast(pl.String)
+        return pl.when(value.is_not_null() & (value != "")).then(value).otherwise(source(fallback))
+    
+    df = lf.select([
+        source("CompanyNumber").alias("company_number"),
+        source("BusinessName").alias("business_name"),
+        source("AddressLine1").alias("address_line1"),
+        source("AddressLine2").alias("address_line2"),
+        source("Town").alias("town"),
+        source_or("County", "ResolvedCounty").alias("county"),
+        source("Postcode").alias("postcode"),
+        source("PersonWithSignificantControl").alias("person_with_significant_control"),
+        source("NatureOfControl").alias("nature_of_control"),
+        source("Title").alias("title"),
+        source_or("Fname", "OfficerFirstName").alias("fname"),
+        source_or("Sname", "OfficerSurname").alias("sname"),
+        
+        # NEW: Enrichment explanation columns
+        source("SelectedPersonSource").alias("selected_person_source"),
+        source("SelectedPSCShareTier").alias("selected_psc_share_tier"),
+        source("SelectedPSCNatureOfControl").alias("selected_psc_nature_of_control"),
+        
+        source_or("Position", "OfficerPosition").alias("position"),
+        source("SIC").alias("sic"),
+        source("CompanyStatus").alias("company_status"),
+        source("CompanyType").alias("company_type"),
+        source("DateOfCreation").alias("date_of_creation"),
+        source("Website").alias("website"),
+        source("Phone").alias("phone"),
+        source("Email").alias("email"),
+        source("WebsiteAddress").alias("website_address"),
+        source("AddressMatch(RegVsWeb)").alias("address_match"),
+    ]).collect()
     total_rows = df.height
     
     logger.info(f"Read {total_rows:,} companies from parquet")
@@ -52,43 +102,20 @@ def import_parquet_to_dataset(
         source_file=str(parquet_file)
     )
     
-    # Prepare company data
-    companies_data = []
-    for row in df.iter_rows(named=True):
-        company = {
-            "company_number": row.get("CompanyNumber", ""),
-            "business_name": row.get("BusinessName", ""),
-            "address_line1": row.get("AddressLine1", ""),
-            "address_line2": row.get("AddressLine2", ""),
-            "town": row.get("Town", ""),
-            "county": row.get("County") or row.get("ResolvedCounty", ""),
-            "postcode": row.get("Postcode", ""),
-            "person_with_significant_control": row.get("PersonWithSignificantControl", ""),
-            "nature_of_control": row.get("NatureOfControl", ""),
-            "title": row.get("Title", ""),
-            "fname": row.get("Fname") or row.get("OfficerFirstName", ""),
-            "sname": row.get("Sname") or row.get("OfficerSurname", ""),
-            
-            # NEW: Enrichment explanation columns
-            "selected_person_source": row.get("SelectedPersonSource", ""),
-            "selected_psc_share_tier": row.get("SelectedPSCShareTier", ""),
-            "selected_psc_nature_of_control": row.get("SelectedPSCNatureOfControl", ""),
-            
-            "position": row.get("Position") or row.get("OfficerPosition", ""),
-            "sic": row.get("SIC", ""),
-            "company_status": row.get("CompanyStatus", ""),
-            "company_type": row.get("CompanyType", ""),
-            "date_of_creation": row.get("DateOfCreation", ""),
-            "website": row.get("Website", ""),
-            "phone": row.get("Phone", ""),
-            "email": row.get("Email", ""),
-            "website_address": row.get("WebsiteAddress", ""),
-            "address_match": row.get("AddressMatch(RegVsWeb)", "")
-        }
-        companies_data.append(company)
-    
-    # Bulk insert
-    inserted_count = crud.bulk_create_companies(db, dataset.id, companies_data)
+    # Bulk insert in batches (one executemany per batch), committed once after
+    # the last; a failed import removes the dataset instead of leaving it with
+    # only some of its companies
+    inserted_count = 0
+    try:
+        for batch in df.iter_slices(IMPORT_BATCH_SIZE):
+            inserted_count += crud.bulk_create_companies(
+                db, dataset.id, batch.to_dicts(), commit=False
+            )
+        db.commit()
+    except Exception:
+        db.rollback()
+        crud.delete_dataset(db, dataset.id)
+        raise
     
     logger.info(f"✓ Dataset '{dataset_name}' created with {inserted_count:,} companies")
     
@@ -112,38 +139,31 @@ def regenerate_analysis(db: Session, dataset_id: int) -> Dict:
     if not dataset:
         raise ValueError(f"Dataset {dataset_id} not found")
     
-    # Export to temporary parquet for analysis
-    import tempfile
-    with tempfile.NamedTemporaryFile(suffix=".parquet", delete=False) as tmp:
-        tmp_path = tmp.name
+    # Read the analysis columns straight into Polars (no ORM hydration)
+    query = (
+        select(
+            Company.company_number.label("CompanyNumber"),
+            Company.business_name.label("BusinessName"),
+            Company.county.label("County"),
+            Company.postcode.label("Postcode"),
+            Company.town.label("Town"),
+        )
+        .where(Company.dataset_id == dataset_id)
+        .limit(1000000)
+    )
+    df = pl.read_database(
+        query,
+        connection=db,
+        schema_overrides={
+            c: pl.String for c in ["CompanyNumber", "BusinessName", "County", "Postcode", "Town"]
+        },
+    )
+    
+    # Run analysis directly on the in-memory frame
+    analysis_result = analyze_dataset(df)
     
-    try:
-        # Fetch all companies
-        companies = crud.get_companies(db, dataset_id, limit=1000000)
-        
-        # Convert to polars DataFrame
-        data = []
-        for c in companies:
-            data.append({
-                "CompanyNumber": c.company_number,
-                "BusinessName": c.business_name,
-                "County": c.county,
-                "Postcode": c.postcode,
-                "Town": c.town,
-                # Add other fields as needed for analysis
-            })
-        
-        df = pl.DataFrame(data)
-        df.write_parquet(tmp_path)
-        
-        # Run analysis
-        analysis_result = analyze_dataset(tmp_path)
-        
-        # Save to database
-        crud.save_analysis(db, dataset_id, analysis_result)
-        
-        logger.info(f"✓ Analysis regenerated for dataset {dataset_id}")
-        return analysis_result
-        
-    finally:
-        Path(tmp_path).unlink(missing_ok=True)
\ No newline at end of file
+    # Save to database
+    crud.save_analysis(db, dataset_id, analysis_result)
+    
+    logger.info(f"✓ Analysis regenerated for dataset {dataset_id}")
+    return analysis_result
@@ -6,7 +6,7 @@ Purpose:
     This is USER-TRIGGERED via "Enrich" button (async operation).
 
 Design:
-    - Streaming processing with batched API calls
+    - Streaming processing with batched, concurrent API calls
     - Checkpoint system to prevent data loss
     - Automatic garbage collection
     - Progress tracking
@@ -14,12 +14,21 @@ Design:
 """
 
 import os
+import math
 import time
 import random
+import shutil
+import sqlite3
+import asyncio
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, NamedTuple, Optional, Tuple
 import requests
+from requests.adapters import HTTPAdapter
+import httpx
+import orjson
 import polars as pl
 from tqdm import tqdm
 from functools import wraps
@@ -33,10 +42,27 @@ API_KEY = os.getenv("COMPANIES_HOUSE_API_KEY", "")
 BASE_URL = "https://api.company-information.service.gov.uk"
 MAX_RETRIES = 3
 MIN_DELAY_SEC = 0.6  # ~600 requests / 5 minutes
+HTTP_POOL_SIZE = 64  # keep-alive connections held by the sync session
+MAX_CONCURRENT_REQUESTS = 16  # in-flight requests; MIN_DELAY_SEC still caps the rate
+# Set CH_ASYNC_CLIENT=0 to fetch with the threaded sync client instead
+USE_ASYNC_CLIENT = os.getenv("CH_ASYNC_CLIENT", "1") != "0"
 
 ENRICHMENT_OUTPUT_DIR = Path("outputs/enriched")
 ENRICHMENT_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
+# Final output layout: low-cardinality columns are written dictionary-encoded
+OUTPUT_CATEGORICAL_COLS = ("CompanyStatus", "CompanyType", "County", "SelectedPSCShareTier")
+OUTPUT_ROW_GROUP_SIZE = 50_000
+OUTPUT_COMPRESSION_LEVEL = 3
+
+# Adaptive checkpoint interval (see CheckpointInterval)
+CHECKPOINT_MAX_ROWS = 1000
+CHECKPOINT_MTBF_SEC = float(os.getenv("CHECKPOINT_MTBF_SEC", "3600"))  # prior until a restart is seen
+
+# Local replay cache for API responses (set CH_CACHE_TTL_SEC=0 to disable)
+RESPONSE_CACHE_PATH = Path(os.getenv("CH_CACHE_PATH", "outputs/cache/ch_api.sqlite"))
+RESPONSE_CACHE_TTL_SEC = int(os.getenv("CH_CACHE_TTL_SEC", str(7 * 24 * 3600)))
+
 
 FINAL_COL_ORDER = [
     "Company Number",
@@ -68,16 +94,23 @@ FINAL_COL_ORDER = [
 
 
 # ============ PERFORMANCE TRACKING ============
+_PROC = psutil.Process()
+
+
 def track_performance(func):
     """Decorator to track execution time and memory."""
     @wraps(func)
     def wrapper(*args, **kwargs):
+        if not logger.isEnabledFor(logging.INFO):
+            # Nothing would be logged; skip the timers and /proc reads
+            return func(*args, **kwargs)
+
         start_time = time.time()
-        start_mem = psutil.Process().memory_info().rss / (1024 ** 2)
+        start_mem = _PROC.memory_info().rss / (1024 ** 2)
         logger.info(f"Starting {func.__name__}")
         result = func(*args, **kwargs)
         end_time = time.time()
-        end_mem = psutil.Process().memory_info().rss / (1024 ** 2)
+        end_mem = _PROC.memory_info().rss / (1024 ** 2)
         duration = end_time - start_time
         mem_delta = end_mem - start_mem
         logger.info(
@@ -89,37 +122,138 @@ def track_performance(func):
 
 
 # ============ API CLIENT ============
+class ResponseCache:
+    """
+    URL -> JSON body cache in SQLite with a TTL.
+    Only bodies are stored; 404s are stored as NULL so misses replay too.
+    """
+
+    def __init__(self, path: Path = RESPONSE_CACHE_PATH, ttl: int = RESPONSE_CACHE_TTL_SEC):
+        self.ttl = ttl
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "url TEXT PRIMARY KEY, body BLOB, fetched_at REAL NOT NULL)"
+        )
+
+    def get(self, url: str) -> Tuple[bool, Optional[Dict]]:
+        """(hit, data) - data is None for a cached 404."""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT body, fetched_at FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return False, None
+        if row[0] is None:
+            return True, None
+        try:
+            return True, orjson.loads(row[0])
+        except orjson.JSONDecodeError:
+            # An undecodable body is a miss; the refetch overwrites it
+            return False, None
+
+    def set(self, url: str, body: Optional[bytes]):
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (url, body, fetched_at) VALUES (?, ?, ?)",
+                (url, body, time.time()),
+            )
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def _open_response_cache() -> Optional[ResponseCache]:
+    if RESPONSE_CACHE_TTL_SEC <= 0:
+        return None
+    try:
+        return ResponseCache()
+    except sqlite3.Error as e:
+        logger.warning(f"API response cache unavailable: {e}")
+        return None
+
+
+def _require_api_key(api_key: str):
+    if not api_key:
+        raise ValueError(
+            "COMPANIES_HOUSE_API_KEY not set. "
+            "Get your free API key from: "
+            "https://developer.company-information.service.gov.uk/"
+        )
+
+
 class CompaniesHouseClient:
-    """Companies House API client with rate limiting and retries."""
+    """
+    Companies House API client with rate limiting and retries.
+    Thread-safe: the rate limiter hands out request slots under a lock.
+    """
 
     def __init__(self, api_key: str):
-        if not api_key:
-            raise ValueError(
-                "COMPANIES_HOUSE_API_KEY not set. "
-                "Get your free API key from: "
-                "https://developer.company-information.service.gov.uk/"
-            )
+        _require_api_key(api_key)
         self.session = requests.Session()
         self.session.auth = (api_key, "")
         self.session.headers.update({"Accept": "application/json"})
-        self.last_request_time = 0
+        # Pooled keep-alive connections reuse the TLS session across calls.
+        # Retries stay in safe_get alone, where every attempt is rate limited
+        adapter = HTTPAdapter(
+            pool_connections=HTTP_POOL_SIZE,
+            pool_maxsize=HTTP_POOL_SIZE,
+            max_retries=0,
+        )
+        self.session.mount("https://", adapter)
+        self._rate_lock = threading.Lock()
+        self._next_slot = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ch-fetch")
+        self.cache = _open_response_cache()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.session.close()
+        if self.cache:
+            self.cache.close()
 
     def _rate_limit(self):
-        elapsed = time.time() - self.last_request_time
-        if elapsed < MIN_DELAY_SEC:
-            time.sleep(MIN_DELAY_SEC - elapsed)
-        self.last_request_time = time.time()
+        # Reserve the next slot under the lock, sleep outside it
+        with self._rate_lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + MIN_DELAY_SEC
+        if slot > now:
+            time.sleep(slot - now)
 
     def safe_get(self, url: str) -> Optional[Dict]:
+        if self.cache:
+            # Cache hits don't touch the API, so they skip the rate limiter
+            hit, data = self.cache.get(url)
+            if hit:
+                return data
+
         for attempt in range(MAX_RETRIES):
             self._rate_limit()
             try:
                 response = self.session.get(url, timeout=30)
 
                 if response.status_code == 200:
-                    return response.json()
+                    # Parsed before caching, so a non-JSON body is never stored
+                    data = orjson.loads(response.content)
+                    if self.cache:
+                        self.cache.set(url, response.content)
+                    return data
 
                 if response.status_code == 404:
+                    if self.cache:
+                        self.cache.set(url, None)
                     return None
 
                 if response.status_code == 429:
@@ -136,7 +270,8 @@ class CompaniesHouseClient:
                 logger.error(f"Unexpected status {response.status_code}: {url}")
                 return None
 
-            except requests.exceptions.RequestException as e:
+            # A malformed body is retried like a failed request
+            except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
                 logger.warning(f"Request failed: {e}. Retry {attempt + 1}")
                 time.sleep(2 ** attempt)
 
@@ -154,89 +289,585 @@ class CompaniesHouseClient:
         data = self.safe_get(f"{BASE_URL}/company/{company_number}/officers") or {}
         return data.get("items", [])
 
+    def fetch_company(self, company_number: str) -> Tuple[Dict, List[Dict], List[Dict]]:
+        """Fetch the profile, then PSC and officers on two threads if it exists."""
+        profile = self.get_company_profile(company_number)
+        if not profile:
+            # No profile, no people data; skips two rate-limited calls
+            return {}, [], []
+        psc_fut = self._executor.submit(self.get_psc, company_number)
+        off_fut = self._executor.submit(self.get_officers, company_number)
+        return profile, psc_fut.result(), off_fut.result()
 
-def parse_officer_name(name: str) -> tuple:
-    if not name:
-        return "", ""
-    if "," in name:
-        surname, firstname = name.split(",", 1)
-        return firstname.strip(), surname.strip()
-    return "", name.strip()
 
+class AsyncRateLimiter:
+    """Spaces request starts at least `min_interval` seconds apart across tasks."""
 
-# =========== FUNCTION FOR PSC SELECTION ============
-def pick_psc_by_ownership(psc_items: list) -> Tuple[Dict, str, str]:
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self._lock = asyncio.Lock()
+        self._next_slot = 0.0
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            if self._next_slot > now:
+                await asyncio.sleep(self._next_slot - now)
+                now = self._next_slot
+            self._next_slot = now + self.min_interval
+
+
+class AsyncCompaniesHouseClient:
     """
-    Returns (psc_dict, share_tier, nature_of_control) based on STRICT ownership priority:
-    1) FIRST individual person with ownership-of-shares-75-to-100-percent
-    2) FIRST individual person with ownership-of-shares-50-to-75-percent
-    3) FIRST individual person with ownership-of-shares-25-to-50-percent
-    Only selects individual persons, NOT corporate entities or legal persons.
-    Returns ({}, "", "") if no individual PSC found.
+    Async Companies House client.
+    Requests overlap (bounded by MAX_CONCURRENT_REQUESTS) while their start
+    times stay MIN_DELAY_SEC apart, so the API budget is respected.
     """
-    if not psc_items:
-        return {}, "", ""
-
-    # Priority 1: First INDIVIDUAL person with 75–100%
-    for p in psc_items:
-        if (p.get("kind") == "individual-person-with-significant-control" and
-            "ownership-of-shares-75-to-100-percent" in p.get("natures_of_control", [])):
-            noc = "; ".join(p.get("natures_of_control", []))
-            return p, "75-100%", noc
-
-    # Priority 2: First INDIVIDUAL person with 50–75%
-    for p in psc_items:
-        if (p.get("kind") == "individual-person-with-significant-control" and
-            "ownership-of-shares-50-to-75-percent" in p.get("natures_of_control", [])):
-            noc = "; ".join(p.get("natures_of_control", []))
-            return p, "50-75%", noc
-
-    # Priority 3: First INDIVIDUAL person with 25–50%
-    for p in psc_items:
-        if (p.get("kind") == "individual-person-with-significant-control" and
-            "ownership-of-shares-25-to-50-percent" in p.get("natures_of_control", [])):
-            noc = "; ".join(p.get("natures_of_control", []))
-            return p, "25-50%", noc
-
-    # No individual PSC found with required ownership
-    return {}, "", ""
-
-
-# ============ TITLE EXTRACTION ============
-def extract_title_from_psc(psc_text: str, officer_first: str, officer_last: str) -> str:
+
+    def __init__(self, api_key: str):
+        _require_api_key(api_key)
+        self.client = httpx.AsyncClient(
+            auth=(api_key, ""),
+            headers={"Accept": "application/json"},
+            timeout=30,
+            limits=httpx.Limits(
+                max_connections=MAX_CONCURRENT_REQUESTS,
+                max_keepalive_connections=MAX_CONCURRENT_REQUESTS,
+            ),
+        )
+        self.limiter = AsyncRateLimiter(MIN_DELAY_SEC)
+        self.semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        self.cache = _open_response_cache()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+        if self.cache:
+            self.cache.close()
+
+    async def safe_get(self, url: str) -> Optional[Dict]:
+        if self.cache:
+            # Cache hits don't touch the API, so they skip the rate limiter
+            hit, data = self.cache.get(url)
+            if hit:
+                return data
+
+        async with self.semaphore:
+            for attempt in range(MAX_RETRIES):
+                await self.limiter.wait()
+                try:
+                    response = await self.client.get(url)
+
+                    if response.status_code == 200:
+                        # Parsed before caching, so a non-JSON body is never stored
+                        data = orjson.loads(response.content)
+                        if self.cache:
+                            self.cache.set(url, response.content)
+                        return data
+
+                    if response.status_code == 404:
+                        if self.cache:
+                            self.cache.set(url, None)
+                        return None
+
+                    if response.status_code == 429:
+                        wait = int(response.headers.get("Retry-After", 15))
+                        logger.warning(f"Rate limited. Waiting {wait}s")
+                        await asyncio.sleep(wait + random.uniform(0, 2))
+                        continue
+
+                    if response.status_code >= 500:
+                        logger.warning(f"Server error {response.status_code}. Retry {attempt + 1}")
+                        await asyncio.sleep(2 ** attempt)
+                        continue
+
+                    logger.error(f"Unexpected status {response.status_code}: {url}")
+                    return None
+
+                # A malformed body is retried like a failed request
+                except (httpx.HTTPError, orjson.JSONDecodeError) as e:
+                    logger.warning(f"Request failed: {e}. Retry {attempt + 1}")
+                    await asyncio.sleep(2 ** attempt)
+
+        logger.error(f"Failed after {MAX_RETRIES} attempts: {url}")
+        return None
+
+    async def fetch_company(self, company_number: str) -> Tuple[Dict, List[Dict], List[Dict]]:
+        """Fetch the profile, then PSC and officers concurrently if it exists."""
+        profile = await self.safe_get(f"{BASE_URL}/company/{company_number}")
+        if not profile:
+            # No profile, no people data; skips two rate-limited calls
+            return {}, [], []
+        psc, officers = await asyncio.gather(
+            self.safe_get(f"{BASE_URL}/company/{company_number}/persons-with-significant-control"),
+            self.safe_get(f"{BASE_URL}/company/{company_number}/officers"),
+        )
+        return profile, (psc or {}).get("items", []), (officers or {}).get("items", [])
+
+
+# =========== FUNCTION FOR PSC SELECTION ============
+PSC_INDIVIDUAL_KIND = "individual-person-with-significant-control"
+# (nature of control, share tier label) in strict priority order
+PSC_SHARE_TIERS = (
+    ("ownership-of-shares-75-to-100-percent", "75-100%"),
+    ("ownership-of-shares-50-to-75-percent", "50-75%"),
+    ("ownership-of-shares-25-to-50-percent", "25-50%"),
+)
+
+
+class PeopleSummary(NamedTuple):
+    """Names and roles the staged row needs from the PSC and officer lists."""
+    psc_names: List[str]
+    officer_names: List[Tuple[str, str]]
+    officer_positions: List[str]
+
+
+def summarize_psc_and_officers(psc_items: list, officers: list) -> PeopleSummary:
     """
-    Extracts a title (Mr, Ms, Miss, Mrs, Dr, etc.) from PSC only if:
-    - The PSC entry starts with a title
-    - AND the name matches the first officer (first + last name)
-    Otherwise returns blank.
+    One pass over each list.
+    PSC selection by ownership tier is done later, in _select_people.
     """
-    if not psc_text or not isinstance(psc_text, str):
-        return ""
+    psc_names = [p["name"] for p in psc_items if p.get("name")]
+
+    # Individuals only - corporate officers don't use the "SURNAME, Firstname" format
+    officer_names = []
+    officer_positions = []
+    for o in officers:
+        officer_name = o.get("name")
+        if officer_name:
+            surname, sep, firstname = officer_name.partition(",")
+            if sep:
+                first, last = firstname.strip(), surname.strip()
+                if first or last:
+                    officer_names.append((first, last))
+        role = o.get("officer_role")
+        if role:
+            officer_positions.append(role)
+
+    return PeopleSummary(psc_names, officer_names, officer_positions)
+
+
+# ============ VECTORIZED BATCH BUILDING ============
+TITLES = frozenset(("mr", "mrs", "ms", "miss", "dr", "sir", "lady", "prof"))
+# Leading title token, trailing dots allowed: "Mr", "mr.", "DR" ...
+TITLE_PATTERN = r"(?i)^(%s)\.*(?:\s|$)" % "|".join(sorted(TITLES))
+
+PSC_ITEM_DTYPE = pl.List(pl.Struct({
+    "name": pl.Utf8,
+    "kind": pl.Utf8,
+    "natures_of_control": pl.List(pl.Utf8),
+}))
+
+# Columns produced by _stage_row, with fixed dtypes so no inference is needed
+STAGE_SCHEMA = {
+    "PersonWithSignificantControl": pl.Utf8,
+    "Position": pl.Utf8,
+    "CompanyStatus": pl.Utf8,
+    "CompanyType": pl.Utf8,
+    "DateOfCreation": pl.Utf8,
+    "Website": pl.Utf8,
+    "Phone": pl.Utf8,
+    "Email": pl.Utf8,
+    "WebsiteAddress": pl.Utf8,
+    "AddressMatch(RegVsWeb)": pl.Utf8,
+    "_psc_items": PSC_ITEM_DTYPE,
+    "_officer_first": pl.Utf8,
+    "_officer_last": pl.Utf8,
+    "_has_officer": pl.Boolean,
+}
+
+
+def _first_individual_psc(share: str) -> pl.Expr:
+    """First individual PSC holding `share`, as a struct (null if none)."""
+    el = pl.element()
+    return pl.col("_psc_items").list.eval(
+        el.filter(
+            (el.struct.field("kind") == PSC_INDIVIDUAL_KIND)
+            & el.struct.field("natures_of_control").list.contains(share)
+        )
+    ).list.first()
+
+
+def _split_title(name: pl.Expr) -> Tuple[pl.Expr, pl.Expr]:
+    """(title, remainder) for a name expression, whitespace-normalized."""
+    name = name.fill_null("").str.strip_chars().str.replace_all(r"\s+", " ")
+    title = name.str.extract(TITLE_PATTERN, 1).str.to_titlecase()
+    return title, name.str.replace(TITLE_PATTERN, "")
 
-    if not officer_first or not officer_last:
-        return ""
 
-    titles = {"mr", "mrs", "ms", "miss", "dr", "sir", "lady", "prof"}
+def _stage_row(profile: Dict, psc_items: List[Dict], officers: List[Dict]) -> Dict:
+    """API-derived fields that don't depend on PSC selection, plus normalized PSC items."""
+    summary = summarize_psc_and_officers(psc_items, officers)
+    officer_first, officer_last = summary.officer_names[0] if summary.officer_names else ("", "")
 
-    officer_first = officer_first.strip().lower()
-    officer_last = officer_last.strip().lower()
+    return {
+        "PersonWithSignificantControl": "; ".join(summary.psc_names),
+        "Position": "; ".join(summary.officer_positions),
+        "CompanyStatus": profile.get("company_status", ""),
+        "CompanyType": profile.get("type", ""),
+        "DateOfCreation": profile.get("date_of_creation", ""),
+        "Website": "",
+        "Phone": "",
+        "Email": "",
+        "WebsiteAddress": "",
+        "AddressMatch(RegVsWeb)": "",
+        "_psc_items": [
+            {
+                "name": p.get("name") or "",
+                "kind": p.get("kind") or "",
+                "natures_of_control": list(p.get("natures_of_control") or []),
+            }
+            for p in psc_items
+        ],
+        "_officer_first": officer_first,
+        "_officer_last": officer_last,
+        "_has_officer": bool(summary.officer_names),
+    }
 
-    parts = [p.strip() for p in psc_text.split(";") if p.strip()]
 
-    for part in parts:
-        tokens = part.split()
-        if not tokens:
-            continue
+def _select_people(stage: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    PSC-by-ownership selection and Title/Fname/Sname resolution as Polars
+    expressions over the staged batch. A selected PSC supplies the person
+    (title and first/last name tokens); otherwise the first individual
+    officer does, titled from the first PSC name that starts with a title
+    and contains that officer's first and last name.
+    Built as one lazy plan so the derived columns are computed in a single
+    optimized pass instead of materializing each with_columns step.
+    """
+    tiers = [_first_individual_psc(share) for share, _ in PSC_SHARE_TIERS]
+    share_tier = pl.when(tiers[0].is_not_null()).then(pl.lit(PSC_SHARE_TIERS[0][1]))
+    for tier, (_, label) in zip(tiers[1:], PSC_SHARE_TIERS[1:]):
+        share_tier = share_tier.when(tier.is_not_null()).then(pl.lit(label))
+
+    stage = stage.with_row_index("_row").with_columns(
+        pl.coalesce(tiers).alias("_selected"),
+        share_tier.otherwise(pl.lit("")).alias("_share_tier"),
+        # Distinct natures of control across all PSCs, first-seen order
+        pl.col("_psc_items")
+        .list.eval(pl.element().struct.field("natures_of_control").explode().drop_nulls().unique(maintain_order=True))
+        .list.join("; ")
+        .alias("NatureOfControl"),
+    )
+
+    psc_title, psc_rest = _split_title(pl.col("_selected").struct.field("name"))
+    stage = stage.with_columns(
+        psc_title.fill_null("").alias("_psc_title"),
+        psc_rest.str.split(" ").alias("_psc_tokens"),
+        pl.col("_selected").struct.field("natures_of_control").list.join("; ").fill_null("").alias("_psc_noc"),
+    ).with_columns(
+        pl.when(pl.col("_psc_tokens").list.len() >= 2)
+        .then(pl.col("_psc_tokens").list.first())
+        .otherwise(pl.lit(""))
+        .alias("_psc_first"),
+        pl.col("_psc_tokens").list.last().fill_null("").alias("_psc_last"),
+    )
+
+    # Officer fallback title: first PSC name that starts with a title and
+    # contains the first officer's first and last name
+    fallback_title, fallback_rest = _split_title(pl.col("_psc_name"))
+    fallback = (
+        stage.filter((pl.col("_officer_first") != "") & (pl.col("_officer_last") != ""))
+        .select(
+            "_row",
+            pl.col("_officer_first").str.strip_chars().str.to_lowercase(),
+            pl.col("_officer_last").str.strip_chars().str.to_lowercase(),
+            pl.col("_psc_items").list.eval(pl.element().struct.field("name")).alias("_psc_name"),
+        )
+        .explode("_psc_name")
+        .with_columns(fallback_title.alias("_title"), fallback_rest.str.to_lowercase().alias("_rest"))
+        .filter(
+            pl.col("_title").is_not_null()
+            & pl.col("_rest").str.contains(pl.col("_officer_first"), literal=True)
+            & pl.col("_rest").str.contains(pl.col("_officer_last"), literal=True)
+        )
+        .group_by("_row", maintain_order=True)
+        .agg(pl.col("_title").first().alias("_fallback_title"))
+    )
+    stage = stage.join(fallback, on="_row", how="left")
+
+    use_psc = (pl.col("_psc_first") != "") | (pl.col("_psc_last") != "") | (pl.col("_psc_title") != "")
+    use_officer = pl.col("_has_officer")
+
+    def pick(psc_value, officer_value) -> pl.Expr:
+        return pl.when(use_psc).then(psc_value).when(use_officer).then(officer_value).otherwise(pl.lit(""))
+
+    return stage.with_columns(
+        pick(pl.col("_psc_title"), pl.col("_fallback_title").fill_null("")).alias("Title"),
+        pick(pl.col("_psc_first"), pl.col("_officer_first")).alias("Fname"),
+        pick(pl.col("_psc_last"), pl.col("_officer_last")).alias("Sname"),
+        pick(
+            pl.lit("PSC: ") + pl.col("_selected").struct.field("name"),
+            pl.lit("First Officer"),
+        ).alias("SelectedPersonSource"),
+        pick(pl.col("_share_tier"), pl.lit("")).alias("SelectedPSCShareTier"),
+        pick(pl.col("_psc_noc"), pl.lit("")).alias("SelectedPSCNatureOfControl"),
+    ).drop(pl.selectors.starts_with("_"))
+
+
+def enrich_batch(batch: pl.DataFrame, results: List[Tuple[Dict, List[Dict], List[Dict]]]) -> pl.DataFrame:
+    """
+    Build the enriched frame for an input batch and its (profile, psc_items,
+    officers) results, in row order. Input columns are kept as-is; only the
+    API-derived columns are built in Python, column-wise.
+    """
+    cols = {name: [] for name in STAGE_SCHEMA}
+    for r in results:
+        for k, v in _stage_row(*r).items():
+            cols[k].append(v)
+    stage = batch.drop([c for c in STAGE_SCHEMA if c in batch.columns]).hstack(
+        pl.DataFrame(cols, schema=STAGE_SCHEMA)
+    )
+    return _select_people(stage.lazy()).collect()
+
+
+def _count_fetch(stats: Dict, profile: Dict, psc_items: List[Dict], officers: List[Dict]):
+    if profile:
+        stats["api_success"] += 1
+    else:
+        stats["api_fail"] += 1
+    if psc_items:
+        stats["with_psc"] += 1
+    if officers:
+        stats["with_officers"] += 1
+
+
+def _write_shard(enriched: pl.DataFrame, shard_dir: Path, shard_idx: int) -> float:
+    """Write one checkpoint shard and return the seconds it took."""
+    start = time.monotonic()
+    enriched.write_parquet(
+        shard_dir / f"{shard_idx:06d}.parquet",
+        compression="zstd",
+        statistics=False,
+    )
+    return time.monotonic() - start
+
+
+async def _enrich_rows(
+    df_to_process: pl.DataFrame,
+    shard_dir: Path,
+    batch_size: int,
+    stats: Dict,
+    progress_callback=None,
+):
+    """
+    Fetch and enrich rows `batch_size` companies at a time.
+    Companies in a batch are fetched concurrently; each batch is written as
+    its own checkpoint shard, so checkpoint cost stays proportional to the batch.
+    """
+    total_to_process = df_to_process.height
+    shard_idx = len(list(shard_dir.glob("*.parquet")))
+    interval = CheckpointInterval(shard_dir, batch_size)
+    done = 0
+
+    async with AsyncCompaniesHouseClient(API_KEY) as client:
+        with tqdm(total=total_to_process, desc="Enriching") as pbar:
+
+            async def process_company(company_number: str) -> Tuple[Dict, List[Dict], List[Dict]]:
+                nonlocal done
+                profile, psc_items, officers = await client.fetch_company(company_number)
+                _count_fetch(stats, profile, psc_items, officers)
+
+                done += 1
+                pbar.update(1)
+                if progress_callback:
+                    progress_callback(done)
+                return profile, psc_items, officers
+
+            offset = 0
+            while offset < total_to_process:
+                batch = df_to_process.slice(offset, interval.rows)
+                offset += batch.height
+
+                batch_start = time.monotonic()
+                results = await asyncio.gather(
+                    *[process_company(cn) for cn in batch["CompanyNumber"]]
+                )
+                enriched = enrich_batch(batch, results)
+                fetch_seconds = time.monotonic() - batch_start
+                write_seconds = _write_shard(enriched, shard_dir, shard_idx)
+                shard_idx += 1
+                gc.collect()
+                next_rows = interval.record(batch.height, fetch_seconds, write_seconds)
+                logger.info(f"✓ Checkpoint saved: {done}/{total_to_process} (next every {next_rows} rows)")
+
+
+def _enrich_rows_threaded(
+    df_to_process: pl.DataFrame,
+    shard_dir: Path,
+    batch_size: int,
+    stats: Dict,
+    progress_callback=None,
+):
+    """
+    Synchronous fallback for _enrich_rows.
+    Rows go one at a time; each row's three endpoints are fetched in parallel.
+    """
+    total_to_process = df_to_process.height
+    shard_idx = len(list(shard_dir.glob("*.parquet")))
+    interval = CheckpointInterval(shard_dir, batch_size)
+    done = 0
+
+    with CompaniesHouseClient(API_KEY) as client, tqdm(total=total_to_process, desc="Enriching") as pbar:
+        offset = 0
+        while offset < total_to_process:
+            batch = df_to_process.slice(offset, interval.rows)
+            offset += batch.height
+
+            batch_start = time.monotonic()
+            results = []
+            for company_number in batch["CompanyNumber"]:
+                result = client.fetch_company(company_number)
+                _count_fetch(stats, *result)
+                results.append(result)
+
+                done += 1
+                pbar.update(1)
+                if progress_callback:
+                    progress_callback(done)
+
+            enriched = enrich_batch(batch, results)
+            fetch_seconds = time.monotonic() - batch_start
+            write_seconds = _write_shard(enriched, shard_dir, shard_idx)
+            shard_idx += 1
+            gc.collect()
+            next_rows = interval.record(batch.height, fetch_seconds, write_seconds)
+            logger.info(f"✓ Checkpoint saved: {done}/{total_to_process} (next every {next_rows} rows)")
+
+
+# ============ CHECKPOINTS ============
+class CheckpointInterval:
+    """
+    Rows per checkpoint from Daly's first-order optimum T = sqrt(2 * delta * M).
+    delta is the measured shard write time and M the mean time between failures.
+    M is estimated from restarts recorded in a sidecar next to the shard
+    directory (outside it, so it survives the cleanup after a successful run);
+    shards left over from an earlier run count as one failure.
+    The interval never drops below the caller's batch size.
+    """
+
+    EWMA_ALPHA = 0.3
+
+    def __init__(self, shard_dir: Path, min_rows: int, max_rows: int = CHECKPOINT_MAX_ROWS):
+        self.min_rows = min_rows
+        self.max_rows = max(max_rows, min_rows)
+        self.rows = min_rows
+        self.sidecar = shard_dir.with_name(f"{shard_dir.name}_stats.json")
+        self._start = time.monotonic()
+        self._delta = None
+        self._row_time = None
+
+        try:
+            self._history = orjson.loads(self.sidecar.read_bytes())
+        except (OSError, ValueError):
+            self._history = {"failures": 0, "run_seconds": 0.0}
+        if any(shard_dir.glob("*.parquet")):
+            self._history["failures"] += 1
+        self._save(0.0)
+
+    def _ewma(self, old: Optional[float], new: float) -> float:
+        return new if old is None else old + self.EWMA_ALPHA * (new - old)
+
+    def _save(self, elapsed: float):
+        history = {**self._history, "run_seconds": self._history["run_seconds"] + elapsed}
+        try:
+            self.sidecar.write_bytes(orjson.dumps(history))
+        except OSError as e:
+            logger.debug(f"Could not write checkpoint stats: {e}")
+
+    def record(self, rows: int, batch_seconds: float, write_seconds: float) -> int:
+        """Fold in one batch's timings and return the next batch size."""
+        if rows <= 0:
+            return self.rows
+        self._delta = self._ewma(self._delta, write_seconds)
+        self._row_time = self._ewma(self._row_time, batch_seconds / rows)
+
+        elapsed = time.monotonic() - self._start
+        failures = self._history["failures"]
+        total_seconds = self._history["run_seconds"] + elapsed
+        mtbf = total_seconds / failures if failures else max(CHECKPOINT_MTBF_SEC, elapsed)
+
+        interval = math.sqrt(2 * self._delta * mtbf)
+        self.rows = int(min(self.max_rows, max(self.min_rows, interval / max(self._row_time, 1e-6))))
+        self._save(elapsed)
+        return self.rows
+
+
+# Input names → output names. Shards hold raw rows; the merged checkpoint
+# written at the end of a run already uses the output names.
+RENAME_MAPPING = {
+    "CompanyNumber": "Company Number",
+    "BusinessName": "Business Name",
+    "AddressLine1": "Add1",
+    "AddressLine2": "Add2",
+    "Town": "Town",
+    "County": "County",
+    "Postcode": "Post Code",
+}
+
+
+def _checkpoint_sources(checkpoint_path: Path, shard_dir: Path) -> List[Path]:
+    """Merged checkpoint from a previous run (if any) followed by batch shards."""
+    sources = [checkpoint_path] if checkpoint_path.exists() else []
+    if shard_dir.exists():
+        sources.extend(sorted(shard_dir.glob("*.parquet")))
+    return sources
+
+
+def _scan_with_output_names(path: Path) -> pl.LazyFrame:
+    lf = pl.scan_parquet(path)
+    names = lf.collect_schema().names()
+    rename_dict = {old: new for old, new in RENAME_MAPPING.items() if old in names and old != new}
+    return lf.rename(rename_dict) if rename_dict else lf
+
+
+def _processed_company_numbers(sources: List[Path]) -> pl.Series:
+    if not sources:
+        return pl.Series("CompanyNumber", [], dtype=pl.Utf8)
+    return (
+        pl.concat([
+            _scan_with_output_names(p).select(pl.col("Company Number").cast(pl.Utf8))
+            for p in sources
+        ])
+        .unique()
+        .collect()
+        .to_series()
+        .rename("CompanyNumber")
+    )
+
+
+def _write_final_output(sources: List[Path], output_path: Path, checkpoint_path: Path, shard_dir: Path) -> int:
+    """
+    Stream all checkpoint sources into the final output with output column
+    names and ordering, then fold the shards into a single merged checkpoint.
+    """
+    result = pl.concat([_scan_with_output_names(p) for p in sources], how="diagonal_relaxed")
 
-        first_token = tokens[0].lower().rstrip(".")
+    # ===== Column ordering =====
+    columns = result.collect_schema().names()
+    existing_cols = set(columns)
+    ordered_cols = [c for c in FINAL_COL_ORDER if c in existing_cols]
+    remaining_cols = [c for c in columns if c not in FINAL_COL_ORDER]
+    result = result.select(ordered_cols + remaining_cols).with_columns(
+        pl.col(c).cast(pl.Utf8).cast(pl.Categorical) for c in OUTPUT_CATEGORICAL_COLS if c in existing_cols
+    )
 
-        if first_token in titles:
-            name_part = " ".join(tokens[1:]).lower()
+    logger.info(f"Writing enriched output to {output_path}")
+    result.sink_parquet(
+        output_path,
+        compression="zstd",
+        compression_level=OUTPUT_COMPRESSION_LEVEL,
+        row_group_size=OUTPUT_ROW_GROUP_SIZE,
+    )
 
-            if officer_first in name_part and officer_last in name_part:
-                return first_token.title()
+    if output_path.resolve() != checkpoint_path.resolve():
+        shutil.copyfile(output_path, checkpoint_path)
+    if shard_dir.exists():
+        shutil.rmtree(shard_dir)
 
-    return ""
+    return int(pl.scan_parquet(output_path).select(pl.len()).collect().item())
 
 
 # ============ ENRICHMENT SERVICE ============
@@ -277,68 +908,46 @@ def enrich_company_data(
     total_input = input_df.height
     logger.info(f"Loaded {total_input:,} companies")
 
-    client = CompaniesHouseClient(API_KEY)
+    _require_api_key(API_KEY)
 
     stem = input_path.stem
     timestamp = time.strftime("%Y%m%d_%H%M%S")
 
     output_path = Path(output_path) if output_path else ENRICHMENT_OUTPUT_DIR / f"{stem}_enriched_{timestamp}.parquet"
     checkpoint_path = Path(checkpoint_path) if checkpoint_path else ENRICHMENT_OUTPUT_DIR / f"{stem}_checkpoint.parquet"
+    # One shard per batch lives next to the merged checkpoint until the run completes
+    shard_dir = checkpoint_path.with_suffix("")
 
-    processed_numbers = set()
-    if resume and checkpoint_path.exists():
-        logger.info("Resuming from checkpoint...")
-        checkpoint_df = pl.read_parquet(checkpoint_path)
-        
-        # Rename checkpoint columns if they exist with old names
-        checkpoint_rename = {
-            "CompanyNumber": "Company Number",
-            "BusinessName": "Business Name",
-        }
-        checkpoint_rename_dict = {old: new for old, new in checkpoint_rename.items() if old in checkpoint_df.columns}
-        if checkpoint_rename_dict:
-            checkpoint_df = checkpoint_df.rename(checkpoint_rename_dict)
-            logger.info(f"Renamed checkpoint columns: {list(checkpoint_rename_dict.keys())}")
-        
-        # Use the correct column name (after potential rename)
-        company_col = "Company Number" if "Company Number" in checkpoint_df.columns else "CompanyNumber"
-        processed_numbers = set(checkpoint_df[company_col].to_list())
-        logger.info(f"Found {len(processed_numbers)} already processed companies")
-    else:
-        checkpoint_df = None
+    if not resume:
+        checkpoint_path.unlink(missing_ok=True)
+        if shard_dir.exists():
+            shutil.rmtree(shard_dir)
+
+    sources = _checkpoint_sources(checkpoint_path, shard_dir)
+    processed_series = _processed_company_numbers(sources)
+    if sources:
+        logger.info(f"Resuming from checkpoint: found {processed_series.len()} already processed companies")
 
-    df_to_process = input_df.filter(~pl.col("CompanyNumber").is_in(list(processed_numbers)))
+    df_to_process = input_df.filter(~pl.col("CompanyNumber").is_in(processed_series))
     total_to_process = df_to_process.height
     logger.info(f"Companies to enrich: {total_to_process:,}")
 
     if total_to_process == 0:
         logger.info("No new companies to process")
 
-        if checkpoint_path.exists():
-            logger.info(f"Writing final output from checkpoint to {output_path}")
-            checkpoint_df = pl.read_parquet(checkpoint_path)
-            
-            # Rename columns in checkpoint before writing final output
-            final_rename = {
-                "CompanyNumber": "Company Number",
-                "BusinessName": "Business Name",
-            }
-            final_rename_dict = {old: new for old, new in final_rename.items() if old in checkpoint_df.columns}
-            if final_rename_dict:
-                checkpoint_df = checkpoint_df.rename(final_rename_dict)
-                logger.info(f"Renamed final output columns: {list(final_rename_dict.keys())}")
-            
-            checkpoint_df.write_parquet(output_path, compression="zstd")
-        else:
+        if not sources:
             raise FileNotFoundError("Checkpoint file not found, cannot produce output file")
 
+        logger.info(f"Writing final output from checkpoint to {output_path}")
+        total_processed = _write_final_output(sources, output_path, checkpoint_path, shard_dir)
+
         return {
             "output_file": str(output_path),
             "checkpoint_file": str(checkpoint_path),
             "enrichment_stats": {
-                "total_processed": len(processed_numbers),
+                "total_processed": total_processed,
                 "newly_enriched": 0,
-                "from_checkpoint": len(processed_numbers)
+                "from_checkpoint": int(processed_series.len())
             }
         }
 
@@ -349,184 +958,27 @@ def enrich_company_data(
         "with_officers": 0
     }
 
-    batch_rows = []
-
-    for idx, row in enumerate(tqdm(df_to_process.iter_rows(named=True), total=total_to_process, desc="Enriching")):
-        company_number = row["CompanyNumber"]
-
-        if progress_callback:
-            progress_callback(idx + 1)
-
-        profile = client.get_company_profile(company_number)
-        if profile:
-            stats["api_success"] += 1
-            psc_items = client.get_psc(company_number)
-            officers = client.get_officers(company_number)
-        else:
-            stats["api_fail"] += 1
-            psc_items, officers = [], []
-
-        # ===== PSC-based selection with STRICT priority =====
-        selected_psc, share_tier, psc_noc = pick_psc_by_ownership(psc_items)
-        
-        psc_title = ""
-        psc_first = ""
-        psc_last = ""
-        
-        # Extract name parts from selected PSC
-        if selected_psc:
-            selected_psc_name = selected_psc.get("name", "")
-            if selected_psc_name:
-                tokens = selected_psc_name.split()
-                titles = {"mr", "mrs", "ms", "miss", "dr", "sir", "lady", "prof"}
-                
-                # Extract title if present
-                if tokens and tokens[0].lower().rstrip(".") in titles:
-                    psc_title = tokens[0].rstrip(".").title()
-                    tokens = tokens[1:]  # Remove title from tokens
-                
-                # Extract first and last name from remaining tokens
-                if len(tokens) >= 2:
-                    psc_first = tokens[0]
-                    psc_last = tokens[-1]
-                elif len(tokens) == 1:
-                    psc_last = tokens[0]
-
-        if psc_items:
-            stats["with_psc"] += 1
-        if officers:
-            stats["with_officers"] += 1
-
-        # Parse officer names for fallback (only individual persons, not entities)
-        officer_names = []
-        for o in officers:
-            # Skip corporate entities - they typically have "appointed_on" but no "name" with comma
-            officer_name = o.get("name", "")
-            if officer_name and "," in officer_name:  # Individual format: "SURNAME, Firstname"
-                first, last = parse_officer_name(officer_name)
-                if first or last:  # Valid individual officer
-                    officer_names.append((first, last))
+    shard_dir.mkdir(parents=True, exist_ok=True)
 
-        # All PSC names for PersonWithSignificantControl field
-        psc_names = "; ".join(p.get("name", "") for p in psc_items if p.get("name"))
-
-        # First officer details for title extraction fallback
-        first_officer_first = officer_names[0][0] if officer_names else ""
-        first_officer_last = officer_names[0][1] if officer_names else ""
-
-        # Initialize tracking variables
-        selected_source = ""
-        selected_share_tier = ""
-        selected_noc = ""
-
-        # OVERRIDE: Use PSC data if available, otherwise first INDIVIDUAL officer
-        if psc_first or psc_last or psc_title:
-            # PSC data available - use it
-            final_title = psc_title
-            final_first = psc_first
-            final_last = psc_last
-            selected_source = f"PSC: {selected_psc.get('name', '')}"
-            selected_share_tier = share_tier
-            selected_noc = psc_noc
-        elif officer_names:
-            # No PSC, use first individual officer
-            final_title = extract_title_from_psc(psc_names, first_officer_first, first_officer_last)
-            final_first = first_officer_first
-            final_last = first_officer_last
-            selected_source = "First Officer"
-            selected_share_tier = ""
-            selected_noc = ""
-        else:
-            # No PSC, no individual officers
-            final_title = ""
-            final_first = ""
-            final_last = ""
-            selected_source = ""
-            selected_share_tier = ""
-            selected_noc = ""
-
-        # Position: semicolon-separated list of officer roles
-        officer_positions = "; ".join(o.get("officer_role", "") for o in officers if o.get("officer_role"))
-
-        enriched = {
-            **row,
-            "PersonWithSignificantControl": psc_names,
-            "NatureOfControl": "; ".join(set(n for p in psc_items for n in p.get("natures_of_control", []))),
-            "Title": final_title,
-            "Fname": final_first,
-            "Sname": final_last,
-            "SelectedPersonSource": selected_source,
-            "SelectedPSCShareTier": selected_share_tier,
-            "SelectedPSCNatureOfControl": selected_noc,
-            "Position": officer_positions,
-            "CompanyStatus": profile.get("company_status", ""),
-            "CompanyType": profile.get("type", ""),
-            "DateOfCreation": profile.get("date_of_creation", ""),
-            "Website": "",
-            "Phone": "",
-            "Email": "",
-            "WebsiteAddress": "",
-            "AddressMatch(RegVsWeb)": "",
-        }
-
-        batch_rows.append(enriched)
-
-        if (idx + 1) % batch_size == 0:
-            batch_df = pl.DataFrame(batch_rows)
-            if checkpoint_df is not None:
-                checkpoint_df = pl.concat([checkpoint_df, batch_df])
-            else:
-                checkpoint_df = batch_df
-
-            checkpoint_df.write_parquet(checkpoint_path)
-            batch_rows.clear()
-            gc.collect()
-            logger.info(f"✓ Checkpoint saved: {idx + 1}/{total_to_process}")
-
-    if batch_rows:
-        final_batch = pl.DataFrame(batch_rows)
-        if checkpoint_df is not None:
-            result = pl.concat([checkpoint_df, final_batch])
-        else:
-            result = final_batch
-        batch_rows.clear()
+    # Keeps the public signature synchronous; callers run this in a worker thread
+    if USE_ASYNC_CLIENT:
+        asyncio.run(
+            _enrich_rows(df_to_process, shard_dir, batch_size, stats, progress_callback)
+        )
     else:
-        result = checkpoint_df
-
-    # ===== Column renaming to match expected names =====
-    rename_mapping = {
-        "CompanyNumber": "Company Number",
-        "BusinessName": "Business Name",
-        "AddressLine1": "Add1",
-        "AddressLine2": "Add2",
-        "Town": "Town",
-        "County": "County",
-        "Postcode": "Post Code",
-    }
+        _enrich_rows_threaded(df_to_process, shard_dir, batch_size, stats, progress_callback)
 
-    # Only rename columns that exist in the dataframe
-    rename_dict = {old: new for old, new in rename_mapping.items() if old in result.columns}
-    if rename_dict:
-        result = result.rename(rename_dict)
-        logger.info(f"Renamed columns: {list(rename_dict.keys())}")
-
-    # ===== Column ordering =====
-    existing_cols = set(result.columns)
-    ordered_cols = [c for c in FINAL_COL_ORDER if c in existing_cols]
-    remaining_cols = [c for c in result.columns if c not in FINAL_COL_ORDER]
-    result = result.select(ordered_cols + remaining_cols)
-
-    logger.info(f"Writing enriched output to {output_path}")
-    result.write_parquet(output_path, compression="zstd")
-    result.write_parquet(checkpoint_path)
+    total_processed = _write_final_output(
+        _checkpoint_sources(checkpoint_path, shard_dir), output_path, checkpoint_path, shard_dir
+    )
 
     return {
         "output_file": str(output_path),
         "checkpoint_file": str(checkpoint_path),
         "enrichment_stats": {
-            "total_processed": int(result.height),
+            "total_processed": total_processed,
             "newly_enriched": int(total_to_process),
-            "from_checkpoint": int(len(processed_numbers)),
+            "from_checkpoint": int(processed_series.len()),
             "api_success": int(stats["api_success"]),
             "api_failures": int(stats["api_fail"]),
             "coverage": {
@@ -534,4 +986,4 @@ def enrich_company_data(
                 "officers": f"{stats['with_officers']/max(total_to_process,1)*100:.1f}%"
             }
         }
-    }
\ No newline at end of file
+    }
@@ -15,7 +15,7 @@ Design:
     - Uses real search layer (Serper.dev / Google)
     - Primary source: Endole
     - Visits website to extract address
-    - LLM used only for:
+    - LLM used only for (one call per page):
         * Field extraction from pages
         * Address normalization
     - Deterministic confidence scoring
@@ -25,14 +25,19 @@ Design:
 
 import os
 import time
+import shutil
+import asyncio
 import logging
-import requests
 from pathlib import Path
 from typing import Dict, Optional, List, Callable
+import httpx
+import orjson
 import polars as pl
 from tqdm import tqdm
 import gc
 
+from app.services.enrichment import RENAME_MAPPING, AsyncRateLimiter, CheckpointInterval
+
 logger = logging.getLogger(__name__)
 
 # ============ CONFIG ============
@@ -47,18 +52,28 @@ HEADERS_SERPER = {"X-API-KEY": SERPER_API_KEY, "Content-Type": "application/json
 CONFIDENCE_REVIEW_THRESHOLD = 70
 
 API_DELAY = 1.5
+
+MAX_CONCURRENT_ROWS = 16  # rows in flight at once (search, fetch and LLM calls)
+SERPER_MIN_INTERVAL_SEC = float(os.getenv("SERPER_MIN_INTERVAL_SEC", "0.2"))
+
 # ============ HELPERS ============
 
-def call_serper(query: str) -> Dict:
+async def call_serper(http: httpx.AsyncClient, limiter: AsyncRateLimiter, query: str) -> Dict:
     payload = {"q": query, "num": 5}
-    r = requests.post(SERPER_URL, headers=HEADERS_SERPER, json=payload, timeout=30)
+    await limiter.wait()
+    r = await http.post(SERPER_URL, headers=HEADERS_SERPER, json=payload)
     r.raise_for_status()
-    return r.json()
+    try:
+        return orjson.loads(r.content)
+    except orjson.JSONDecodeError as e:
+        # Treated as no results rather than failing the whole batch
+        logger.warning(f"Serper returned invalid JSON for {query!r}: {e}")
+        return {}
 
 
-def fetch_url(url: str) -> str:
+async def fetch_url(http: httpx.AsyncClient, url: str) -> str:
     try:
-        r = requests.get(url, timeout=30, headers={"User-Agent": "Mozilla/5.0"})
+        r = await http.get(url, headers={"User-Agent": "Mozilla/5.0"})
         if r.status_code == 200:
             return r.text
     except Exception as e:
@@ -67,75 +82,66 @@ def fetch_url(url: str) -> str:
 
 
 # ---- LLM HELPERS ----
-def llm_extract_contact_fields(text: str) -> Dict:
+async def llm_json(oa, prompt: str) -> Dict:
     """
-    Extract phone, email, website from raw text.
-    Return 'Unreported' if missing.
+    Run a prompt in JSON mode and parse the reply.
+    Retries once if the model returns malformed JSON.
     """
-    from openai import OpenAI
-    client = OpenAI(api_key=OPENAI_API_KEY)
-
-    prompt = f"""
-You are extracting business contact information.
-
-From the text below, extract:
-- Phone
-- Email
-- Website
-
-Rules:
-- If a field is missing, return "Unreported"
-- Return JSON only
-
-TEXT:
-{text}
-"""
+    for attempt in range(2):
+        response = await oa.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0,
+            response_format={"type": "json_object"},
+        )
+        try:
+            return orjson.loads(response.choices[0].message.content)
+        except orjson.JSONDecodeError:
+            if attempt:
+                raise
+            logger.warning("LLM returned invalid JSON, retrying once")
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0
-    )
 
-    return eval(response.choices[0].message.content)
+ADDRESS_FIELDS = ("AddressLine1", "AddressLine2", "Town", "County", "Postcode")
 
 
-def llm_normalize_address(address_text: str) -> Dict:
+async def llm_extract_all(oa, text: str) -> Dict:
     """
-    Convert free-form UK address into:
-    AddressLine1, AddressLine2, Town, County, Postcode
+    Extract contact fields and the business address from raw page text in one call.
+    Returns {"contact": {Phone, Email, Website}, "address": {AddressLine1, ...}};
+    missing contact fields are 'Unreported', missing address fields are "".
     """
-    from openai import OpenAI
-    client = OpenAI(api_key=OPENAI_API_KEY)
-
     prompt = f"""
-Normalize this UK address into structured fields:
-- AddressLine1
-- AddressLine2
-- Town
-- County
-- Postcode
+You are extracting business contact information from a web page.
 
-Return JSON only. If any field missing, return empty string.
+From the text below, extract:
+- contact: Phone, Email, Website
+- address: the business's UK address as AddressLine1, AddressLine2, Town, County, Postcode
 
-ADDRESS:
-{address_text}
-"""
+Rules:
+- If a contact field is missing, return "Unreported"
+- If an address field is missing, return empty string
+- Return JSON only, shaped as {{"contact": {{...}}, "address": {{...}}}}
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0
-    )
+TEXT:
+{text}
+"""
 
-    return eval(response.choices[0].message.content)
+    data = await llm_json(oa, prompt)
+    address = data.get("address") or {}
+    return {
+        "contact": data.get("contact") or {},
+        "address": {k: str(address.get(k) or "") for k in ADDRESS_FIELDS},
+    }
 
 
 # ============ CORE LOGIC ============
 
-def search_endole(business_name: str, town: str, postcode: str) -> Optional[str]:
+async def search_endole(
+    http: httpx.AsyncClient, limiter: AsyncRateLimiter, business_name: str, town: str, postcode: str
+) -> Optional[str]:
     query = f"{business_name} {town} {postcode} site:endole.co.uk"
-    data = call_serper(query)
+    data = await call_serper(http, limiter, query)
 
     for r in data.get("organic", []):
         if "endole.co.uk" in r.get("link", ""):
@@ -156,6 +162,143 @@ def calculate_confidence(found_on_endole, has_website, has_phone, has_email,
     return min(score, 100)
 
 
+async def process_row_v2(row: Dict, http: httpx.AsyncClient, oa, limiter: AsyncRateLimiter) -> Dict:
+    """Search, fetch and LLM steps for one company; returns the enriched row."""
+    business = row.get("BusinessName", "")
+    town = row.get("Town", "")
+    postcode = row.get("Postcode", "")
+
+    found_on_endole = False
+    website = phone = email = "Unreported"
+    website_address = {}
+    address_match = False
+    normalized_address = False
+    llm_ok = False
+
+    # ---- SEARCH ENDOLE ----
+    endole_url = await search_endole(http, limiter, business, town, postcode)
+    if endole_url:
+        found_on_endole = True
+        endole_text = await fetch_url(http, endole_url)
+        try:
+            extracted = (await llm_extract_all(oa, endole_text))["contact"]
+            website = extracted.get("Website", "Unreported")
+            phone = extracted.get("Phone", "Unreported")
+            email = extracted.get("Email", "Unreported")
+            llm_ok = True
+        except Exception:
+            pass
+
+    # ---- VISIT WEBSITE ----
+    if website and website != "Unreported":
+        site_text = await fetch_url(http, website)
+        if site_text:
+            try:
+                site_address = (await llm_extract_all(oa, site_text))["address"]
+                if any(site_address.values()):
+                    website_address = site_address
+                    normalized_address = True
+
+                    reg_address = " ".join([
+                        str(row.get("AddressLine1", "")),
+                        str(row.get("AddressLine2", "")),
+                        str(row.get("Town", "")),
+                        str(row.get("County", "")),
+                        str(row.get("Postcode", ""))
+                    ]).lower()
+
+                    website_addr_text = " ".join(website_address.values()).lower()
+                    if website_addr_text == reg_address:
+                        address_match = True
+            except Exception:
+                pass
+
+    # ---- CONFIDENCE ----
+    confidence = calculate_confidence(
+        found_on_endole,
+        website != "Unreported",
+        phone != "Unreported",
+        email != "Unreported",
+        address_match,
+        normalized_address,
+        llm_ok
+    )
+
+    review_flag = confidence < CONFIDENCE_REVIEW_THRESHOLD
+
+    enriched = {
+        **row,
+        "Website": website,
+        "Phone": phone,
+        "Email": email,
+        "WebsiteAddressLine1": website_address.get("AddressLine1", ""),
+        "WebsiteAddressLine2": website_address.get("AddressLine2", ""),
+        "WebsiteTown": website_address.get("Town", ""),
+        "WebsiteCounty": website_address.get("County", ""),
+        "WebsitePostcode": website_address.get("Postcode", ""),
+        "WebsiteAddressMatch": "Match" if address_match else "Different" if website_address else "Unreported",
+        "ConfidenceScore": confidence,
+        "ReviewFlag": review_flag
+    }
+    return enriched
+
+
+async def _enrich_rows_v2(
+    to_process: pl.DataFrame,
+    cached_rows: Dict[str, Dict],
+    interval: CheckpointInterval,
+    write_shard: Callable[[List[Dict]], None],
+    progress_callback=None,
+):
+    """
+    Enrich `interval.rows` rows at a time, up to MAX_CONCURRENT_ROWS in flight,
+    writing one checkpoint shard per batch. Cache hits are passed through.
+    """
+    from openai import AsyncOpenAI
+
+    total = to_process.height
+    processed_count = 0
+    sem = asyncio.Semaphore(MAX_CONCURRENT_ROWS)
+    limiter = AsyncRateLimiter(SERPER_MIN_INTERVAL_SEC)
+
+    async with httpx.AsyncClient(
+        timeout=30,
+        follow_redirects=True,
+        limits=httpx.Limits(max_connections=MAX_CONCURRENT_ROWS * 2),
+    ) as http, AsyncOpenAI(api_key=OPENAI_API_KEY) as oa:
+        with tqdm(total=total, desc="Advanced Enrichment") as pbar:
+
+            async def run_row(row: Dict) -> Dict:
+                nonlocal processed_count
+                cached_row = cached_rows.get(row.get("CompanyNumber"))
+                if cached_row is not None:
+                    pbar.update(1)
+                    return cached_row
+
+                async with sem:
+                    enriched = await process_row_v2(row, http, oa, limiter)
+
+                processed_count += 1
+                pbar.update(1)
+                if progress_callback:
+                    progress_callback(processed_count, total)
+                return enriched
+
+            offset = 0
+            while offset < total:
+                batch = to_process.slice(offset, interval.rows)
+                offset += batch.height
+
+                batch_start = time.monotonic()
+                batch_rows = await asyncio.gather(
+                    *[run_row(r) for r in batch.iter_rows(named=True)]
+                )
+                write_start = time.monotonic()
+                write_shard(batch_rows)
+                interval.record(batch.height, write_start - batch_start, time.monotonic() - write_start)
+                gc.collect()
+
+
 # ============ MAIN SERVICE ============
 
 def enrich_company_data_v2(
@@ -171,18 +314,17 @@ def enrich_company_data_v2(
     """
     cache_path = Path("outputs/enriched/v2_cache.parquet")
 
+    # Only the key -> row index is kept; the cache frame itself is re-scanned
+    # when the cache is updated at the end of the run
+    cached_rows = {}
     if cache_path.exists():
         try:
-            cache_df = pl.read_parquet(cache_path)
-            cached_keys = set(cache_df["CompanyNumber"].to_list())
-            logger.info(f"Loaded {len(cached_keys)} cached companies for v2")
+            cached_rows = {
+                r["CompanyNumber"]: r for r in pl.read_parquet(cache_path).iter_rows(named=True)
+            }
+            logger.info(f"Loaded {len(cached_rows)} cached companies for v2")
         except Exception as e:
             logger.warning(f"⚠️ Cache file corrupted, resetting: {e}")
-            cache_df = None
-            cached_keys = set()
-    else:
-        cache_df = None
-        cached_keys = set()
 
 
     input_path = Path(input_path)
@@ -191,6 +333,15 @@ def enrich_company_data_v2(
 
     df = pl.read_parquet(input_path)
 
+    # Enrichment 1.0 writes display names ("Company Number", "Post Code", ...);
+    # map them back so its output can be fed in directly
+    restore = {
+        new: old for old, new in RENAME_MAPPING.items()
+        if old != new and new in df.columns and old not in df.columns
+    }
+    if restore:
+        df = df.rename(restore)
+
     required_cols = {"CompanyNumber", "BusinessName", "Town", "Postcode"}
     if not required_cols.issubset(set(df.columns)):
         raise ValueError("Dataset must be Enrichment 1.0 output before running Enrichment 2.0")
@@ -215,144 +366,69 @@ def enrich_company_data_v2(
         }
 
 
-    processed = set()
-    if resume and checkpoint_path.exists():
-        checkpoint_df = pl.read_parquet(checkpoint_path)
-        processed = set(checkpoint_df["CompanyNumber"].to_list())
-    else:
-        checkpoint_df = None
-
-    to_process = df.filter(~pl.col("CompanyNumber").is_in(list(processed)))
-    total = to_process.height
-
-    batch_rows = []
-    processed_count = 0
-
-    for idx, row in enumerate(tqdm(to_process.iter_rows(named=True), total=total, desc="Advanced Enrichment")):
-        company_key = row.get("CompanyNumber")
-
-        if company_key in cached_keys:
-            cached_row = cache_df.filter(pl.col("CompanyNumber") == company_key).to_dicts()[0]
-            batch_rows.append(cached_row)
-            continue
-
-        business = row.get("BusinessName", "")
-        town = row.get("Town", "")
-        postcode = row.get("Postcode", "")
-
-        found_on_endole = False
-        website = phone = email = "Unreported"
-        website_address = {}
-        address_match = False
-        normalized_address = False
-        llm_ok = False
-
-        # ---- SEARCH ENDOLE ----
-        endole_url = search_endole(business, town, postcode)
-        if endole_url:
-            found_on_endole = True
-            endole_text = fetch_url(endole_url)
-            try:
-                extracted = llm_extract_contact_fields(endole_text)
-                website = extracted.get("Website", "Unreported")
-                phone = extracted.get("Phone", "Unreported")
-                email = extracted.get("Email", "Unreported")
-                llm_ok = True
-            except Exception:
-                pass
-
-        # ---- VISIT WEBSITE ----
-        if website and website != "Unreported":
-            site_text = fetch_url(website)
-            if site_text:
-                try:
-                    addr_data = llm_extract_contact_fields(site_text)
-                    raw_address = addr_data.get("Address", "")
-                    if raw_address:
-                        website_address = llm_normalize_address(raw_address)
-                        normalized_address = True
-
-                        reg_address = " ".join([
-                            str(row.get("AddressLine1", "")),
-                            str(row.get("AddressLine2", "")),
-                            str(row.get("Town", "")),
-                            str(row.get("County", "")),
-                            str(row.get("Postcode", ""))
-                        ]).lower()
-
-                        website_addr_text = " ".join(website_address.values()).lower()
-                        if website_addr_text == reg_address:
-                            address_match = True
-                except Exception:
-                    pass
-
-        # ---- CONFIDENCE ----
-        confidence = calculate_confidence(
-            found_on_endole,
-            website != "Unreported",
-            phone != "Unreported",
-            email != "Unreported",
-            address_match,
-            normalized_address,
-            llm_ok
+    # Each batch is appended as its own shard; the merged checkpoint file is
+    # only rewritten once, when the run completes
+    shard_dir = checkpoint_path.with_suffix("")
+    if not resume:
+        checkpoint_path.unlink(missing_ok=True)
+        if shard_dir.exists():
+            shutil.rmtree(shard_dir)
+    shard_dir.mkdir(parents=True, exist_ok=True)
+
+    def checkpoint_sources() -> List[Path]:
+        sources = [checkpoint_path] if checkpoint_path.exists() else []
+        return sources + sorted(shard_dir.glob("*.parquet"))
+
+    sources = checkpoint_sources()
+    if sources:
+        processed = (
+            pl.concat([pl.scan_parquet(p).select(pl.col("CompanyNumber").cast(pl.Utf8)) for p in sources])
+            .unique()
+            .collect()
+            .to_series()
         )
-
-        review_flag = confidence < CONFIDENCE_REVIEW_THRESHOLD
-
-        enriched = {
-            **row,
-            "Website": website,
-            "Phone": phone,
-            "Email": email,
-            "WebsiteAddressLine1": website_address.get("AddressLine1", ""),
-            "WebsiteAddressLine2": website_address.get("AddressLine2", ""),
-            "WebsiteTown": website_address.get("Town", ""),
-            "WebsiteCounty": website_address.get("County", ""),
-            "WebsitePostcode": website_address.get("Postcode", ""),
-            "WebsiteAddressMatch": "Match" if address_match else "Different" if website_address else "Unreported",
-            "ConfidenceScore": confidence,
-            "ReviewFlag": review_flag
-        }
-
-        batch_rows.append(enriched)
-        processed_count += 1
-
-        if progress_callback:
-            progress_callback(processed_count, total)
-
-        if processed_count % batch_size == 0:
-            batch_df = pl.DataFrame(batch_rows)
-            checkpoint_df = pl.concat([checkpoint_df, batch_df]) if checkpoint_df is not None else batch_df
-            checkpoint_df.write_parquet(checkpoint_path)
-            batch_rows.clear()
-            gc.collect()
-
-    if batch_rows:
-        final_df = pl.DataFrame(batch_rows)
-        result = pl.concat([checkpoint_df, final_df]) if checkpoint_df is not None else final_df
     else:
-        result = checkpoint_df
-
+        processed = pl.Series("CompanyNumber", [], dtype=pl.Utf8)
 
-    # Persist new enriched rows to v2 cache
-    if batch_rows:
-        new_cache_df = pl.DataFrame(batch_rows)
-        if cache_df is not None:
-            cache_df = pl.concat([cache_df, new_cache_df])
-        else:
-            cache_df = new_cache_df
+    to_process = df.filter(~pl.col("CompanyNumber").is_in(processed))
 
-        cache_df.write_parquet(cache_path)
+    shard_idx = len(sources) - checkpoint_path.exists()
 
+    def write_shard(batch_rows: List[Dict]):
+        nonlocal shard_idx
+        pl.DataFrame(batch_rows).write_parquet(
+            shard_dir / f"{shard_idx:06d}.parquet",
+            compression="zstd",
+            statistics=False,
+        )
+        shard_idx += 1
+
+    # Keeps the public signature synchronous; callers run this in a worker thread
+    interval = CheckpointInterval(shard_dir, batch_size)
+    asyncio.run(_enrich_rows_v2(to_process, cached_rows, interval, write_shard, progress_callback))
+
+    # Stream checkpoint + shards into the output without materializing them
+    result = pl.concat([pl.scan_parquet(p) for p in checkpoint_sources()], how="diagonal_relaxed")
+    result.sink_parquet(output_path, compression="zstd")
+    if output_path.resolve() != checkpoint_path.resolve():
+        shutil.copyfile(output_path, checkpoint_path)
+    shutil.rmtree(shard_dir)
+
+    # Persist enriched rows to v2 cache (existing cache entries win)
+    output_lf = pl.scan_parquet(output_path)
+    cache_lf = (
+        pl.concat([pl.scan_parquet(cache_path), output_lf], how="diagonal_relaxed")
+        if cached_rows else output_lf
+    )
+    cache_lf.unique("CompanyNumber", keep="first", maintain_order=True).collect().write_parquet(cache_path)
 
-    result.write_parquet(output_path)
-    result.write_parquet(checkpoint_path)
+    total_processed = output_lf.select(pl.len()).collect().item()
 
     return {
         "output_file": str(output_path),
         "checkpoint_file": str(checkpoint_path),
         "advanced_enrichment_stats": {
-            "total_processed": int(result.height),
+            "total_processed": int(total_processed),
             "confidence_threshold": CONFIDENCE_REVIEW_THRESHOLD
         }
     }
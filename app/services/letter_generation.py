@@ -1,21 +1,45 @@
 import pandas as pd
+import polars as pl
 import sys
 import os
+import re
 from docx import Document
+from docx.opc.oxml import serialize_part_xml
+from docx.oxml import parse_xml
+from docx.oxml.ns import qn
 from docx.shared import Pt, RGBColor
 from docx.enum.text import WD_BREAK
 import zipfile
+import zlib
+import struct
 import io
 from datetime import datetime
 import argparse
-from typing import Any, Dict, Optional, List
+from typing import Any, BinaryIO, Dict, Iterator, NamedTuple, Optional, List, Tuple, Union
 from pathlib import Path
 import copy
 import tempfile
+from contextlib import closing
+from functools import lru_cache
+from bisect import bisect_right
+from itertools import accumulate
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 from docx.oxml import OxmlElement
+from lxml import etree
 from docx.enum.section import WD_SECTION
 from docxcompose.composer import Composer
 
+# Fastest available deflate for the per-letter document.xml: ISA-L, then
+# zlib-ng, then stdlib. Static template parts are deflated once with zlib -9.
+try:
+    from isal import isal_zlib as deflate_zlib
+except ImportError:
+    try:
+        from zlib_ng import zlib_ng as deflate_zlib
+    except ImportError:
+        import zlib as deflate_zlib
+
 
 # ================= CONFIG =================
 
@@ -31,113 +55,195 @@ REQUIRED_COLUMNS = [
     "Post Code",
 ]
 
+# Placeholder keys in substitution order; the combined salutation comes last
+COLUMN_PLACEHOLDERS = [f"{{{col}}}" for col in REQUIRED_COLUMNS]
+SALUTATION_PLACEHOLDER = "{Title} {Sname}"
+# Positions in a prepared row tuple (columns follow REQUIRED_COLUMNS)
+TITLE_IDX = REQUIRED_COLUMNS.index("Title")
+SNAME_IDX = REQUIRED_COLUMNS.index("Sname")
+PLACEHOLDER_KEYS = COLUMN_PLACEHOLDERS + [SALUTATION_PLACEHOLDER]
+PLACEHOLDER_RE = re.compile("|".join(map(re.escape, PLACEHOLDER_KEYS)))
+# Position of each placeholder's value in placeholder_values(row)
+PLACEHOLDER_INDEX = {key: i for i, key in enumerate(PLACEHOLDER_KEYS)}
+
+# Cells pandas reads as NaN by default; the polars CSV path blanks the same values
+PANDAS_NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND",
+    "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+]
+
+DOCUMENT_PART = "word/document.xml"
+
+W_P = qn("w:p")
+W_T = qn("w:t")
+W_SECTPR = qn("w:sectPr")
+XML_SPACE = qn("xml:space")
+# Text of runs directly in the paragraph or inside a hyperlink
+PARAGRAPH_TEXT_XPATH = "./w:r/w:t | ./w:hyperlink/w:r/w:t"
+
+# Letters are rendered across processes once a batch is big enough to
+# amortize worker start-up (workers are spawned, not forked, since the
+# service runs inside a threaded web server)
+RENDER_WORKERS = int(os.getenv("LETTER_RENDER_WORKERS", os.cpu_count() or 1))
+PARALLEL_MIN_LETTERS = 200
+RENDER_CHUNKSIZE = 32
+
+# Render by joining values into the pre-serialized document.xml instead of
+# filling and re-serializing an lxml tree per letter
+FAST_STRING_RENDER = os.getenv("LETTER_FAST_STRING_RENDER", "1") != "0"
+# Stand-in for a letter's body when splitting the serialized template
+BODY_MARKER = "letter-body"
+# str.translate tables: control characters XML 1.0 cannot carry are dropped
+# from every value; the string render path also escapes text the way lxml
+# serializes it (a carriage return becomes a character reference)
+CONTROL_CHAR_TABLE = str.maketrans("", "", "".join(
+    chr(c) for c in range(0x20) if chr(c) not in "\t\n\r"
+))
+XML_TEXT_TABLE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", "\r": "&#13;"})
+
 # ================= HELPERS =================
 
+class _SafeFilenameTable(dict):
+    """str.translate table: keep alphanumerics and " _-", map the rest to "_"."""
+
+    def __missing__(self, code: int):
+        char = chr(code)
+        value = code if char.isalnum() or char in " _-" else "_"
+        self[code] = value
+        return value
+
+
+_SAFE_FILENAME_TABLE = _SafeFilenameTable()
+
+
+@lru_cache(maxsize=4096)
 def safe_filename(name: str) -> str:
     """Create safe filename from business name."""
     if not name or not isinstance(name, str):
         return "letter"
-    return "".join(c if c.isalnum() or c in " _-" else "_" for c in name).strip()
+    return name.translate(_SAFE_FILENAME_TABLE).strip()
 
-def replace_placeholders_properly(doc: Document, mapping: dict):
+def merge_split_placeholders(root, pattern: re.Pattern = PLACEHOLDER_RE):
     """
-    Replace placeholders while PRESERVING formatting.
-    This is the key fix - we iterate through runs, not paragraphs.
+    Merge runs so that no placeholder straddles two <w:t> nodes.
+    The text goes into the first run the placeholder touches (keeping that
+    run's formatting) and the other runs are blanked. Row-independent, so it
+    runs once on the template.
     """
-    for paragraph in doc.paragraphs:
-        # Build full paragraph text to check for placeholders
-        full_text = paragraph.text
-        
-        # Check if any placeholder exists in this paragraph
-        has_placeholder = any(key in full_text for key in mapping.keys())
-        
-        if has_placeholder:
-            # We need to replace text while preserving runs
-            # Strategy: concatenate all run texts, do replacement, then redistribute
-            
-            # Collect all runs and their properties
-            runs_data = []
-            for run in paragraph.runs:
-                runs_data.append({
-                    'text': run.text,
-                    'bold': run.bold,
-                    'italic': run.italic,
-                    'underline': run.underline,
-                    'font_name': run.font.name,
-                    'font_size': run.font.size,
-                    'font_color': run.font.color.rgb if run.font.color.rgb else None
-                })
-            
-            # Get full text and perform replacements
-            full_text = ''.join([r['text'] for r in runs_data])
-            for key, value in mapping.items():
-                full_text = full_text.replace(key, value)
-            
-            # Clear all runs
-            for _ in range(len(paragraph.runs)):
-                paragraph.runs[0]._element.getparent().remove(paragraph.runs[0]._element)
-            
-            # Add new run with replaced text, using first run's formatting as template
-            if runs_data:
-                new_run = paragraph.add_run(full_text)
-                template = runs_data[0]
-                new_run.bold = template['bold']
-                new_run.italic = template['italic']
-                new_run.underline = template['underline']
-                if template['font_name']:
-                    new_run.font.name = template['font_name']
-                if template['font_size']:
-                    new_run.font.size = template['font_size']
-                if template['font_color']:
-                    new_run.font.color.rgb = template['font_color']
-            else:
-                paragraph.add_run(full_text)
-    
-    # Also handle tables
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                for paragraph in cell.paragraphs:
-                    full_text = paragraph.text
-                    has_placeholder = any(key in full_text for key in mapping.keys())
-                    
-                    if has_placeholder:
-                        # Same strategy for table cells
-                        runs_data = []
-                        for run in paragraph.runs:
-                            runs_data.append({
-                                'text': run.text,
-                                'bold': run.bold,
-                                'italic': run.italic,
-                                'underline': run.underline,
-                                'font_name': run.font.name,
-                                'font_size': run.font.size,
-                                'font_color': run.font.color.rgb if run.font.color.rgb else None
-                            })
-                        
-                        full_text = ''.join([r['text'] for r in runs_data])
-                        for key, value in mapping.items():
-                            full_text = full_text.replace(key, value)
-                        
-                        # Clear runs
-                        for _ in range(len(paragraph.runs)):
-                            paragraph.runs[0]._element.getparent().remove(paragraph.runs[0]._element)
-                        
-                        # Add new run
-                        if runs_data:
-                            new_run = paragraph.add_run(full_text)
-                            template = runs_data[0]
-                            new_run.bold = template['bold']
-                            new_run.italic = template['italic']
-                            new_run.underline = template['underline']
-                            if template['font_name']:
-                                new_run.font.name = template['font_name']
-                            if template['font_size']:
-                                new_run.font.size = template['font_size']
-                            if template['font_color']:
-                                new_run.font.color.rgb = template['font_color']
-                        else:
-                            paragraph.add_run(full_text)
+    for paragraph in root.iter(W_P):
+        nodes = paragraph.xpath(PARAGRAPH_TEXT_XPATH)
+        if len(nodes) < 2:
+            continue
+        texts = [t.text or "" for t in nodes]
+        matches = list(pattern.finditer("".join(texts)))
+        if not matches:
+            continue
+
+        ends = list(accumulate(len(text) for text in texts))
+        head = list(range(len(nodes)))
+        for match in matches:
+            first = head[bisect_right(ends, match.start())]
+            last = bisect_right(ends, match.end() - 1)
+            for i in range(first + 1, last + 1):
+                texts[first] += texts[i]
+                texts[i] = ""
+                head[i] = first
+
+        for node, text in zip(nodes, texts):
+            if text != (node.text or ""):
+                node.text = text
+
+
+# (child-index path from the root to the <w:t>, literal strings and value indices)
+TextPlan = List[Tuple[Tuple[int, ...], Tuple[Union[str, int], ...]]]
+
+
+def _element_path(root, element) -> Tuple[int, ...]:
+    path = []
+    while element is not root:
+        parent = element.getparent()
+        path.append(parent.index(element))
+        element = parent
+    return tuple(reversed(path))
+
+
+def compile_text_plan(root, pattern: re.Pattern = PLACEHOLDER_RE) -> TextPlan:
+    """
+    Split every <w:t> holding a placeholder into literals and value indices,
+    so a letter is filled by joining row values in without any regex work.
+    Nodes are addressed by path, so paragraphs without placeholders are never
+    visited per letter. Expects merge_split_placeholders to have run on the tree.
+    """
+    plan = []
+    for node in root.iter(W_T):
+        text = node.text or ""
+        segments = []
+        pos = 0
+        for match in pattern.finditer(text):
+            if match.start() > pos:
+                segments.append(text[pos:match.start()])
+            segments.append(PLACEHOLDER_INDEX[match.group(0)])
+            pos = match.end()
+        if not segments:
+            continue
+        if pos < len(text):
+            segments.append(text[pos:])
+        # Values may start or end with spaces
+        node.set(XML_SPACE, "preserve")
+        plan.append((_element_path(root, node), tuple(segments)))
+    return plan
+
+
+def fill_placeholders(root, plan: TextPlan, values: tuple):
+    """Write one row's values into a copy of the template tree."""
+    for path, segments in plan:
+        node = root
+        for i in path:
+            node = node[i]
+        node.text = "".join(
+            segment if segment.__class__ is str else values[segment] for segment in segments
+        )
+
+def read_letter_csv(csv_path: str, engine: str = "pandas") -> pd.DataFrame:
+    """
+    Read a CSV as all-string columns.
+    "pandas" (default) uses pandas' C parser. "auto" opts in to polars'
+    multithreaded parser, falling back to pandas if it cannot parse the file.
+    """
+    if engine == "auto":
+        try:
+            # Columns take pandas' names (read from the header alone), so blank
+            # headers are still "Unnamed: n" for prepare_dataframe to drop and
+            # duplicates are "name.1". polars keeps blank lines as all-null
+            # rows where pandas skips them, so every all-empty row is dropped
+            # (unlike pandas, this includes rows such as ",,")
+            columns = list(pd.read_csv(csv_path, dtype=str, nrows=0).columns)
+            frame = pl.read_csv(
+                csv_path,
+                infer_schema=False,
+                new_columns=columns,
+                null_values=PANDAS_NA_VALUES,
+                missing_utf8_is_empty_string=False,
+            )
+            return frame.filter(~pl.all_horizontal(pl.all().is_null())).to_pandas()
+        except pl.exceptions.PolarsError:
+            pass
+    return pd.read_csv(csv_path, dtype=str)
+
+
+def read_letter_excel(excel_path: str, engine: str = "pandas") -> pd.DataFrame:
+    """
+    Read an Excel sheet as all-string columns.
+    "pandas" (default) uses pandas' default engine; "auto" opts in to the
+    calamine engine when python-calamine is installed.
+    """
+    if engine == "auto":
+        try:
+            return pd.read_excel(excel_path, dtype=str, engine="calamine")
+        except ImportError:
+            pass
+    return pd.read_excel(excel_path, dtype=str)
+
 
 def prepare_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     """
@@ -150,9 +256,6 @@ def prepare_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     # Remove unnamed columns
     df = df.loc[:, ~df.columns.str.contains("^Unnamed")]
     
-    # Fill NaN with empty string
-    df = df.fillna("")
-    
     # Case-insensitive header matching
     header_map = {col.lower(): col for col in df.columns}
     
@@ -166,20 +269,25 @@ def prepare_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     if missing:
         raise ValueError(f"Missing required columns: {missing}")
     
-    # Create DataFrame with properly named columns
-    clean_data = {}
-    for req_col in REQUIRED_COLUMNS:
-        req_lower = req_col.lower()
-        source_col = header_map[req_lower]
-        clean_data[req_col] = df[source_col].astype(str).str.strip()
-    
-    return pd.DataFrame(clean_data)
+    # Select and rename in one step, then fill and strip only those columns
+    rename_map = {header_map[req_col.lower()]: req_col for req_col in REQUIRED_COLUMNS}
+    out = df[list(rename_map)].rename(columns=rename_map).fillna("").astype(str)
+    return out.apply(lambda col: col.str.translate(CONTROL_CHAR_TABLE).str.strip())
+
+
+def escape_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    """XML-escape every value of a prepared DataFrame for the string render path."""
+    return df.apply(lambda col: col.str.translate(XML_TEXT_TABLE))
 
 
 def remove_trailing_empty_paragraphs(doc):
-    while doc.paragraphs and not doc.paragraphs[-1].text.strip():
-        p = doc.paragraphs[-1]._element
-        p.getparent().remove(p)
+    # One reverse pass over the body's <w:p> children; doc.paragraphs would
+    # re-run its XPath on every pop. <w:sectPr> is never matched.
+    body = doc.element.body
+    for p in reversed(body.findall(W_P)):
+        if "".join(t.text or "" for t in p.iter(W_T)).strip():
+            break
+        body.remove(p)
 
 
 def combine_letters_from_individual(letter_docs: List[bytes]) -> bytes:
@@ -247,10 +355,331 @@ def combine_letters_from_individual(letter_docs: List[bytes]) -> bytes:
     buffer.seek(0)
     return buffer.getvalue()
 
+class ZipMember(NamedTuple):
+    """A deflated ZIP entry ready to be written verbatim."""
+    name: bytes
+    dos_time: int
+    dos_date: int
+    crc: int
+    size: int
+    data: bytes
+
+
+def deflate_member(name: str, data: bytes, date_time: Tuple[int, ...], best: bool = False) -> ZipMember:
+    if best:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    else:
+        compressor = deflate_zlib.compressobj(wbits=-15)
+    packed = compressor.compress(data) + compressor.flush()
+    year, month, day, hour, minute, second = date_time
+    return ZipMember(
+        name.encode("utf-8"),
+        (hour << 11) | (minute << 5) | (second // 2),
+        ((year - 1980) << 9) | (month << 5) | day,
+        deflate_zlib.crc32(data),
+        len(data),
+        packed,
+    )
+
+
+def write_zip(members: List[ZipMember]) -> bytes:
+    """Assemble a ZIP archive from already-deflated members."""
+    buffer = io.BytesIO()
+    central = []
+    for m in members:
+        offset = buffer.tell()
+        buffer.write(struct.pack(
+            "<4s5H3L2H", b"PK\x03\x04", 20, 0x800, zipfile.ZIP_DEFLATED,
+            m.dos_time, m.dos_date, m.crc, len(m.data), m.size, len(m.name), 0,
+        ))
+        buffer.write(m.name)
+        buffer.write(m.data)
+        central.append(struct.pack(
+            "<4s6H3L5H2L", b"PK\x01\x02", 20, 20, 0x800, zipfile.ZIP_DEFLATED,
+            m.dos_time, m.dos_date, m.crc, len(m.data), m.size, len(m.name),
+            0, 0, 0, 0, 0, offset,
+        ) + m.name)
+    directory = b"".join(central)
+    directory_offset = buffer.tell()
+    buffer.write(directory)
+    buffer.write(struct.pack(
+        "<4s4H2LH", b"PK\x05\x06", 0, 0, len(members), len(members),
+        len(directory), directory_offset, 0,
+    ))
+    return buffer.getvalue()
+
+
+class StoredZipWriter:
+    """
+    Stream already-compressed files (DOCX letters) into a ZIP_STORED archive
+    written from the start of `stream`. CRC-32s come from the caller, so they
+    can be computed where the member was rendered, and members are written
+    without zipfile's per-entry Python overhead. ZIP64 records are added only
+    when the entry count or archive size needs them.
+    """
+
+    def __init__(self, stream: BinaryIO):
+        self._stream = stream
+        self._offset = 0
+        self._central: List[bytes] = []
+        now = datetime.now()
+        self._dos_time = (now.hour << 11) | (now.minute << 5) | (now.second // 2)
+        self._dos_date = ((now.year - 1980) << 9) | (now.month << 5) | now.day
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+
+    def write(self, name: str, data: bytes, crc: int):
+        encoded = name.encode("utf-8")
+        size = len(data)
+        header = struct.pack(
+            "<4s5H3L2H", b"PK\x03\x04", 20, 0x800, zipfile.ZIP_STORED,
+            self._dos_time, self._dos_date, crc, size, size, len(encoded), 0,
+        )
+        self._stream.write(header + encoded)
+        self._stream.write(data)
+
+        if self._offset > zipfile.ZIP64_LIMIT:
+            extra = struct.pack("<2HQ", 1, 8, self._offset)
+            version, offset = zipfile.ZIP64_VERSION, 0xFFFFFFFF
+        else:
+            extra = b""
+            version, offset = 20, self._offset
+        self._central.append(struct.pack(
+            "<4s6H3L5H2L", b"PK\x01\x02", version, version, 0x800, zipfile.ZIP_STORED,
+            self._dos_time, self._dos_date, crc, size, size, len(encoded),
+            len(extra), 0, 0, 0, 0, offset,
+        ) + encoded + extra)
+        self._offset += len(header) + len(encoded) + size
+
+    def close(self):
+        directory = b"".join(self._central)
+        count = len(self._central)
+        directory_offset = self._offset
+        self._stream.write(directory)
+        end_offset = directory_offset + len(directory)
+
+        if (count >= zipfile.ZIP_FILECOUNT_LIMIT or directory_offset > zipfile.ZIP64_LIMIT
+                or len(directory) > zipfile.ZIP64_LIMIT):
+            self._stream.write(struct.pack(
+                "<4sQ2H2L4Q", b"PK\x06\x06", 44, zipfile.ZIP64_VERSION, zipfile.ZIP64_VERSION,
+                0, 0, count, count, len(directory), directory_offset,
+            ))
+            self._stream.write(struct.pack("<4sLQL", b"PK\x06\x07", 0, end_offset, 1))
+            count = min(count, 0xFFFF)
+            directory_offset = min(directory_offset, 0xFFFFFFFF)
+        self._stream.write(struct.pack(
+            "<4s4H2LH", b"PK\x05\x06", 0, 0, count, count,
+            min(len(directory), 0xFFFFFFFF), directory_offset, 0,
+        ))
+
+
+class TemplateParts(NamedTuple):
+    members: List[ZipMember]  # every part, deflated once, in archive order
+    document_index: int  # position of word/document.xml in members
+    document_date_time: Tuple[int, ...]
+
+
+def load_template_parts(template_path: str) -> Tuple[TemplateParts, Any]:
+    """
+    Read every member of the template DOCX once.
+    Parts other than document.xml never change, so they are deflated here and
+    copied verbatim into each letter. Returns the parts and the parsed
+    document.xml root.
+    """
+    with zipfile.ZipFile(template_path) as zf:
+        infos = zf.infolist()
+        members = [
+            deflate_member(info.filename, zf.read(info), info.date_time, best=True) for info in infos
+        ]
+        document_index = next(i for i, info in enumerate(infos) if info.filename == DOCUMENT_PART)
+        document_xml = zf.read(DOCUMENT_PART)
+    parts = TemplateParts(members, document_index, infos[document_index].date_time)
+    return parts, parse_xml(document_xml)
+
+
+def pack_docx(parts: TemplateParts, document_root) -> bytes:
+    """Write a DOCX from the cached template parts with a new document.xml."""
+    return pack_docx_xml(parts, serialize_part_xml(document_root))
+
+
+def pack_docx_xml(parts: TemplateParts, document_xml: bytes) -> bytes:
+    """Write a DOCX from the cached template parts with already-serialized document.xml."""
+    members = list(parts.members)
+    members[parts.document_index] = deflate_member(
+        DOCUMENT_PART, document_xml, parts.document_date_time
+    )
+    return write_zip(members)
+
+
+def append_letter_body(master_root, letter_root):
+    """
+    Append a letter's body after a new-page section break in the master.
+    Every letter comes from the same template, so styles, numbering and
+    relationships already match and the body children can move as-is.
+    """
+    master_body = master_root.body
+    sentinel_sectPr = master_body.add_section_break()
+    sentinel_sectPr.start_type = WD_SECTION.NEW_PAGE
+    for child in list(letter_root.body):
+        if child.tag != W_SECTPR:
+            sentinel_sectPr.addprevious(child)
+
+
+def placeholder_values(row: tuple) -> tuple:
+    """Values for PLACEHOLDER_KEYS from one prepared row tuple."""
+    return row + (f"{row[TITLE_IDX]} {row[SNAME_IDX]}".strip(),)
+
+
+class StringTemplate(NamedTuple):
+    """Serialized document.xml cut into the pieces render_letters joins."""
+    head: str  # declaration and everything up to the first body child
+    body: Tuple[Union[str, int], ...]  # letter body: literals and value indices
+    tail: str  # body sectPr onwards, after a single letter
+    first_break: str  # section-break paragraph before the second letter
+    next_break: str  # section-break paragraph before each later letter
+    combined_tail: str  # sentinel sectPr onwards, after several letters
+
+
+def _split_on_markers(root) -> List[str]:
+    marker = f"<!--{BODY_MARKER}-->"
+    return serialize_part_xml(root).decode("utf-8").split(marker)
+
+
+def compile_string_template(root, plan: TextPlan,
+                            pattern: re.Pattern = PLACEHOLDER_RE) -> Optional[StringTemplate]:
+    """
+    Serialize the planned template once and cut it around the letter body and
+    the section breaks append_letter_body inserts. Returns None when the
+    string form cannot be trusted to match the tree render: no body sectPr,
+    the marker already in the template, or placeholder text outside the
+    planned <w:t> nodes (attributes, field codes, ...).
+    """
+    body = root.body
+    if len(body) == 0 or body[-1].tag != W_SECTPR:
+        return None
+
+    single = copy.deepcopy(root)
+    single.body.insert(0, etree.Comment(BODY_MARKER))
+    single.body[-1].addprevious(etree.Comment(BODY_MARKER))
+    pieces = _split_on_markers(single)
+    if len(pieces) != 3:
+        return None
+    head, body_xml, tail = pieces
+
+    segments = []
+    pos = 0
+    for match in pattern.finditer(body_xml):
+        if match.start() > pos:
+            segments.append(body_xml[pos:match.start()])
+        segments.append(PLACEHOLDER_INDEX[match.group(0)])
+        pos = match.end()
+    segments.append(body_xml[pos:])
+    planned = sum(1 for _, parts in plan for part in parts if part.__class__ is int)
+    if sum(1 for part in segments if part.__class__ is int) != planned:
+        return None
+
+    # Four bodies reduced to markers, joined like render_letters joins letters
+    def marked_letter():
+        letter = copy.deepcopy(root)
+        for child in list(letter.body)[:-1]:
+            letter.body.remove(child)
+        letter.body.insert(0, etree.Comment(BODY_MARKER))
+        return letter
+
+    combined = marked_letter()
+    for _ in range(3):
+        append_letter_body(combined, marked_letter())
+    pieces = _split_on_markers(combined)
+    if len(pieces) != 5 or pieces[0] != head or pieces[2] != pieces[3]:
+        return None
+    return StringTemplate(head, tuple(segments), tail, pieces[1], pieces[2], pieces[4])
+
+
+class LetterTemplate(NamedTuple):
+    parts: TemplateParts
+    root: Any  # document.xml with split placeholders already merged
+    plan: TextPlan
+    strings: Optional[StringTemplate]  # None renders through the lxml tree
+
+
+def load_letter_template(template_path: str, fast_string_render: bool = FAST_STRING_RENDER) -> LetterTemplate:
+    parts, root = load_template_parts(template_path)
+    merge_split_placeholders(root)
+    plan = compile_text_plan(root)
+    strings = compile_string_template(root, plan) if fast_string_render else None
+    return LetterTemplate(parts, root, plan, strings)
+
+
+def letter_rows(template: LetterTemplate, df: pd.DataFrame) -> List[tuple]:
+    """Row tuples of a prepared DataFrame in the form render_letters expects."""
+    if template.strings is not None:
+        df = escape_dataframe(df)
+    return list(df.itertuples(index=False, name=None))
+
+
+def render_letters_string(template: LetterTemplate, rows: List[tuple]) -> bytes:
+    """render_letters on the pre-serialized template; rows are already XML-escaped."""
+    strings = template.strings
+    out = [strings.head]
+    for i, row in enumerate(rows):
+        if i:
+            out.append(strings.first_break if i == 1 else strings.next_break)
+        values = placeholder_values(row)
+        out.extend(
+            segment if segment.__class__ is str else values[segment] for segment in strings.body
+        )
+    out.append(strings.tail if len(rows) == 1 else strings.combined_tail)
+    return pack_docx_xml(template.parts, "".join(out).encode("utf-8"))
+
+
+def render_letters(template: LetterTemplate, rows: List[tuple]) -> bytes:
+    """
+    Fill one copy of the template per row and return them as a single DOCX,
+    each letter after the first starting a new page section. Rows come from
+    letter_rows, which escapes them when the template renders as a string.
+    """
+    if template.strings is not None:
+        return render_letters_string(template, rows)
+
+    master_root = None
+    for row in rows:
+        root = copy.deepcopy(template.root)
+        fill_placeholders(root, template.plan, placeholder_values(row))
+        if master_root is None:
+            master_root = root
+        else:
+            append_letter_body(master_root, root)
+    return pack_docx(template.parts, master_root)
+
+
+# Per-process template, loaded once by the pool initializer
+_worker_template: Optional[LetterTemplate] = None
+
+
+def _init_render_worker(template_path: str, fast_string_render: bool):
+    global _worker_template
+    _worker_template = load_letter_template(template_path, fast_string_render)
+
+
+def render_member(template: LetterTemplate, rows: List[tuple]) -> Tuple[bytes, int]:
+    """render_letters plus the DOCX's CRC-32 for StoredZipWriter."""
+    docx = render_letters(template, rows)
+    return docx, deflate_zlib.crc32(docx)
+
+
+def _render_batch(rows: List[tuple]) -> Tuple[bytes, int]:
+    return render_member(_worker_template, rows)
+
+
 # ================= WEB SERVICE CLASS =================
 
 class LetterGenerationService:
-    def __init__(self, template_path: str = None):
+    def __init__(self, template_path: str = None, fast_string_render: bool = FAST_STRING_RENDER):
         if template_path is None:
             # Try to find template in common locations
             possible_paths = [
@@ -276,46 +705,76 @@ class LetterGenerationService:
             )
         
         self.template_path = template_path
+        self.fast_string_render = fast_string_render
+        # Parse and plan the template once; each letter works on a copy of the
+        # XML tree, or on its serialized string when the fast path applies
+        self._template = load_letter_template(template_path, fast_string_render)
+
+    def _render_batches(self, batches: List[List[tuple]], total_letters: int) -> Iterator[Tuple[bytes, int]]:
+        """Yield one (DOCX, CRC-32) per batch of rows, in order."""
+        if RENDER_WORKERS < 2 or total_letters < PARALLEL_MIN_LETTERS:
+            for rows in batches:
+                yield render_member(self._template, rows)
+            return
+
+        letters_per_batch = max(len(batches[0]), 1)
+
+        with ProcessPoolExecutor(
+            max_workers=RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_render_worker,
+            initargs=(self.template_path, self.fast_string_render),
+        ) as executor:
+            yield from executor.map(
+                _render_batch, batches, chunksize=max(RENDER_CHUNKSIZE // letters_per_batch, 1)
+            )
     
     def generate_from_excel(self, excel_path: str, mode: str = "zip", 
-                          letters_per_file: int = 1) -> dict[str, Any]:
+                          letters_per_file: int = 1,
+                          output_stream: Optional[BinaryIO] = None,
+                          engine: str = "pandas") -> dict[str, Any]:
         """Generate letters from Excel file."""
         try:
             if not os.path.exists(excel_path):
                 return {"error": f"Excel file not found: {excel_path}"}
             
-            df = pd.read_excel(excel_path, dtype=str)
-            return self.generate_from_dataframe(df, mode, letters_per_file)
+            df = read_letter_excel(excel_path, engine)
+            return self.generate_from_dataframe(df, mode, letters_per_file, output_stream)
         except Exception as e:
             return {"error": f"Cannot read Excel file: {str(e)}"}
     
     def generate_from_csv(self, csv_path: str, mode: str = "zip", 
-                         letters_per_file: int = 1) -> dict[str, Any]:
+                         letters_per_file: int = 1,
+                         output_stream: Optional[BinaryIO] = None,
+                         engine: str = "pandas") -> dict[str, Any]:
         """Generate letters from CSV file."""
         try:
             if not os.path.exists(csv_path):
                 return {"error": f"CSV file not found: {csv_path}"}
             
-            df = pd.read_csv(csv_path, dtype=str)
-            return self.generate_from_dataframe(df, mode, letters_per_file)
+            df = read_letter_csv(csv_path, engine)
+            return self.generate_from_dataframe(df, mode, letters_per_file, output_stream)
         except Exception as e:
             return {"error": f"Cannot read CSV file: {str(e)}"}
     
     def generate_from_file(self, file_path: str, mode: str = "zip", 
-                          letters_per_file: int = 1) -> dict[str, Any]:
+                          letters_per_file: int = 1,
+                          output_stream: Optional[BinaryIO] = None,
+                          engine: str = "pandas") -> dict[str, Any]:
         """Generate letters from Excel or CSV file."""
         try:
             if file_path.lower().endswith(('.xlsx', '.xls')):
-                return self.generate_from_excel(file_path, mode, letters_per_file)
+                return self.generate_from_excel(file_path, mode, letters_per_file, output_stream, engine)
             elif file_path.lower().endswith('.csv'):
-                return self.generate_from_csv(file_path, mode, letters_per_file)
+                return self.generate_from_csv(file_path, mode, letters_per_file, output_stream, engine)
             else:
                 return {"error": "Unsupported file format. Use Excel (.xlsx, .xls) or CSV (.csv)"}
         except Exception as e:
             return {"error": f"Cannot read file: {str(e)}"}
     
     def generate_from_dataframe(self, df: pd.DataFrame, mode: str = "zip", 
-                               letters_per_file: int = 1) -> dict[str, Any]:
+                               letters_per_file: int = 1,
+                               output_stream: Optional[BinaryIO] = None) -> dict[str, Any]:
         """
         Generate letters from DataFrame.
         
@@ -323,6 +782,8 @@ class LetterGenerationService:
             df: Source DataFrame
             mode: "zip" = ZIP with individual files (1 per DOCX), "combined" = ZIP with N letters per DOCX
             letters_per_file: How many letters per DOCX file (only used in "combined" mode)
+            output_stream: Writable binary file to stream the ZIP into. When given,
+                the result has no "content"; otherwise the ZIP is returned as bytes.
         
         NOTE: ALL rows in the dataframe will be processed. No limit parameter.
         """
@@ -333,40 +794,35 @@ class LetterGenerationService:
         
         # Process ALL rows - no limit
         total_letters = len(df)
+        rows = letter_rows(self._template, df)
+
+        # Letters are written into the ZIP as they are rendered, so only the
+        # archive itself (or nothing, when streaming to a file) is held in memory.
+        # Members are stored, not deflated: each DOCX is already a compressed ZIP,
+        # and its CRC is computed alongside the render (in the workers when pooled)
+        zip_target = output_stream if output_stream is not None else io.BytesIO()
+
+        def with_content(result: dict) -> dict:
+            if output_stream is None:
+                result["content"] = zip_target.getvalue()
+            return result
         
         if mode == "zip":
             # Generate ZIP with one letter per DOCX file
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for idx, row in df.iterrows():
-                    data = row.to_dict()
-                    
-                    # Load fresh template for each letter
-                    doc = Document(self.template_path)
-                    
-                    # Create replacements mapping
-                    replacements = {f"{{{k}}}": v for k, v in data.items()}
-                    replacements["{Title} {Sname}"] = f"{data.get('Title', '')} {data.get('Sname', '')}".strip()
-                    
-                    # Replace placeholders properly
-                    replace_placeholders_properly(doc, replacements)
-                    
-                    # Save to bytes for ZIP
-                    letter_buffer = io.BytesIO()
-                    doc.save(letter_buffer)
-                    letter_buffer.seek(0)
-                    
-                    filename = safe_filename(data.get("Business Name", "")) or f"letter_{idx+1}"
-                    zipf.writestr(f"{filename}.docx", letter_buffer.getvalue())
+            batches = [[row] for row in rows]
+            with StoredZipWriter(zip_target) as zipf, \
+                    closing(self._render_batches(batches, total_letters)) as letters:
+                # File names use the unescaped business name
+                for idx, (name, (letter, crc)) in enumerate(zip(df["Business Name"], letters)):
+                    filename = safe_filename(name) or f"letter_{idx+1}"
+                    zipf.write(f"{filename}.docx", letter, crc)
             
-            zip_buffer.seek(0)
-            return {
-                "content": zip_buffer.getvalue(),
+            return with_content({
                 "filename": f"letters_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
                 "content_type": "application/zip",
                 "total_letters": total_letters,
                 "files_created": total_letters
-            }
+            })
         
         elif mode == "combined":
             # Generate ZIP with multiple DOCX files, N letters per file
@@ -376,74 +832,29 @@ class LetterGenerationService:
             print(f"DEBUG: Generating in combined mode with {letters_per_file} letters per file")
             print(f"DEBUG: Total letters: {total_letters}")
     
-            # STEP 1: Generate ALL individual letters first (preserves template perfectly)
-            all_letters: List[bytes] = []
-    
-            for i, (_, row) in enumerate(df.iterrows()):
-                data = row.to_dict()
-        
-                # Generate single letter using template (same as individual mode)
-                doc = Document(self.template_path)
-                replacements = {f"{{{k}}}": v for k, v in data.items()}
-                replacements["{Title} {Sname}"] = f"{data.get('Title', '')} {data.get('Sname', '')}".strip()
-                replace_placeholders_properly(doc, replacements)
-        
-                # Save to bytes
-                letter_buffer = io.BytesIO()
-                doc.save(letter_buffer)
-                letter_buffer.seek(0)
-        
-                all_letters.append(letter_buffer.getvalue())
-    
-            print(f"DEBUG: Generated {len(all_letters)} individual letters before batching")
-    
-            # STEP 2: Batch + combine using real DOCX merging
-            from docxcompose.composer import Composer
-    
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                file_num = 1
-    
-                for start_idx in range(0, len(all_letters), letters_per_file):
-                    batch = all_letters[start_idx:start_idx + letters_per_file]
+            # Each batch is rendered straight into one document from template copies
+            batches = [rows[i:i + letters_per_file] for i in range(0, total_letters, letters_per_file)]
+            with StoredZipWriter(zip_target) as zipf, \
+                    closing(self._render_batches(batches, total_letters)) as combined_docs:
+                start_idx = 0
     
+                for file_num, (batch, (combined, crc)) in enumerate(zip(batches, combined_docs), start=1):
                     print(f"DEBUG: Combining batch {file_num} with {len(batch)} letters "
                           f"(rows {start_idx+1} to {start_idx+len(batch)})")
+                    zipf.write(f"letters_batch_{file_num}.docx", combined, crc)
+                    start_idx += len(batch)
     
-                    # Load first document as master
-                    master_doc = Document(io.BytesIO(batch[0]))
-                    composer = Composer(master_doc)
-    
-                    # Append remaining documents in batch WITH forced section break
-                    for letter_bytes in batch[1:]:
-                        temp_doc = Document(io.BytesIO(letter_bytes))
-
-                        # FORCE each new letter to start on a new page (real Word section break)
-                        master_doc.add_section(WD_SECTION.NEW_PAGE)
-                        composer.append(temp_doc)
-
-                    # Save combined DOCX to bytes
-                    combined_buffer = io.BytesIO()
-                    master_doc.save(combined_buffer)
-                    combined_buffer.seek(0)
-    
-                    zipf.writestr(f"letters_batch_{file_num}.docx", combined_buffer.getvalue())
-    
-                    file_num += 1
-    
-            zip_buffer.seek(0)
-            num_files = file_num - 1
+            num_files = len(batches)
             
             print(f"DEBUG: Created {num_files} combined files")
     
-            return {
-                "content": zip_buffer.getvalue(),
+            return with_content({
                 "filename": f"letters_batches_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
                 "content_type": "application/zip",
                 "total_letters": total_letters,
                 "files_created": num_files,
                 "letters_per_file": letters_per_file
-            }
+            })
         
         else:
             return {"error": f"Unsupported mode: {mode}. Use 'zip' or 'combined'"}
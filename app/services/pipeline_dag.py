@@ -0,0 +1,79 @@
+"""
+Pipeline DAG: Dependency-Ordered Stage Scheduling
+
+Each Task names the tasks it depends on. run() groups tasks into levels with
+Kahn's algorithm (a level holds every task whose dependencies all sit in
+earlier levels) and runs the tasks of a level concurrently on a thread pool.
+Stages spend their time in Polars, Parquet I/O or HTTP, all of which release
+the GIL, so threads are enough for them to overlap.
+
+Example:
+    C → B, C → D, D → D2  gives levels  [C], [B, D], [D2]
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Task(NamedTuple):
+    name: str
+    deps: Tuple[str, ...]
+    # Called with the results of all tasks completed so far, keyed by name
+    fn: Callable[[Dict[str, Any]], Any]
+
+
+class DAGPipeline:
+    """Run a set of tasks level by level in dependency order."""
+
+    def __init__(self, tasks: List[Task]):
+        self.tasks: Dict[str, Task] = {}
+        for task in tasks:
+            if task.name in self.tasks:
+                raise ValueError(f"Duplicate pipeline task: {task.name}")
+            self.tasks[task.name] = task
+        self.levels = self._compute_levels()
+
+    def _compute_levels(self) -> List[List[Task]]:
+        indegree = {name: 0 for name in self.tasks}
+        dependents: Dict[str, List[str]] = {name: [] for name in self.tasks}
+        for task in self.tasks.values():
+            for dep in task.deps:
+                if dep not in self.tasks:
+                    raise ValueError(f"Task '{task.name}' depends on unknown task '{dep}'")
+                indegree[task.name] += 1
+                dependents[dep].append(task.name)
+
+        levels = []
+        ready = [name for name, count in indegree.items() if count == 0]
+        while ready:
+            levels.append([self.tasks[name] for name in ready])
+            next_ready = []
+            for name in ready:
+                for dependent in dependents[name]:
+                    indegree[dependent] -= 1
+                    if indegree[dependent] == 0:
+                        next_ready.append(dependent)
+            ready = next_ready
+
+        if sum(len(level) for level in levels) != len(self.tasks):
+            raise ValueError("Pipeline tasks contain a dependency cycle")
+        return levels
+
+    def run(self, max_workers: Optional[int] = None) -> Dict[str, Any]:
+        """Execute every task and return their results keyed by task name."""
+        results: Dict[str, Any] = {}
+        if not self.levels:
+            return results
+
+        workers = max_workers or max(len(level) for level in self.levels)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for i, level in enumerate(self.levels):
+                logger.info(f"DAG level {i}: {', '.join(task.name for task in level)}")
+                snapshot = dict(results)
+                futures = [(task.name, pool.submit(task.fn, snapshot)) for task in level]
+                for name, future in futures:
+                    results[name] = future.result()
+        return results
@@ -10,18 +10,57 @@ Script Responsibilities:
     C: Filter by explicit CSV County if counties specified, otherwise return all (auto-runs every time)
     B: Analyze dataset (user-triggered, read-only)
     D: Enrich dataset (user-triggered)
+    D2: Advanced enrichment of D's output (user-triggered)
+
+run_pipeline_stages schedules A → C plus any requested B/D/D2 as one DAG
+(see pipeline_dag): B and D each depend only on C and run concurrently.
 
 Job States:
     - sic_extracted
     - county_filtered (if counties specified) OR all_companies (if no counties)
 """
 
+import copy
+import queue
 import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Optional, Dict
+from typing import Callable, Iterator, List, Optional, Dict
+
+import polars as pl
 
 logger = logging.getLogger(__name__)
 
+# Extract chunks Stage A may have in flight to Stage C before it waits
+_STREAM_QUEUE_SIZE = 4
+
+# Put on the chunk queue in place of the end-of-stream None when A fails
+_STREAM_ABORTED = object()
+
+
+def _ordered_chunks(chunks: queue.Queue) -> Iterator:
+    """Yield queued chunk payloads in CSV order, until the None sentinel."""
+    # Chunks arrive as (first_row, end_row, payload) in whatever order the
+    # streaming engine's threads finish them; each is held until every chunk
+    # before it has been yielded
+    waiting = {}
+    next_row = 0
+    while True:
+        item = chunks.get()
+        if item is None:
+            break
+        if item is _STREAM_ABORTED:
+            raise RuntimeError("SIC extraction failed before the extract was complete")
+        first_row, end_row, payload = item
+        waiting[first_row] = (end_row, payload)
+        while next_row in waiting:
+            next_row, payload = waiting.pop(next_row)
+            yield payload
+    if waiting:
+        raise RuntimeError("SIC extraction streamed an incomplete extract")
+
 
 # ============ MAIN PIPELINE ============
 def execute_pipeline(
@@ -44,8 +83,16 @@ def execute_pipeline(
 
     # Local imports to avoid circular dependencies
     from app.config import CURRENT_SNAPSHOT, NSPL_PATH, CACHE_DIR
-    from app.services.sic_extraction import extract_companies_by_sic
-    from app.services.county_filtering import resolve_and_filter_by_county
+    from app.services.sic_extraction import (
+        SIC_EXTRACT_DIR,
+        extract_companies_by_sic,
+        generate_sic_hash,
+    )
+    from app.services.county_filtering import (
+        county_batch_filter,
+        resolve_and_filter_by_county,
+        write_county_batches,
+    )
 
     # Defaults
     csv_path = csv_path or CURRENT_SNAPSHOT
@@ -53,27 +100,91 @@ def execute_pipeline(
     cache_dir = cache_dir or CACHE_DIR
     config_dir = config_dir or Path("config")
 
-    logger.info("=" * 70)
-    logger.info("PIPELINE EXECUTION")
-    logger.info("=" * 70)
-    logger.info(f"SIC Codes: {sic_codes}")
-    logger.info(f"Counties Filter: {counties if counties else 'None (return all companies)'}")
-    logger.info(f"Data Source: {csv_path}")
-    logger.info("=" * 70)
+    # Banner lines below are skipped entirely (no f-string formatting) when INFO is off
+    log_info = logger.isEnabledFor(logging.INFO)
+
+    if log_info:
+        logger.info("=" * 70)
+        logger.info("PIPELINE EXECUTION")
+        logger.info("=" * 70)
+        logger.info(f"SIC Codes: {sic_codes}")
+        logger.info(f"Counties Filter: {counties if counties else 'None (return all companies)'}")
+        logger.info(f"Data Source: {csv_path}")
+        logger.info("=" * 70)
 
     stages_completed = []
     stage_results = {}
 
-    # ============ STAGE A: SIC EXTRACTION ============
-    logger.info("")
-    logger.info("▶ STAGE A: SIC Extraction")
-    logger.info("-" * 70)
-
-    sic_result = extract_companies_by_sic(
-        sic_codes=sic_codes,
-        csv_path=csv_path,
-        force_refresh=force_refresh
-    )
+    # ============ STAGES A + C: PIPELINED ============
+    # On a fresh extraction every CSV chunk Stage A streams is county-filtered
+    # on the spot and queued (bounded) for a Stage C writer thread, so C's
+    # output is built while A is still scanning the CSV. The writer only uses
+    # pyarrow: A's Polars workers block on a full queue, so it must not need
+    # the Polars thread pool to drain it. On a cache hit nothing is streamed
+    # and C reads the extract from disk as before
+    if log_info:
+        logger.info("")
+        logger.info("▶ STAGE A: SIC Extraction")
+        if counties:
+            logger.info("▶ STAGE C: County Filtering (Explicit CSV County Only)")
+            logger.info(f"  Filter: {counties}")
+            logger.info("  Note: Only companies with explicit county in CSV will be included")
+        else:
+            logger.info("▶ STAGE C: No County Filter - Returning All Companies")
+            logger.info("  Note: All companies returned regardless of county field")
+        logger.info("-" * 70)
+
+    chunks: queue.Queue = queue.Queue(maxsize=_STREAM_QUEUE_SIZE)
+    stage_c: Optional[Future] = None
+    filter_batch: Optional[Callable] = None
+    stage_c_start = threading.Lock()
+    stream_file = str(SIC_EXTRACT_DIR / f"{generate_sic_hash(sic_codes)}.parquet")
+
+    def hand_off(item) -> None:
+        # Once C has failed nothing drains the queue, so stop handing off
+        # rather than block A's worker threads on a full queue
+        while not stage_c.done():
+            try:
+                chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def on_batch(first_row: int, end_row: int, rows: pl.DataFrame) -> None:
+        nonlocal stage_c, filter_batch
+        with stage_c_start:
+            if stage_c is None:
+                filter_batch = county_batch_filter(counties, config_dir)
+                stage_c = stage_c_pool.submit(
+                    write_county_batches,
+                    _ordered_chunks(chunks),
+                    sic_extract_file=stream_file,
+                    counties=counties,  # Can be None - Script C handles it
+                )
+        if stage_c.done():
+            return
+        table, with_county = filter_batch(rows)
+        hand_off((first_row, end_row, (rows.height, table, with_county)))
+
+    with ThreadPoolExecutor(max_workers=1) as stage_c_pool:
+        try:
+            sic_result = extract_companies_by_sic(
+                sic_codes=sic_codes,
+                csv_path=csv_path,
+                force_refresh=force_refresh,
+                on_batch=on_batch,
+            )
+        except BaseException:
+            if stage_c is not None:
+                hand_off(_STREAM_ABORTED)
+            raise
+
+        # The end-of-stream sentinel goes in only now that the extract is
+        # published, so C's output is written after it and passes C's cache
+        # check next time
+        if stage_c is not None:
+            hand_off(None)
+            county_result = stage_c.result()
 
     stages_completed.append("sic_extraction")
     stage_results["sic_extraction"] = {
@@ -83,29 +194,21 @@ def execute_pipeline(
         "stats": sic_result["stats"]
     }
 
-    logger.info(f"✓ Stage A complete: {sic_result['stats'].get('total_companies', 0):,} companies")
-    logger.info(f"  Output: {sic_result['output_file']}")
-    logger.info(f"  From cache: {sic_result.get('from_cache', False)}")
+    if log_info:
+        logger.info(f"✓ Stage A complete: {sic_result['stats'].get('total_companies', 0):,} companies")
+        logger.info(f"  Output: {sic_result['output_file']}")
+        logger.info(f"  From cache: {sic_result.get('from_cache', False)}")
 
     # ============ STAGE C: COUNTY FILTERING (IF COUNTIES SPECIFIED) ============
-    logger.info("")
-    if counties:
-        logger.info("▶ STAGE C: County Filtering (Explicit CSV County Only)")
-        logger.info(f"  Filter: {counties}")
-        logger.info("  Note: Only companies with explicit county in CSV will be included")
-    else:
-        logger.info("▶ STAGE C: No County Filter - Returning All Companies")
-        logger.info("  Note: All companies returned regardless of county field")
-    logger.info("-" * 70)
-
-    county_result = resolve_and_filter_by_county(
-        sic_extract_file=sic_result["output_file"],
-        counties=counties,  # Can be None - Script C handles it
-        nspl_path=nspl_path,
-        cache_dir=cache_dir,
-        config_dir=config_dir,
-        force_refresh=force_refresh
-    )
+    if stage_c is None:
+        county_result = resolve_and_filter_by_county(
+            sic_extract_file=sic_result["output_file"],
+            counties=counties,  # Can be None - Script C handles it
+            nspl_path=nspl_path,
+            cache_dir=cache_dir,
+            config_dir=config_dir,
+            force_refresh=force_refresh
+        )
 
     # Always append 'county_filtering' to stages (even if no filter applied)
     stages_completed.append("county_filtering")
@@ -130,26 +233,28 @@ def execute_pipeline(
 
     current_dataset = county_result["output_file"]
 
-    logger.info(f"✓ Stage C complete: {total_after:,} companies")
-    logger.info(f"  Output: {current_dataset}")
-    if counties:
-        logger.info(f"  Filtered by explicit CSV county: {total_before:,} → {total_after:,}")
-        logger.info(f"  Companies with explicit county: {stats.get('companies_with_explicit_county', 0):,}")
-    else:
-        logger.info(f"  All companies returned (no filtering)")
-        logger.info(f"  Companies with county: {stats.get('companies_with_explicit_county', 0):,}")
-        logger.info(f"  Companies without county: {stats.get('companies_without_county', 0):,}")
-    logger.info(f"  From cache: {county_result.get('from_cache', False)}")
+    if log_info:
+        logger.info(f"✓ Stage C complete: {total_after:,} companies")
+        logger.info(f"  Output: {current_dataset}")
+        if counties:
+            logger.info(f"  Filtered by explicit CSV county: {total_before:,} → {total_after:,}")
+            logger.info(f"  Companies with explicit county: {stats.get('companies_with_explicit_county', 0):,}")
+        else:
+            logger.info(f"  All companies returned (no filtering)")
+            logger.info(f"  Companies with county: {stats.get('companies_with_explicit_county', 0):,}")
+            logger.info(f"  Companies without county: {stats.get('companies_without_county', 0):,}")
+        logger.info(f"  From cache: {county_result.get('from_cache', False)}")
 
     # ============ PIPELINE COMPLETE ============
-    logger.info("")
-    logger.info("=" * 70)
-    logger.info("PIPELINE COMPLETE")
-    logger.info("=" * 70)
-    logger.info(f"Active Dataset: {current_dataset}")
-    logger.info(f"Pipeline State: {pipeline_state}")
-    logger.info(f"Stages Completed: {' → '.join(stages_completed)}")
-    logger.info("=" * 70)
+    if log_info:
+        logger.info("")
+        logger.info("=" * 70)
+        logger.info("PIPELINE COMPLETE")
+        logger.info("=" * 70)
+        logger.info(f"Active Dataset: {current_dataset}")
+        logger.info(f"Pipeline State: {pipeline_state}")
+        logger.info(f"Stages Completed: {' → '.join(stages_completed)}")
+        logger.info("=" * 70)
 
     return {
         "current_dataset": str(current_dataset),
@@ -164,21 +269,12 @@ def execute_pipeline(
 
 
 # ============ STAGE B: ANALYSIS ============
-def analyze_current_dataset(dataset_file: str) -> Dict[str, any]:
-    """
-    Run analysis on current dataset (Stage B).
-    User-triggered via "Analyze" button.
-    """
-
+@lru_cache(maxsize=32)
+def _analyze_cached(dataset_file: str, mtime_ns: int, size: int) -> Dict[str, any]:
+    """Analyze one version of a dataset file; keyed on mtime/size so a rewrite by C is re-analyzed."""
     from app.services.dataset_analysis import analyze_dataset
-    from pathlib import Path
     from datetime import datetime
 
-    logger.info("=" * 70)
-    logger.info("STAGE B: Dataset Analysis")
-    logger.info("=" * 70)
-    logger.info(f"Analyzing: {dataset_file}")
-
     analysis = analyze_dataset(dataset_file)
 
     # -------------------------------
@@ -205,10 +301,32 @@ def analyze_current_dataset(dataset_file: str) -> Dict[str, any]:
     except Exception as e:
         logger.warning(f"Could not format dataset lineage: {e}")
 
-    logger.info("✓ Analysis complete")
-    logger.info(f"  Total companies: {analysis['summary']['total_companies']:,}")
-    logger.info(f"  Data quality: {analysis['data_quality_score']}/100")
-    logger.info("=" * 70)
+    return analysis
+
+
+def analyze_current_dataset(dataset_file: str) -> Dict[str, any]:
+    """
+    Run analysis on current dataset (Stage B).
+    User-triggered via "Analyze" button. Repeat runs on an unchanged file
+    reuse the cached result.
+    """
+
+    log_info = logger.isEnabledFor(logging.INFO)
+    if log_info:
+        logger.info("=" * 70)
+        logger.info("STAGE B: Dataset Analysis")
+        logger.info("=" * 70)
+        logger.info(f"Analyzing: {dataset_file}")
+
+    stat = Path(dataset_file).stat()
+    # Copied so callers can't alter the cached result
+    analysis = copy.deepcopy(_analyze_cached(str(dataset_file), stat.st_mtime_ns, stat.st_size))
+
+    if log_info:
+        logger.info("✓ Analysis complete")
+        logger.info(f"  Total companies: {analysis['summary']['total_companies']:,}")
+        logger.info(f"  Data quality: {analysis['data_quality_score']}/100")
+        logger.info("=" * 70)
 
     return analysis
 
@@ -227,10 +345,12 @@ def enrich_current_dataset(
 
     from app.services.enrichment import enrich_company_data
 
-    logger.info("=" * 70)
-    logger.info("STAGE D: Dataset Enrichment")
-    logger.info("=" * 70)
-    logger.info(f"Enriching: {dataset_file}")
+    log_info = logger.isEnabledFor(logging.INFO)
+    if log_info:
+        logger.info("=" * 70)
+        logger.info("STAGE D: Dataset Enrichment")
+        logger.info("=" * 70)
+        logger.info(f"Enriching: {dataset_file}")
 
     result = enrich_company_data(
         input_path=dataset_file,
@@ -238,10 +358,11 @@ def enrich_current_dataset(
         progress_callback=progress_callback
     )
 
-    logger.info("✓ Enrichment complete")
-    logger.info(f"  Output: {result.get('output_file')}")
-    logger.info(f"  Total processed: {result.get('enrichment_stats', {}).get('total_processed', 0):,}")
-    logger.info("=" * 70)
+    if log_info:
+        logger.info("✓ Enrichment complete")
+        logger.info(f"  Output: {result.get('output_file')}")
+        logger.info(f"  Total processed: {result.get('enrichment_stats', {}).get('total_processed', 0):,}")
+        logger.info("=" * 70)
 
     return result
 
@@ -259,10 +380,12 @@ def enrich_current_dataset_v2(
 
     from app.services.enrichment_v2 import enrich_company_data_v2
 
-    logger.info("=" * 70)
-    logger.info("STAGE D2: Advanced Dataset Enrichment (V2)")
-    logger.info("=" * 70)
-    logger.info(f"Advanced enriching: {dataset_file}")
+    log_info = logger.isEnabledFor(logging.INFO)
+    if log_info:
+        logger.info("=" * 70)
+        logger.info("STAGE D2: Advanced Dataset Enrichment (V2)")
+        logger.info("=" * 70)
+        logger.info(f"Advanced enriching: {dataset_file}")
 
     result = enrich_company_data_v2(
         input_path=dataset_file,
@@ -270,9 +393,57 @@ def enrich_current_dataset_v2(
         progress_callback=progress_callback
     )
 
-    logger.info("✓ Advanced enrichment complete")
-    logger.info(f"  Output: {result.get('output_file')}")
-    logger.info(f"  Total processed: {result.get('enrichment_stats', {}).get('total_processed', 0):,}")
-    logger.info("=" * 70)
+    if log_info:
+        logger.info("✓ Advanced enrichment complete")
+        logger.info(f"  Output: {result.get('output_file')}")
+        logger.info(f"  Total processed: {result.get('enrichment_stats', {}).get('total_processed', 0):,}")
+        logger.info("=" * 70)
 
-    return result
\ No newline at end of file
+    return result
+
+
+# ============ DAG ENTRY POINT ============
+def run_pipeline_stages(
+    sic_codes: List[str],
+    counties: Optional[List[str]] = None,
+    analyze: bool = False,
+    enrich: bool = False,
+    enrich_v2: bool = False,
+    enrich_output_path: Optional[str] = None,
+    enrich_v2_output_path: Optional[str] = None,
+    enrich_progress: Optional[Callable] = None,
+    enrich_v2_progress: Optional[Callable] = None,
+    **pipeline_kwargs,
+) -> Dict[str, any]:
+    """
+    Run A → C and the requested user-triggered stages as one dependency DAG.
+
+    Dependencies: B and D on C, D2 on D (it enriches D's output; requesting
+    D2 implies D). Independent stages run concurrently. Returns each stage's
+    result under "pipeline", "analysis", "enrichment" and "enrichment_v2".
+    pipeline_kwargs are passed through to execute_pipeline.
+    """
+    from app.services.pipeline_dag import DAGPipeline, Task
+
+    def dataset(results):
+        return results["pipeline"]["current_dataset"]
+
+    tasks = [
+        Task("pipeline", (), lambda results: execute_pipeline(
+            sic_codes=sic_codes, counties=counties, **pipeline_kwargs
+        )),
+    ]
+    if analyze:
+        tasks.append(Task("analysis", ("pipeline",), lambda results: analyze_current_dataset(
+            dataset(results)
+        )))
+    if enrich or enrich_v2:
+        tasks.append(Task("enrichment", ("pipeline",), lambda results: enrich_current_dataset(
+            dataset(results), enrich_output_path, enrich_progress
+        )))
+    if enrich_v2:
+        tasks.append(Task("enrichment_v2", ("enrichment",), lambda results: enrich_current_dataset_v2(
+            results["enrichment"]["output_file"], enrich_v2_output_path, enrich_v2_progress
+        )))
+
+    return DAGPipeline(tasks).run()
@@ -3,20 +3,24 @@ Enhanced Search Service - Search across ALL fields in ALL datasets
 """
 
 import logging
+import operator
 from typing import List, Dict
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
 from app.database import crud
-from app.database.models import Company, Dataset
+from app.database.models import Dataset, SEARCH_FIELDS
 
 logger = logging.getLogger(__name__)
 
+# Fetches every SEARCH_FIELDS attribute of a company in one C-level call
+_SEARCH_FIELD_GETTER = operator.attrgetter(*SEARCH_FIELDS)
+
 
 def search_all_datasets(
     db: Session,
     query: str,
     skip: int = 0,
-    limit: int = 500
+    limit: int = 500,
+    highlight: bool = True
 ) -> Dict:
     """
     COMPREHENSIVE CENTRALIZED SEARCH: Search across ALL datasets in ALL company fields.
@@ -29,12 +33,16 @@ def search_all_datasets(
     - All contact info (website, phone, email, website_address)
     - All enrichment fields (selected_person_source, etc.)
     - Address match field
+
+    With highlight=False, search_match_info is None and the per-field match
+    is not computed.
     """
     logger.info(f"COMPREHENSIVE search across ALL datasets for: '{query}' (searching ALL 25+ fields)")
     
     # Use the comprehensive search function from crud
-    companies = crud.search_companies_comprehensive(db, query, skip, limit)
-    total_count = crud.get_comprehensive_search_count(db, query)
+    companies = crud.search_companies_comprehensive(
+        db, query, skip, limit, with_match_mask=highlight
+    )
     
     if not companies:
         return {
@@ -44,14 +52,18 @@ def search_all_datasets(
             "message": f"No results found for '{query}' across any field"
         }
     
+    # Every row carries the total match count (COUNT(*) OVER ())
+    total_count = companies[0].total_count
+    
     # Group by dataset for better organization
     results_by_dataset = {}
+    datasets = crud.get_datasets_by_ids(db, (company.dataset_id for company in companies))
     
     for company in companies:
         dataset_id = company.dataset_id
         
         if dataset_id not in results_by_dataset:
-            dataset = db.query(Dataset).filter(Dataset.id == dataset_id).first()
+            dataset = datasets.get(dataset_id)
             results_by_dataset[dataset_id] = {
                 "dataset_name": dataset.name if dataset else f"Dataset {dataset_id}",
                 "dataset_id": dataset_id,
@@ -104,7 +116,7 @@ def search_all_datasets(
             "selected_psc_nature_of_control": company.selected_psc_nature_of_control,
             
             # Search match indicators (for UI highlighting)
-            "search_match_info": get_search_match_info(company, query)
+            "search_match_info": get_search_match_info(company, query) if highlight else None
         }
         
         results_by_dataset[dataset_id]["companies"].append(company_result)
@@ -122,14 +134,7 @@ def search_all_datasets(
         "returned_results": len(companies),
         "datasets_with_matches": len(datasets_list),
         "datasets": datasets_list,
-        "search_fields_covered": [
-            "business_name", "company_number", "address_line1", "address_line2",
-            "town", "county", "postcode", "person_with_significant_control",
-            "nature_of_control", "title", "fname", "sname", "position",
-            "sic", "company_status", "company_type", "date_of_creation",
-            "website", "phone", "email", "website_address", "address_match",
-            "selected_person_source", "selected_psc_share_tier", "selected_psc_nature_of_control"
-        ],
+        "search_fields_covered": SEARCH_FIELDS,
         "message": f"Found {total_count} results across {len(datasets_list)} dataset(s) in ALL fields"
     }
 
@@ -137,48 +142,29 @@ def search_all_datasets(
 def get_search_match_info(company, query: str) -> Dict:
     """
     Identify which fields contain the search term for highlighting.
+    Rows from the crud search functions carry a SQL-computed match_mask,
+    which only needs decoding; other companies are checked field by field.
     """
-    query_lower = query.lower()
-    match_info = {
-        "matched_fields": [],
-        "match_count": 0
-    }
-    
-    # Check each field
-    fields_to_check = [
-        ("business_name", company.business_name),
-        ("company_number", company.company_number),
-        ("address_line1", company.address_line1),
-        ("address_line2", company.address_line2),
-        ("town", company.town),
-        ("county", company.county),
-        ("postcode", company.postcode),
-        ("person_with_significant_control", company.person_with_significant_control),
-        ("nature_of_control", company.nature_of_control),
-        ("title", company.title),
-        ("fname", company.fname),
-        ("sname", company.sname),
-        ("position", company.position),
-        ("sic", company.sic),
-        ("company_status", company.company_status),
-        ("company_type", company.company_type),
-        ("date_of_creation", company.date_of_creation),
-        ("website", company.website),
-        ("phone", company.phone),
-        ("email", company.email),
-        ("website_address", company.website_address),
-        ("address_match", company.address_match),
-        ("selected_person_source", company.selected_person_source),
-        ("selected_psc_share_tier", company.selected_psc_share_tier),
-        ("selected_psc_nature_of_control", company.selected_psc_nature_of_control),
+    match_mask = getattr(company, "match_mask", None)
+    if match_mask is not None:
+        matched_fields = [
+            name for i, name in enumerate(SEARCH_FIELDS) if match_mask >> i & 1
+        ]
+        return {
+            "matched_fields": matched_fields,
+            "match_count": len(matched_fields)
+        }
+
+    query_folded = query.casefold()
+    # All search fields are string columns, so no str() is needed
+    matched_fields = [
+        name for name, value in zip(SEARCH_FIELDS, _SEARCH_FIELD_GETTER(company))
+        if value and query_folded in value.casefold()
     ]
-    
-    for field_name, field_value in fields_to_check:
-        if field_value and query_lower in str(field_value).lower():
-            match_info["matched_fields"].append(field_name)
-            match_info["match_count"] += 1
-    
-    return match_info
+    return {
+        "matched_fields": matched_fields,
+        "match_count": len(matched_fields)
+    }
 
 
 def search_within_dataset(
@@ -186,11 +172,13 @@ def search_within_dataset(
     dataset_id: int,
     query: str,
     skip: int = 0,
-    limit: int = 500
+    limit: int = 500,
+    highlight: bool = True
 ) -> Dict:
     """
     Comprehensive search within a specific dataset only.
-    Searches ALL fields within the specified dataset.
+    Searches ALL fields within the specified dataset; match_info is None
+    when highlight is False.
     """
     logger.info(f"Comprehensive search within dataset {dataset_id} for: '{query}'")
     
@@ -203,44 +191,19 @@ def search_within_dataset(
         }
     
     # Use dataset-specific comprehensive search
-    companies = crud.search_within_dataset_comprehensive(db, dataset_id, query, skip, limit)
-    
-    # Get total count
-    search_term = f"%{query}%"
-    search_conditions = [
-        Company.business_name.ilike(search_term),
-        Company.company_number.ilike(search_term),
-        Company.address_line1.ilike(search_term),
-        Company.address_line2.ilike(search_term),
-        Company.town.ilike(search_term),
-        Company.county.ilike(search_term),
-        Company.postcode.ilike(search_term),
-        Company.person_with_significant_control.ilike(search_term),
-        Company.nature_of_control.ilike(search_term),
-        Company.title.ilike(search_term),
-        Company.fname.ilike(search_term),
-        Company.sname.ilike(search_term),
-        Company.position.ilike(search_term),
-        Company.sic.ilike(search_term),
-        Company.company_status.ilike(search_term),
-        Company.company_type.ilike(search_term),
-        Company.date_of_creation.ilike(search_term),
-        Company.website.ilike(search_term),
-        Company.phone.ilike(search_term),
-        Company.email.ilike(search_term),
-        Company.website_address.ilike(search_term),
-        Company.address_match.ilike(search_term),
-        Company.selected_person_source.ilike(search_term),
-        Company.selected_psc_share_tier.ilike(search_term),
-        Company.selected_psc_nature_of_control.ilike(search_term),
-    ]
-    
-    total_count = (
-        db.query(Company)
-        .filter(Company.dataset_id == dataset_id, or_(*search_conditions))
-        .count()
+    companies = crud.search_within_dataset_comprehensive(
+        db, dataset_id, query, skip, limit, with_match_mask=highlight
     )
     
+    # Get total count: every row carries it (COUNT(*) OVER ()); a page past
+    # the last match has no rows, so only then is it counted separately
+    if companies:
+        total_count = companies[0].total_count
+    elif skip:
+        total_count = crud.get_dataset_search_count(db, dataset_id, query)
+    else:
+        total_count = 0
+    
     results = []
     for company in companies:
         results.append({
@@ -271,7 +234,7 @@ def search_within_dataset(
             "website": company.website,
             
             # Quick match indicators for UI
-            "match_info": get_search_match_info(company, query)
+            "match_info": get_search_match_info(company, query) if highlight else None
         })
     
     return {
@@ -281,12 +244,5 @@ def search_within_dataset(
         "total_results": total_count,
         "returned_results": len(results),
         "companies": results,
-        "search_fields": [
-            "business_name", "company_number", "address_line1", "address_line2",
-            "town", "county", "postcode", "person_with_significant_control",
-            "nature_of_control", "title", "fname", "sname", "position",
-            "sic", "company_status", "company_type", "date_of_creation",
-            "website", "phone", "email", "website_address", "address_match",
-            "selected_person_source", "selected_psc_share_tier", "selected_psc_nature_of_control"
-        ]
+        "search_fields": SEARCH_FIELDS
     }
\ No newline at end of file
@@ -7,7 +7,7 @@ Purpose:
 
 Design Decisions:
     1. Streams entire CSV in lazy mode to avoid memory overload
-    2. Writes directly to Parquet (compressed, columnar, fast)
+    2. Streams directly to Parquet (compressed, columnar, fast)
     3. Returns complete population - no pagination at this stage
     4. Caches result so subsequent filters don't re-scan source
     5. Includes metadata about extraction for traceability
@@ -17,37 +17,52 @@ Output:
     - Metadata JSON: outputs/sic_extracts/{sic_hash}_meta.json
 """
 
+import os
 import re
-import json
 import logging
 import hashlib
+import tempfile
+import threading
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional
 from datetime import datetime
+import orjson
 import polars as pl
+import pyarrow.parquet as pq
 import psutil
-from functools import wraps
+from functools import wraps, lru_cache
 
 logger = logging.getLogger(__name__)
 
 # ============ CONFIGURATION ============
 SIC_EXTRACT_DIR = Path("outputs/sic_extracts")
 SIC_EXTRACT_DIR.mkdir(parents=True, exist_ok=True)
+_OUT_ROW_GROUP_SIZE = 100_000
+
+# Row-index column carried through a tapped scan so chunks can be put back in order
+_CSV_ROW = "__csv_row"
 
 
 # ============ UTILITIES ============
+_PROC = psutil.Process()
+
+
 def track_performance(func):
     """Track execution time and memory usage."""
     @wraps(func)
     def wrapper(*args, **kwargs):
+        if not logger.isEnabledFor(logging.INFO):
+            # Nothing would be logged; skip the timers and /proc reads
+            return func(*args, **kwargs)
+
         start_time = datetime.now()
-        start_mem = psutil.Process().memory_info().rss / (1024 ** 2)
+        start_mem = _PROC.memory_info().rss / (1024 ** 2)
 
         logger.info(f"Starting {func.__name__}")
         result = func(*args, **kwargs)
 
         end_time = datetime.now()
-        end_mem = psutil.Process().memory_info().rss / (1024 ** 2)
+        end_mem = _PROC.memory_info().rss / (1024 ** 2)
         duration = (end_time - start_time).total_seconds()
         mem_delta = end_mem - start_mem
 
@@ -59,6 +74,64 @@ def track_performance(func):
     return wrapper
 
 
+@lru_cache(maxsize=4)
+def _detect_schema_cached(csv_path: str, mtime_ns: int) -> Dict:
+    """Probe the CSV header once per file version; keyed on mtime so a new snapshot is re-read."""
+    logger.info("Reading CSV schema...")
+    # A lazy scan's schema comes from the header alone; read_csv(n_rows=1)
+    # still decodes a whole first chunk of the file
+    columns = pl.scan_csv(csv_path, infer_schema_length=0).collect_schema().names()
+
+    # Lower-case each header once; pairs rather than a dict so columns that
+    # differ only by case keep their first-match order
+    lowered = [(c.lower(), c) for c in columns]
+
+    def find(key: str) -> Optional[str]:
+        return next((c for low, c in lowered if key in low), None)
+
+    schema = {
+        "name": find("companyname"),
+        "number": find("companynumber"),
+        "sic": tuple(c for low, c in lowered if "siccode.sictext" in low),
+        "postcode": find("regaddress.postcode"),
+        "county": find("regaddress.county"),
+        "addr1": find("regaddress.addressline1"),
+        "addr2": find("regaddress.addressline2"),
+        "town": find("regaddress.posttown"),
+    }
+
+    if not schema["name"] or not schema["number"] or not schema["sic"]:
+        raise ValueError(
+            f"Required columns not found. Available columns: {columns[:10]}"
+        )
+    return schema
+
+
+def detect_schema(csv_path: str) -> Dict:
+    """Return the detected column names for a Companies House CSV."""
+    return _detect_schema_cached(str(csv_path), Path(csv_path).stat().st_mtime_ns)
+
+
+# One lock per SIC hash: concurrent requests for the same codes wait for the
+# first extraction and then reuse its cache instead of writing it twice
+_EXTRACT_LOCKS: Dict[str, threading.Lock] = {}
+_EXTRACT_LOCKS_GUARD = threading.Lock()
+
+
+def _extract_lock(sic_hash: str) -> threading.Lock:
+    with _EXTRACT_LOCKS_GUARD:
+        return _EXTRACT_LOCKS.setdefault(sic_hash, threading.Lock())
+
+
+def _temp_path(target: Path) -> Path:
+    """Unique temp file beside target, for writing before os.replace."""
+    fd, name = tempfile.mkstemp(dir=target.parent, prefix=target.name + ".", suffix=".tmp")
+    os.close(fd)
+    # mkstemp creates the file 0600; published outputs keep the usual mode
+    os.chmod(name, 0o644)
+    return Path(name)
+
+
 def generate_sic_hash(sic_codes: List[str]) -> str:
     """Generate deterministic hash for SIC code combination."""
     normalized = sorted([s.strip() for s in sic_codes])
@@ -85,6 +158,7 @@ def extract_companies_by_sic(
     sic_codes: List[str],
     csv_path: str,
     force_refresh: bool = False,
+    on_batch: Optional[Callable[[int, int, pl.DataFrame], None]] = None,
 ) -> Dict[str, any]:
     """
     Extract ALL companies matching SIC codes from Companies House snapshot.
@@ -95,6 +169,12 @@ def extract_companies_by_sic(
     - NO enrichment
     - SIC filtering ONLY
     - BUT preserves address fields for later stages
+
+    On a fresh extraction, on_batch (if given) is called with
+    (first_row, end_row, rows) for each CSV chunk as it is streamed: rows are
+    the extract rows found in CSV rows [first_row, end_row). Chunks can arrive
+    out of order and from several Polars worker threads at once. It is not
+    called on a cache hit.
     """
 
     csv_path_obj = Path(csv_path)
@@ -107,127 +187,173 @@ def extract_companies_by_sic(
     target_sics = [s.strip() for s in sic_codes]
     sic_hash = generate_sic_hash(target_sics)
 
-    # Check cache
-    if not force_refresh:
-        existing = find_existing_extract(target_sics)
-        if existing:
-            with open(existing["metadata"], "r") as f:
-                metadata = json.load(f)
-
-            logger.info(
-                f"Using cached SIC extract: {metadata['stats']['total_companies']:,} companies"
-            )
-
-            return {
-                "output_file": str(existing["data"]),
-                "metadata_file": str(existing["metadata"]),
-                "stats": metadata["stats"],
-                "from_cache": True
-            }
-
-    output_file = SIC_EXTRACT_DIR / f"{sic_hash}.parquet"
-    metadata_file = SIC_EXTRACT_DIR / f"{sic_hash}_meta.json"
-
-    logger.info(f"Extracting SIC codes: {target_sics}")
-    logger.info(f"Source: {csv_path}")
-    logger.info(f"Output: {output_file}")
-
-    # ============ SCHEMA DETECTION ============
-    logger.info("Reading CSV schema...")
-    sample = pl.read_csv(csv_path, n_rows=1, infer_schema_length=0)
-
-    name_col = next((c for c in sample.columns if "companyname" in c.lower()), None)
-    num_col = next((c for c in sample.columns if "companynumber" in c.lower()), None)
-    sic_cols = [c for c in sample.columns if "siccode.sictext" in c.lower()]
-
-    postcode_col = next((c for c in sample.columns if "regaddress.postcode" in c.lower()), None)
-    county_col = next((c for c in sample.columns if "regaddress.county" in c.lower()), None)
-    addr1_col = next((c for c in sample.columns if "regaddress.addressline1" in c.lower()), None)
-    addr2_col = next((c for c in sample.columns if "regaddress.addressline2" in c.lower()), None)
-    town_col = next((c for c in sample.columns if "regaddress.posttown" in c.lower()), None)
+    with _extract_lock(sic_hash):
+        # Check cache
+        if not force_refresh:
+            existing = find_existing_extract(target_sics)
+            if existing:
+                metadata = orjson.loads(existing["metadata"].read_bytes())
+
+                logger.info(
+                    f"Using cached SIC extract: {metadata['stats']['total_companies']:,} companies"
+                )
+
+                return {
+                    "output_file": str(existing["data"]),
+                    "metadata_file": str(existing["metadata"]),
+                    "stats": metadata["stats"],
+                    "from_cache": True
+                }
+
+        output_file = SIC_EXTRACT_DIR / f"{sic_hash}.parquet"
+        metadata_file = SIC_EXTRACT_DIR / f"{sic_hash}_meta.json"
+
+        logger.info(f"Extracting SIC codes: {target_sics}")
+        logger.info(f"Source: {csv_path}")
+        logger.info(f"Output: {output_file}")
+
+        # ============ SCHEMA DETECTION ============
+        schema = detect_schema(csv_path)
+        name_col, num_col = schema["name"], schema["number"]
+        sic_cols = list(schema["sic"])
+        postcode_col, county_col = schema["postcode"], schema["county"]
+        addr1_col, addr2_col, town_col = schema["addr1"], schema["addr2"], schema["town"]
 
-    if not name_col or not num_col or not sic_cols:
-        raise ValueError(
-            f"Required columns not found. Available columns: {sample.columns[:10]}"
+        logger.info(
+            f"Detected columns: name={name_col}, number={num_col}, "
+            f"SIC columns={len(sic_cols)}, postcode={postcode_col}, county={county_col}"
         )
 
-    logger.info(
-        f"Detected columns: name={name_col}, number={num_col}, "
-        f"SIC columns={len(sic_cols)}, postcode={postcode_col}, county={county_col}"
-    )
-
-    required_cols = [name_col, num_col] + sic_cols
-
-    # Optional address columns
-    for c in [postcode_col, county_col, addr1_col, addr2_col, town_col]:
-        if c:
-            required_cols.append(c)
-
-    # Pre-compile SIC regex
-    sic_pattern = "|".join(re.escape(s) for s in target_sics)
-
-    # ============ STREAMING EXTRACTION ============
-    logger.info("Building extraction pipeline (streaming mode)...")
-
-    lazy_df = (
-        pl.scan_csv(csv_path, infer_schema_length=0)
-        .select([pl.col(c) for c in required_cols])
-        .with_columns(
-            pl.concat_str(
+        required_cols = [name_col, num_col] + sic_cols
+
+        # Optional address columns
+        for c in [postcode_col, county_col, addr1_col, addr2_col, town_col]:
+            if c:
+                required_cols.append(c)
+
+        # ============ SIC FILTER ============
+        # Snapshot SIC cells look like "62012 - Description". When every target is
+        # a full 5-digit code, each cell's code is looked up in a hash set instead
+        # of running a regex over all SIC columns concatenated. Other non-empty
+        # targets (prefixes, partial codes) are matched per column, which skips
+        # building the concatenated string; a single target is a plain substring
+        # search. Only empty targets or ones holding the "|" separator need the
+        # concatenated form to match as before
+        sic_pattern = "|".join(re.escape(s) for s in target_sics)
+        if all(len(s) == 5 and s.isdigit() for s in target_sics):
+            target_set = pl.Series(target_sics, dtype=pl.String)
+            sic_filter = pl.any_horizontal(
+                [pl.col(c).str.slice(0, 5).is_in(target_set) for c in sic_cols]
+            )
+        elif all(s and "|" not in s for s in target_sics):
+            if len(target_sics) == 1:
+                matches = [pl.col(c).str.contains(target_sics[0], literal=True) for c in sic_cols]
+            else:
+                matches = [pl.col(c).str.contains(sic_pattern) for c in sic_cols]
+            sic_filter = pl.any_horizontal(matches)
+        else:
+            sic_filter = pl.concat_str(
                 [pl.col(c).fill_null("") for c in sic_cols],
                 separator="|"
-            ).alias("all_sics")
+            ).str.contains(sic_pattern)
+
+        # ============ STREAMING EXTRACTION ============
+        logger.info("Building extraction pipeline (streaming mode)...")
+
+        def to_extract(lf: pl.LazyFrame) -> pl.LazyFrame:
+            return (
+                lf.filter(sic_filter)
+                .with_columns([
+                    pl.col(num_col).str.zfill(8).alias("CompanyNumber"),
+                    pl.col(name_col).str.strip_chars().alias("BusinessName"),
+                    pl.lit("; ".join(target_sics)).alias("SIC"),
+                    pl.col(postcode_col).fill_null("").alias("Postcode") if postcode_col else pl.lit("").alias("Postcode"),
+                    pl.col(county_col).fill_null("").alias("County") if county_col else pl.lit("").alias("County"),
+                    pl.col(addr1_col).fill_null("").alias("AddressLine1") if addr1_col else pl.lit("").alias("AddressLine1"),
+                    pl.col(addr2_col).fill_null("").alias("AddressLine2") if addr2_col else pl.lit("").alias("AddressLine2"),
+                    pl.col(town_col).fill_null("").alias("Town") if town_col else pl.lit("").alias("Town"),
+                ])
+                .select([
+                    "CompanyNumber",
+                    "BusinessName",
+                    "SIC",
+                    "Postcode",
+                    "County",
+                    "AddressLine1",
+                    "AddressLine2",
+                    "Town"
+                ])
+            )
+
+        scan = pl.scan_csv(
+            csv_path,
+            infer_schema_length=0,
+            row_index_name=_CSV_ROW if on_batch else None,
         )
-        .filter(pl.col("all_sics").str.contains(sic_pattern))
-        .drop("all_sics")
-        .with_columns([
-            pl.col(num_col).str.zfill(8).alias("CompanyNumber"),
-            pl.col(name_col).str.strip_chars().alias("BusinessName"),
-            pl.lit("; ".join(target_sics)).alias("SIC"),
-            pl.col(postcode_col).fill_null("").alias("Postcode") if postcode_col else pl.lit("").alias("Postcode"),
-            pl.col(county_col).fill_null("").alias("County") if county_col else pl.lit("").alias("County"),
-            pl.col(addr1_col).fill_null("").alias("AddressLine1") if addr1_col else pl.lit("").alias("AddressLine1"),
-            pl.col(addr2_col).fill_null("").alias("AddressLine2") if addr2_col else pl.lit("").alias("AddressLine2"),
-            pl.col(town_col).fill_null("").alias("Town") if town_col else pl.lit("").alias("Town"),
-        ])
-        .select([
-            "CompanyNumber",
-            "BusinessName",
-            "SIC",
-            "Postcode",
-            "County",
-            "AddressLine1",
-            "AddressLine2",
-            "Town"
-        ])
-    )
-
-    # ============ COLLECT AND WRITE ============
-    logger.info("Collecting data (streaming mode)...")
-    df = lazy_df.collect(streaming=True)
-
-    total_companies = df.height
-    logger.info(f"Extracted {total_companies:,} companies")
-
-    logger.info(f"Writing to {output_file}...")
-    df.write_parquet(output_file, compression="zstd")
-
-    metadata = {
-        "sic_hash": sic_hash,
-        "sic_codes": target_sics,
-        "extraction_timestamp": datetime.now().isoformat(),
-        "source_file": str(csv_path),
-        "stats": {
-            "total_companies": int(total_companies)
-        }
-    }
+        if on_batch is None:
+            lazy_df = to_extract(scan.select([pl.col(c) for c in required_cols]))
+        else:
+            # The extract is built per CSV chunk inside the streaming engine, so
+            # each chunk can be handed on before the sink writes it. The row
+            # index tells the receiver which CSV rows the chunk covered
+            source = scan.select([pl.col(_CSV_ROW)] + [pl.col(c) for c in required_cols])
+
+            def tap(chunk: pl.DataFrame) -> pl.DataFrame:
+                rows = to_extract(chunk.lazy()).collect()
+                if chunk.height:
+                    row_index = chunk[_CSV_ROW]
+                    on_batch(row_index[0], row_index[-1] + 1, rows)
+                return rows
+
+            lazy_df = source.map_batches(
+                tap,
+                streamable=True,
+                schema=to_extract(source).collect_schema(),
+                projection_pushdown=False,
+            )
 
-    with open(metadata_file, "w") as f:
-        json.dump(metadata, f, indent=2)
+        # ============ STREAM TO PARQUET ============
+        # Row groups are written as the CSV is decoded, so the extract is never
+        # held in memory; the row count comes from the written footer. The cache
+        # is write-once/read-many and never queried by column stats, so zstd runs
+        # at level 1 with statistics off
+        logger.info(f"Streaming extract to {output_file}...")
+        tmp_output = _temp_path(output_file)
+        try:
+            lazy_df.sink_parquet(
+                tmp_output,
+                compression="zstd",
+                compression_level=1,
+                statistics=False,
+                row_group_size=_OUT_ROW_GROUP_SIZE,
+            )
+        except BaseException:
+            tmp_output.unlink(missing_ok=True)
+            raise
+
+        total_companies = pq.read_metadata(tmp_output).num_rows
+        logger.info(f"Extracted {total_companies:,} companies")
+
+        metadata = {
+            "sic_hash": sic_hash,
+            "sic_codes": target_sics,
+            "extraction_timestamp": datetime.now(),
+            "source_file": str(csv_path),
+            "stats": {
+                "total_companies": int(total_companies)
+            }
+        }
 
-    return {
-        "output_file": str(output_file),
-        "metadata_file": str(metadata_file),
-        "stats": metadata["stats"],
-        "from_cache": False
-    }
+        # Publish atomically: a run killed mid-write leaves only *.tmp files, never
+        # a truncated extract or meta that find_existing_extract would trust
+        tmp_meta = _temp_path(metadata_file)
+        tmp_meta.write_bytes(orjson.dumps(metadata, option=orjson.OPT_INDENT_2))
+        os.replace(tmp_output, output_file)
+        os.replace(tmp_meta, metadata_file)
+
+        return {
+            "output_file": str(output_file),
+            "metadata_file": str(metadata_file),
+            "stats": metadata["stats"],
+            "from_cache": False
+        }
@@ -0,0 +1,93 @@
+"""
+Stage D → D2 chain: Enrichment 2.0 must accept Enrichment 1.0's output as-is.
+
+Companies House and Serper are mocked; both stages otherwise run for real.
+Run with: python -m unittest discover tests
+"""
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import polars as pl
+
+from app.services import enrichment, enrichment_v2
+from app.services.pipeline_orchestrator import run_pipeline_stages
+
+
+class FakeCompaniesHouseClient:
+    """Stands in for AsyncCompaniesHouseClient; every company has one director."""
+
+    def __init__(self, api_key: str):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return None
+
+    async def fetch_company(self, company_number: str):
+        profile = {"company_status": "active", "type": "ltd", "date_of_creation": "2020-01-01"}
+        officers = [{"name": "SMITH, John", "officer_role": "director"}]
+        return profile, [], officers
+
+
+class EnrichmentChainTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        # Both stages keep caches and checkpoints under outputs/ relative to cwd
+        os.chdir(self._tmp.name)
+        Path("outputs/enriched").mkdir(parents=True)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def test_enrich_then_enrich_v2(self):
+        dataset = Path("dataset.parquet")
+        pl.DataFrame({
+            "CompanyNumber": ["00000001", "00000002"],
+            "BusinessName": ["Acme Ltd", "Widgets Ltd"],
+            "Postcode": ["ME1 1AA", "CT1 2BB"],
+            "County": ["Kent", "Kent"],
+            "AddressLine1": ["1 High St", "2 Low St"],
+            "AddressLine2": ["", ""],
+            "Town": ["Rochester", "Canterbury"],
+        }).write_parquet(dataset)
+
+        queries = []
+
+        async def fake_serper(http, limiter, query):
+            queries.append(query)
+            return {"organic": []}
+
+        with mock.patch.object(enrichment, "API_KEY", "test"), \
+                mock.patch.object(enrichment, "USE_ASYNC_CLIENT", True), \
+                mock.patch.object(enrichment, "AsyncCompaniesHouseClient", FakeCompaniesHouseClient), \
+                mock.patch.object(enrichment_v2, "OPENAI_API_KEY", "test"), \
+                mock.patch.object(enrichment_v2, "call_serper", fake_serper), \
+                mock.patch("app.services.pipeline_orchestrator.execute_pipeline",
+                           return_value={"current_dataset": str(dataset)}):
+            results = run_pipeline_stages(
+                sic_codes=["62012"],
+                enrich_v2=True,
+                enrich_output_path="outputs/enriched/d.parquet",
+                enrich_v2_output_path="outputs/enriched/d2.parquet",
+            )
+
+        d1 = pl.read_parquet(results["enrichment"]["output_file"])
+        self.assertIn("Company Number", d1.columns)
+
+        d2 = pl.read_parquet(results["enrichment_v2"]["output_file"])
+        self.assertEqual(sorted(d2["CompanyNumber"]), ["00000001", "00000002"])
+        self.assertEqual(d2["Fname"].to_list(), ["John", "John"])
+        self.assertIn("ConfidenceScore", d2.columns)
+        # D2 searched with D's business names, not blanks from missing columns
+        self.assertTrue(any(q.startswith("Acme Ltd Rochester ME1 1AA") for q in queries))
+
+
+if __name__ == "__main__":
+    unittest.main()